@@ -0,0 +1,75 @@
+# Online migration of file metadata from the embedded 'files' array of 'clusters-data'
+# to the normalized 'files-data' collection.
+#
+# Safe to run while the server is serving and safe to re-run: every document is upserted
+# on its natural key with $setOnInsert, so entries already written by the server are kept.
+# Usage: python -m api.mongodb.migrate_files [--batch-size N] [--drop-embedded]
+
+import argparse
+from pymongo import UpdateOne
+from api.mongodb.mongodb_drive import DriveMongo
+from api.mongodb.mongodb_pool import get_client, close_client
+from utils.config import config
+
+
+def file_key(cluster_id, file):
+    if file.get("is_folder"):
+        return {"cluster_id": cluster_id, "locate_media": file.get("locate_media"), "is_folder": True}
+    return {"cluster_id": cluster_id, "id_message": str(file.get("id_message")), "is_folder": False}
+
+
+def migrate_cluster(clusters_collection, files_collection, cluster_id, batch_size):
+    # Stream the array with $unwind instead of loading the whole document
+    cursor = clusters_collection.aggregate([
+        {"$match": {"cluster_id": cluster_id}},
+        {"$unwind": "$files"},
+        {"$replaceRoot": {"newRoot": "$files"}}
+    ], batchSize=batch_size)
+
+    migrated = 0
+    batch = []
+    for file in cursor:
+        file["cluster_id"] = cluster_id
+        if not file.get("is_folder"):
+            file["id_message"] = str(file.get("id_message"))
+        batch.append(UpdateOne(file_key(cluster_id, file), {"$setOnInsert": file}, upsert=True))
+        if len(batch) >= batch_size:
+            files_collection.bulk_write(batch, ordered=False)
+            migrated += len(batch)
+            batch = []
+    if batch:
+        files_collection.bulk_write(batch, ordered=False)
+        migrated += len(batch)
+    return migrated
+
+
+def migrate(batch_size=500, drop_embedded=False):
+    db = get_client()[config.NAME_CLUSTER]
+
+    drive = DriveMongo()
+    drive.clusters_collection = db["clusters-data"]
+    drive.files_collection = db["files-data"]
+    drive.upload_sessions_collection = db["upload-sessions"]
+    drive.ensure_indexes()
+
+    for cluster in drive.clusters_collection.find({"files.0": {"$exists": True}},
+                                                  {"cluster_id": 1, "cluster_name": 1, "_id": 0}):
+        cluster_id = int(cluster["cluster_id"])
+        migrated = migrate_cluster(drive.clusters_collection, drive.files_collection, cluster_id, batch_size)
+        print(f"[INFO] Cluster {cluster.get('cluster_name')} ({cluster_id}): {migrated} entries migrated")
+
+        if drop_embedded:
+            drive.clusters_collection.update_one({"cluster_id": cluster["cluster_id"]}, {"$unset": {"files": ""}})
+            print(f"[INFO] Cluster {cluster.get('cluster_name')} ({cluster_id}): embedded array removed")
+
+    close_client()
+    print("[INFO] Migration completed")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move embedded file metadata to the 'files-data' collection")
+    parser.add_argument("--batch-size", type=int, default=config.SYNC_BATCH_SIZE)
+    parser.add_argument("--drop-embedded", action="store_true",
+                        help="remove the embedded 'files' array once a cluster is migrated")
+    args = parser.parse_args()
+    migrate(args.batch_size, args.drop_embedded)
@@ -0,0 +1,93 @@
+import asyncio
+from pymongo import UpdateOne, DeleteOne
+
+from api.mongodb.mongodb_executor import run_sync
+
+# Fields an edit in telegram may change. Name, location and date are owned by the drive (renames,
+# moves and trashing only happen in mongodb), so edits never overwrite them.
+TELEGRAM_FIELDS = ("message_text", "media_size", "media_type", "location")
+
+
+# Batched, debounced writer applying live telegram changes to 'files-data'.
+# Changes are keyed by (cluster_id, id_message), so a burst of edits to the same message
+# collapses into one write. New messages only insert (a record that already exists keeps the
+# name / location the drive gave it); edits made in telegram update the TELEGRAM_FIELDS of the
+# record, the other fields are only written if the record does not exist yet.
+# Pending changes are flushed `delay` seconds after the first one, or as soon as `max_batch`
+# accumulate, with a single unordered bulk_write.
+class ChangeWriter:
+    def __init__(self, files_collection, delay, max_batch):
+        self.files_collection = files_collection
+        self.delay = delay
+        self.max_batch = max_batch
+        self.pending = {}
+        self._full = asyncio.Event()
+        self._task = None
+
+    @staticmethod
+    def key(cluster_id, id_message):
+        return int(cluster_id), str(id_message)
+
+    def insert(self, document):
+        key = self.key(document["cluster_id"], document["id_message"])
+        if key not in self.pending:
+            self.pending[key] = ("insert", document)
+        self.__schedule()
+
+    # The document is rebuilt from the edited message
+    def update(self, document):
+        self.pending[self.key(document["cluster_id"], document["id_message"])] = ("update", document)
+        self.__schedule()
+
+    def delete(self, cluster_id, id_messages):
+        for id_message in id_messages:
+            self.pending[self.key(cluster_id, id_message)] = ("delete", None)
+        self.__schedule()
+
+    def __schedule(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.__run())
+        if len(self.pending) >= self.max_batch:
+            self._full.set()
+
+    async def __run(self):
+        while self.pending:
+            try:
+                await asyncio.wait_for(self._full.wait(), self.delay)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            await self.flush()
+
+    async def flush(self):
+        batch, self.pending = self.pending, {}
+        if not batch:
+            return 0
+        operations = []
+        for (cluster_id, id_message), (operation, document) in batch.items():
+            key = {"cluster_id": cluster_id, "id_message": id_message, "is_folder": False}
+            if operation == "delete":
+                operations.append(DeleteOne(key))
+            elif operation == "update":
+                owned = {k: v for k, v in document.items() if k in TELEGRAM_FIELDS}
+                rest = {k: v for k, v in document.items() if k not in TELEGRAM_FIELDS}
+                operations.append(UpdateOne(key, {"$set": owned, "$setOnInsert": rest}, upsert=True))
+            else:
+                operations.append(UpdateOne(key, {"$setOnInsert": document}, upsert=True))
+        try:
+            await run_sync(self.files_collection.bulk_write, operations, ordered=False)
+            return len(operations)
+        except Exception as e:
+            # Keep the failed changes unless newer ones arrived meanwhile; retried on the next flush
+            print(f"[WARNING] Error applying {len(operations)} live changes: {e}")
+            for key, change in batch.items():
+                self.pending.setdefault(key, change)
+            return 0
+
+    # Write what is pending and stop
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
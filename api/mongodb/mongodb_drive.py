@@ -1,115 +1,282 @@
+import asyncio
 import os
 import re
+import time
+from pymongo import UpdateOne, ASCENDING, ReturnDocument
 from pymongo.errors import ConnectionFailure
-from pymongo.mongo_client import MongoClient
-from pymongo.server_api import ServerApi
-from datetime import datetime
+from telethon.errors import FloodWaitError
+from datetime import datetime, timezone
 
+from api.mongodb.mongodb_change_writer import ChangeWriter
+from api.mongodb.mongodb_executor import run_sync, find_all
+from api.mongodb.mongodb_pool import get_client
 from utils.config import config
+from utils.id_bitmap import IdBitmap
 from utils.response_handler import success, error
 
 VALID_FILE_NAME_REGEX = r'^[\w\-.]+$'
 
 
+# Build the file document stored in mongodb from a telegram Media object
+def media_to_file_document(file, cluster_id):
+    return {
+        "cluster_id": int(cluster_id),
+        "id_message": file.get_id_message(),
+        "media_name": file.get_media_name(),
+        "locate_media": file.get_locate_media(),
+        "media_size": file.get_media_size(),
+        "media_type": file.get_media_type(),
+        "message_text": file.get_message_text(),
+        "date": file.get_date(),
+        "location": file.get_location(),
+        "is_folder": False
+    }
+
+
+# File records returned to callers: without the telegram location (internal, and not JSON)
+FILE_PROJECTION = {"_id": 0, "location": 0}
+
+
+# Anchored prefix regex -- can use the (cluster_id, locate_media, is_folder) index
+def prefix_regex(path):
+    return {"$regex": "^" + re.escape(path)}
+
+
 class DriveMongo:
     def __init__(self):
         self.url_mongo = None
         self.client = None
         self.db = None
         self.clusters_collection = None
+        self.files_collection = None
         self.users_collection = None
+        self.upload_sessions_collection = None
+        self.changes = None
+        self.sync_progress = {}
         self.base_directory = "./"
         self.trash_directory = self.base_directory + "trash"
 
     # Init database
     def initialize_indexes(self):
 
-        confirmation = input("Type 'CONFIRM' to initialize 'cluster-data': ")
+        confirmation = input("Type 'CONFIRM' to initialize 'cluster-data' and 'files-data': ")
         if confirmation != 'CONFIRM':
             print("[INFO] Initialization cancelled")
             return
 
         self.clusters_collection.drop()
+        self.files_collection.drop()
 
         # INIT CLUSTER DATA
         self.clusters_collection.create_index("cluster_name")
         self.clusters_collection.create_index("cluster_id", unique=True)
-        self.clusters_collection.create_index("files.is_folder")
-        self.clusters_collection.create_index("files.id_message")
-        self.clusters_collection.create_index("files.media_name")
-        self.clusters_collection.create_index("files.locate_media")
-        self.clusters_collection.create_index("files.media_size")
-        self.clusters_collection.create_index("files.media_type")
-        self.clusters_collection.create_index("files.date")
+        self.ensure_indexes()
 
         print("[INFO] Initialization 'cluster-data' completed")
 
+    # Indexes of the files collection -- create_index is a no-op when they already exist
+    def ensure_indexes(self):
+        self.files_collection.create_index(
+            [("cluster_id", ASCENDING), ("id_message", ASCENDING)],
+            unique=True,
+            partialFilterExpression={"is_folder": False}
+        )
+        self.files_collection.create_index(
+            [("cluster_id", ASCENDING), ("locate_media", ASCENDING), ("is_folder", ASCENDING)]
+        )
+        # Resumable upload sessions are removed by mongodb once expired
+        self.upload_sessions_collection.create_index("session_id", unique=True)
+        self.upload_sessions_collection.create_index("expires_at", expireAfterSeconds=0)
+
     # Sync data mongo_db -- telegram drive
-    async def sync_data(self, layer):
-        try:
-            for cluster_name in layer.get_clusters_info():
-                print(cluster_name)
-                n = await layer.get_chat_id_by_name(cluster_name)
-                # print(n)
-                if n["status"] == "error":
-                    return error(n["message"])
-
-                cluster_id = n["data"]
-
-                # Check if the cluster_id already exists in the database
-                existing_cluster = self.clusters_collection.find_one({"cluster_id": cluster_id})
-                if not existing_cluster:
-                    print(f"[INFO] Creating cluster {cluster_name} with ID {cluster_id} in the database.")
-                    # Insert new cluster if it does not exist
-                    new_cluster = {
-                        "cluster_id": cluster_id,
-                        "cluster_name": cluster_name,
-                        "files": []
-                    }
-                    self.clusters_collection.insert_one(new_cluster)
-
-                r = await layer.get_all_file_by_cluster_id(cluster_name)
-                if r["status"] == "error":
-                    raise Exception(r['message'])
-
-                for file in r["data"]:
-                    # print(file)
-                    #print(self.__get_file_by_id(file.get_id_message()))
-                    if self.__get_file_by_id(file.get_id_message(), cluster_name) is None:
-                        # Media not found in mongodb --> add media
-
-                        # Create the new file document
-                        new_file = {
-                            "id_message": file.get_id_message(),
-                            "media_name": file.get_media_name(),
-                            "locate_media": file.get_locate_media(),
-                            "media_size": file.get_media_size(),
-                            "media_type": file.get_media_type(),
-                            "message_text": file.get_message_text(),
-                            "date": file.get_date(),
-                            "is_folder": False
-                        }
-
-                        # Find the cluster and add the new file to the files array
-                        self.clusters_collection.update_one(
-                            {"cluster_name": cluster_name},
-                            {"$push": {"files": new_file}}
-                        )
-
-                        print("[INFO] Media file added successfully")
-
-            return success("Successfully sync data", None)
-        except Exception as e:
-            return error(f"Error sync data telegram-mongodb {e}")
+    # Clusters are synced concurrently, at most config.SYNC_CONCURRENCY at a time. A FloodWait
+    # pauses every cluster until it expires, then the cluster is retried (config.SYNC_FLOOD_RETRIES
+    # times). A failing cluster is reported in its own entry and does not stop the others.
+    # reconcile="delete" / "flag" also removes or flags files whose message is gone (see reconcile_cluster).
+    async def sync_data(self, layer, full=False, reconcile=None):
+        report = {}
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(config.SYNC_CONCURRENCY)
+        resume_at = [0.0]
+        clusters = list(layer.get_clusters_info())
+        self.sync_progress = {cluster_name: "pending" for cluster_name in clusters}
+
+        async def run(cluster_name):
+            async with semaphore:
+                for _ in range(config.SYNC_FLOOD_RETRIES + 1):
+                    delay = resume_at[0] - loop.time()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    self.sync_progress[cluster_name] = "running"
+                    try:
+                        report[cluster_name] = await self.sync_cluster(layer, cluster_name, full, reconcile)
+                        self.sync_progress[cluster_name] = "done"
+                        print(f"[INFO] Synced {cluster_name}: {report[cluster_name]}")
+                        return
+                    except FloodWaitError as e:
+                        resume_at[0] = max(resume_at[0], loop.time() + e.seconds)
+                        self.sync_progress[cluster_name] = "flood_wait"
+                        print(f"[WARNING] FloodWait of {e.seconds}s while syncing {cluster_name}")
+                        failure = f"FloodWait of {e.seconds}s"
+                    except Exception as e:
+                        failure = str(e)
+                        break
+                self.sync_progress[cluster_name] = "error"
+                report[cluster_name] = {"status": "error", "message": f"Error sync data telegram-mongodb {failure}"}
+                print(f"[ERROR] Sync of {cluster_name} failed: {failure}")
+
+        await asyncio.gather(*(run(cluster_name) for cluster_name in clusters))
+        # 'partial' when only some clusters failed; the report has the status of each one
+        failed = [name for name, r in report.items() if r["status"] == "error"]
+        if failed and len(failed) == len(clusters):
+            return {"status": "error", "message": f"Sync failed in every cluster ({len(failed)})", "data": report}
+        if failed:
+            return {"status": "partial",
+                    "message": f"Sync completed with errors in {len(failed)} of {len(clusters)} clusters",
+                    "data": report}
+        return success("Successfully sync data", report)
+
+    # Sync one cluster
+    # Incremental by default: only messages newer than the cluster watermark (last_message_id)
+    # are read from telegram. full=True re-reads the whole history to reconcile.
+    # Known ids are loaded once per cluster and new files are written in batches of
+    # config.SYNC_BATCH_SIZE with bulk_write. Returns counts and timings.
+    async def sync_cluster(self, layer, cluster_name, full=False, reconcile=None):
+        started = time.perf_counter()
+        n = await layer.get_chat_id_by_name(cluster_name)
+        # print(n)
+        if n["status"] == "error":
+            raise Exception(n["message"])
+
+        cluster_id = int(n["data"])
+
+        # Check if the cluster_id already exists in the database
+        existing_cluster = await run_sync(
+            self.clusters_collection.find_one,
+            {"cluster_id": cluster_id},
+            {"last_message_id": 1, "_id": 0}
+        )
+        if not existing_cluster:
+            print(f"[INFO] Creating cluster {cluster_name} with ID {cluster_id} in the database.")
+            # Insert new cluster if it does not exist
+            existing_cluster = {
+                "cluster_id": cluster_id,
+                "cluster_name": cluster_name,
+                "last_message_id": 0
+            }
+            await run_sync(self.clusters_collection.insert_one, dict(existing_cluster))
+
+        # Known ids -- covered by the (cluster_id, id_message) index
+        known_ids = {
+            str(f["id_message"]) for f in await find_all(
+                self.files_collection,
+                {"cluster_id": cluster_id, "is_folder": False},
+                {"id_message": 1, "_id": 0}
+            )
+        }
+        watermark = 0 if full else int(existing_cluster.get("last_message_id", 0))
+
+        r = await layer.get_all_file_by_cluster_id(cluster_name, watermark)
+        if r["status"] == "error":
+            raise Exception(r['message'])
+        fetched = time.perf_counter()
+
+        # Diff in memory
+        last_message_id = watermark
+        new_files = []
+        for file in r["data"]:
+            last_message_id = max(last_message_id, int(file.get_id_message()))
+            if str(file.get_id_message()) not in known_ids:
+                known_ids.add(str(file.get_id_message()))
+                new_files.append(media_to_file_document(file, cluster_id))
+
+        # Upsert on the natural key so concurrent writers never duplicate a file
+        batch_size = config.SYNC_BATCH_SIZE
+        batches = 0
+        for i in range(0, len(new_files), batch_size):
+            await run_sync(self.files_collection.bulk_write, [
+                UpdateOne({"cluster_id": cluster_id, "id_message": f["id_message"], "is_folder": False},
+                          {"$setOnInsert": f}, upsert=True)
+                for f in new_files[i:i + batch_size]
+            ], ordered=False)
+            batches += 1
+
+        # Persist the watermark only once every file up to it is stored
+        await run_sync(
+            self.clusters_collection.update_one,
+            {"cluster_id": cluster_id},
+            {"$max": {"last_message_id": last_message_id}}
+        )
+        written = time.perf_counter()
+
+        report = {
+            "status": "success",
+            "cluster_id": cluster_id,
+            "scanned": len(r["data"]),
+            "inserted": len(new_files),
+            "batches": batches,
+            "fetch_seconds": round(fetched - started, 3),
+            "write_seconds": round(written - fetched, 3),
+            "total_seconds": round(written - started, 3)
+        }
+        if reconcile:
+            report["orphans"] = await self.reconcile_cluster(layer, cluster_name, cluster_id, reconcile)
+            report["total_seconds"] = round(time.perf_counter() - started, 3)
+        return report
+
+    # Stored file ids of a cluster, up to upper, that are not in present -- runs in the executor and
+    # streams the cursor, so only the orphans are held in memory
+    def __find_orphans(self, cluster_id, present, upper):
+        orphans = []
+        cursor = self.files_collection.find(
+            {"cluster_id": cluster_id, "is_folder": False},
+            {"id_message": 1, "_id": 0}
+        ).batch_size(config.SYNC_BATCH_SIZE)
+        for f in cursor:
+            message_id = int(f["id_message"])
+            if message_id <= upper and message_id not in present:
+                orphans.append(f["id_message"])
+        return orphans
+
+    # Deletion reconcile of one cluster: the ids of its file messages are streamed into a bitmap
+    # (memory proportional to the id range, no message is kept) and compared with the stored ids.
+    # Orphans are deleted (mode "delete") or marked orphaned: True (mode "flag") in bulk.
+    # Files newer than the scan start are left alone. Returns the number of orphans.
+    async def reconcile_cluster(self, layer, cluster_name, cluster_id, mode):
+        r = await layer.get_last_message_id(cluster_name)
+        if r["status"] == "error":
+            raise Exception(r["message"])
+        upper = r["data"]
+
+        present = IdBitmap(upper)
+        async for message_id in layer.iter_file_ids(cluster_name, upper):
+            present.add(message_id)
+
+        orphans = await run_sync(self.__find_orphans, cluster_id, present, upper)
+        batch_size = config.SYNC_BATCH_SIZE
+        for i in range(0, len(orphans), batch_size):
+            query = {"cluster_id": cluster_id, "is_folder": False, "id_message": {"$in": orphans[i:i + batch_size]}}
+            if mode == "flag":
+                await run_sync(self.files_collection.update_many, query, {"$set": {"orphaned": True}})
+            else:
+                await run_sync(self.files_collection.delete_many, query)
+        if orphans:
+            print(f"[INFO] Reconciled {cluster_name}: {len(orphans)} orphans ({mode})")
+        return len(orphans)
 
     @classmethod
     async def create(cls, url, init):
         instance = cls()
         try:
-            instance.client = MongoClient(url, server_api=ServerApi('1'))
+            instance.url_mongo = url
+            instance.client = get_client(url)
             instance.db = instance.client[config.NAME_CLUSTER]
             instance.users_collection = instance.db["user-data"]
             instance.clusters_collection = instance.db["clusters-data"]
+            instance.files_collection = instance.db["files-data"]
+            instance.upload_sessions_collection = instance.db["upload-sessions"]
+            instance.changes = ChangeWriter(instance.files_collection, config.CHANGE_FLUSH_DELAY,
+                                            config.SYNC_BATCH_SIZE)
 
             print("[INFO] Connected to MongoDB")
 
@@ -118,6 +285,8 @@ class DriveMongo:
                     instance.initialize_indexes()
                 except Exception as e:
                     print(f"[INFO] Error initializing database {e}")
+            else:
+                await run_sync(instance.ensure_indexes)
 
         except ConnectionFailure as e:
             print(f"[ERROR] Could not connect to MongoDB: {e}")
@@ -125,34 +294,31 @@ class DriveMongo:
         return instance
 
     # Get all discord_id
-    def get_users_discord_id(self):
-        cursor = self.users_collection.find({}, {"discord_id": 1, "_id": 0})
+    async def get_users_discord_id(self):
+        cursor = await find_all(self.users_collection, {}, {"discord_id": 1, "_id": 0})
         discord_ids = [user['discord_id'] for user in cursor if 'discord_id' in user]
         return discord_ids
 
-    # Get file by name and id
-    def __get_file_by_id(self, file_id, cluster_name):
-        result = self.clusters_collection.find_one(
-            {"cluster_name": cluster_name, "files.id_message": file_id},
-            {"files.$": 1}
-        )
-        return result["files"][0] if result else None
-
     # PUBLIC METHOD
 
+    # cluster_name -> cluster_id of the clusters synced so far
+    async def get_clusters_info(self):
+        clusters = await find_all(self.clusters_collection, {}, {"cluster_name": 1, "cluster_id": 1, "_id": 0})
+        return {c["cluster_name"]: str(c["cluster_id"]) for c in clusters if "cluster_name" in c}
+
     def get_trash_path(self):
         return self.trash_directory
 
     # Get file by id
     async def get_file_by_id(self, cluster_id, id_message):
         try:
-            cluster = self.clusters_collection.find_one({"cluster_id": cluster_id})
-            if not cluster:
-                return error(f"Cluster with ID {cluster_id} not found")
-
-            for file in cluster.get("files", []):
-                if int(file.get("id_message")) == int(id_message):
-                    return success("File found", file)
+            file = await run_sync(
+                self.files_collection.find_one,
+                {"cluster_id": int(cluster_id), "id_message": str(id_message), "is_folder": False},
+                FILE_PROJECTION
+            )
+            if file:
+                return success("File found", file)
 
             return error("File not found")
 
@@ -161,55 +327,87 @@ class DriveMongo:
 
     async def get_all_files_by_cluster_id(self, cluster_id):
         try:
-            result = self.clusters_collection.find_one(
-                {"cluster_id": cluster_id},
-                {"files": 1, "_id": 0}
+            files = await find_all(
+                self.files_collection,
+                {"cluster_id": int(cluster_id), "locate_media": {"$ne": self.trash_directory}},
+                FILE_PROJECTION
             )
-            if result and "files" in result:
-                files = [file for file in result["files"] if file.get("locate_media") != "./trash"]
-                if files:
-                    for file in files:
-                        file["cluster_id"] = cluster_id
-                    return success("Get all files successfully", files)
-                else:
-                    return error("No files found after filtering")
+            if files:
+                return success("Get all files successfully", files)
             else:
-                return error("Cluster does not exist or no files found")
+                return error("No files found after filtering")
         except Exception as e:
             return error(f"Error retrieving files for cluster {cluster_id}: {e}")
 
     async def get_all_files_trashed(self, cluster_id):
         try:
-            result = self.clusters_collection.find_one(
-                {"cluster_id": cluster_id},
-                {"files": 1, "_id": 0}
+            trashed_files = await find_all(
+                self.files_collection,
+                {"cluster_id": int(cluster_id), "locate_media": self.trash_directory},
+                FILE_PROJECTION
             )
-            if result and "files" in result:
-                trashed_files = [file for file in result["files"] if file.get("locate_media") == "./trash"]
-                if trashed_files:
-                    for file in trashed_files:
-                        file["cluster_id"] = cluster_id
-
-                return success("Get all trashed files successfully", trashed_files)
-
-            else:
-                return error("Cluster does not exist or no files found")
+            return success("Get all trashed files successfully", trashed_files)
         except Exception as e:
             return error(f"Error retrieving trashed files for cluster {cluster_id}: {e}")
 
+    # Insert the record of a file just sent to telegram (a Media object)
+    # Same upsert as sync_data, so a later sync or a duplicate call never duplicates it
+    async def insert_file(self, file, cluster_id):
+        try:
+            document = media_to_file_document(file, cluster_id)
+            await run_sync(
+                self.files_collection.update_one,
+                {"cluster_id": document["cluster_id"], "id_message": document["id_message"], "is_folder": False},
+                {"$setOnInsert": document},
+                upsert=True
+            )
+            document.pop("location", None)
+            return success("File inserted successfully", document)
+        except Exception as e:
+            return error(f"Error inserting file: {e}")
+
+    # Telegram location of a file (see Media.get_location), None for records written before it
+    # was stored
+    async def get_file_location(self, cluster_id, id_message):
+        file = await run_sync(
+            self.files_collection.find_one,
+            {"cluster_id": int(cluster_id), "id_message": str(id_message), "is_folder": False},
+            {"location": 1, "_id": 0}
+        )
+        return file.get("location") if file else None
+
+    # Store a fresh location -- after a file reference expired, or for older records
+    async def set_file_location(self, cluster_id, id_message, location):
+        await run_sync(
+            self.files_collection.update_one,
+            {"cluster_id": int(cluster_id), "id_message": str(id_message), "is_folder": False},
+            {"$set": {"location": location}}
+        )
+
+    # Live telegram changes, written in batches by the change writer
+    def file_changed(self, file, cluster_id, edited=False):
+        document = media_to_file_document(file, cluster_id)
+        if edited:
+            self.changes.update(document)
+        else:
+            self.changes.insert(document)
+
+    def files_deleted(self, cluster_id, id_messages):
+        self.changes.delete(cluster_id, id_messages)
+
     # Delete file from database
     async def delete_file(self, cluster_id, file_id):
         try:
-            result = self.clusters_collection.update_one(
-                {"cluster_id": int(cluster_id)},
-                {"$pull": {"files": {"id_message": str(file_id)}}}
+            result = await run_sync(
+                self.files_collection.delete_one,
+                {"cluster_id": int(cluster_id), "id_message": str(file_id), "is_folder": False}
             )
-            if result.modified_count > 0:
+            if result.deleted_count > 0:
                 return success("File deleted successfully", None)
             else:
                 return error("File not found")
         except Exception as e:
-            error(f"An error occurred while deleting the file: {e}")
+            return error(f"An error occurred while deleting the file: {e}")
 
     # Method to update file name and date
     async def update_file_name(self, cluster_id, file_id, new_name):
@@ -223,11 +421,12 @@ class DriveMongo:
             current_date = datetime.utcnow()
 
             # Update the file name and date
-            result = self.clusters_collection.update_one(
-                {"cluster_id": int(cluster_id), "files.id_message": str(file_id)},
+            result = await run_sync(
+                self.files_collection.update_one,
+                {"cluster_id": int(cluster_id), "id_message": str(file_id), "is_folder": False},
                 {"$set": {
-                    "files.$.media_name": new_name,
-                    "files.$.date": current_date
+                    "media_name": new_name,
+                    "date": current_date
                 }}
             )
             if result.matched_count > 0:
@@ -240,10 +439,11 @@ class DriveMongo:
     # Method to update file location
     async def update_file_location(self, cluster_id, file_id, new_location):
         try:
-            result = self.clusters_collection.update_one(
-                {"cluster_id": int(cluster_id), "files.id_message": str(file_id)},
+            result = await run_sync(
+                self.files_collection.update_one,
+                {"cluster_id": int(cluster_id), "id_message": str(file_id), "is_folder": False},
                 {"$set": {
-                    "files.$.locate_media": new_location
+                    "locate_media": new_location
                 }}
             )
             if result.matched_count > 0:
@@ -251,7 +451,7 @@ class DriveMongo:
             else:
                 return error("File not found")
         except Exception as e:
-            error(f"An error occurred while updating the file location: {e}")
+            return error(f"An error occurred while updating the file location: {e}")
 
     # Trash file -- not delete
     async def trash_file(self, cluster_id, file_id):
@@ -259,14 +459,20 @@ class DriveMongo:
 
     async def create_folder(self, cluster_id, path_folder):
         try:
-            existing_folder = self.clusters_collection.find_one(
-                {"cluster_id": cluster_id, "files.locate_media": path_folder, "files.is_folder": True}
+            if not await run_sync(self.clusters_collection.find_one, {"cluster_id": int(cluster_id)}, {"_id": 1}):
+                return error("Cluster not found")
+
+            existing_folder = await run_sync(
+                self.files_collection.find_one,
+                {"cluster_id": int(cluster_id), "locate_media": path_folder, "is_folder": True},
+                {"_id": 1}
             )
 
             if existing_folder:
                 return error("A folder with the same name already exists")
 
             file_data = {
+                "cluster_id": int(cluster_id),
                 "id_message": -1,
                 "media_name": "None",
                 "locate_media": path_folder,
@@ -277,15 +483,8 @@ class DriveMongo:
                 "is_folder": True
             }
 
-            result = self.clusters_collection.update_one(
-                {"cluster_id": cluster_id},
-                {"$push": {"files": file_data}}
-            )
-
-            if result.modified_count > 0:
-                return success("Folder created successfully", None)
-            else:
-                return error("Cluster not found")
+            await run_sync(self.files_collection.insert_one, file_data)
+            return success("Folder created successfully", None)
 
         except Exception as e:
             return error(f"An error occurred while inserting the folder: {e}")
@@ -293,11 +492,11 @@ class DriveMongo:
     # Delete folder
     async def delete_folder(self, cluster_id, path_folder):
         try:
-            result = self.clusters_collection.update_one(
-                {"cluster_id": cluster_id},
-                {"$pull": {"files": {"locate_media": path_folder, "is_folder": True}}}
+            result = await run_sync(
+                self.files_collection.delete_one,
+                {"cluster_id": int(cluster_id), "locate_media": path_folder, "is_folder": True}
             )
-            if result.modified_count > 0:
+            if result.deleted_count > 0:
                 return success("Folder deleted successfully", None)
             else:
                 return error("Cluster not found or folder not deleted")
@@ -307,8 +506,10 @@ class DriveMongo:
     # Rename folder
     async def rename_folder(self, cluster_id, old_path_folder, new_name):
         try:
-            existing_folder = self.clusters_collection.find_one(
-                {"cluster_id": cluster_id, "files.locate_media": old_path_folder, "files.is_folder": True}
+            existing_folder = await run_sync(
+                self.files_collection.find_one,
+                {"cluster_id": int(cluster_id), "locate_media": old_path_folder, "is_folder": True},
+                {"_id": 1}
             )
 
             if not existing_folder:
@@ -317,16 +518,19 @@ class DriveMongo:
             base_path = os.path.dirname(old_path_folder)
             new_path_folder = os.path.join(base_path, new_name)
 
-            duplicate_folder = self.clusters_collection.find_one(
-                {"cluster_id": cluster_id, "files.locate_media": new_path_folder, "files.is_folder": True}
+            duplicate_folder = await run_sync(
+                self.files_collection.find_one,
+                {"cluster_id": int(cluster_id), "locate_media": new_path_folder, "is_folder": True},
+                {"_id": 1}
             )
 
             if duplicate_folder:
                 return error("A folder with the same name already exists at the new location")
 
-            result = self.clusters_collection.update_one(
-                {"cluster_id": cluster_id, "files.locate_media": old_path_folder, "files.is_folder": True},
-                {"$set": {"files.$.locate_media": new_path_folder}}
+            result = await run_sync(
+                self.files_collection.update_one,
+                {"_id": existing_folder["_id"]},
+                {"$set": {"locate_media": new_path_folder}}
             )
 
             if result.modified_count > 0:
@@ -340,69 +544,123 @@ class DriveMongo:
     # Get all folders by cluster_id
     async def get_all_folders_by_cluster_id(self, cluster_id):
         try:
-            result = self.clusters_collection.find_one(
-                {"cluster_id": cluster_id},
-                {"files": 1, "_id": 0}
+            folders = await find_all(
+                self.files_collection,
+                {"cluster_id": int(cluster_id), "is_folder": True},
+                {"_id": 0}
             )
-            if result and "files" in result:
-                folders = [file for file in result["files"] if file["is_folder"]]
-                return success("Get all folders successfully", folders)
-            else:
-                return error("Cluster does not exist or no folders found")
+            return success("Get all folders successfully", folders)
         except Exception as e:
             return error(f"Error retrieving folders for cluster {cluster_id}: {e}")
 
     # Get all files in a specific folder excluding subfolders
     async def get_files_in_folder(self, cluster_id, folder_path):
         try:
-            result = self.clusters_collection.find_one(
-                {"cluster_id": cluster_id},
-                {"files": 1, "_id": 0}
+            files = await find_all(
+                self.files_collection,
+                {"cluster_id": int(cluster_id), "locate_media": folder_path, "is_folder": False},
+                FILE_PROJECTION
             )
-            if result and "files" in result:
-                files = [file for file in result["files"]
-                         if not file["is_folder"] and file["locate_media"] == folder_path]
-                return success("Get all files in folder successfully", files)
-            else:
-                return error("Cluster or folder does not exist or no files found")
+            return success("Get all files in folder successfully", files)
         except Exception as e:
             return error(f"Error retrieving files for folder {folder_path}: {e}")
 
     # Get all files in a specific folder including files in subfolders
     async def get_files_in_folder_including_subfolders(self, cluster_id, folder_path):
         try:
-            result = self.clusters_collection.find_one(
-                {"cluster_id": cluster_id},
-                {"files": 1, "_id": 0}
+            files = await find_all(
+                self.files_collection,
+                {"cluster_id": int(cluster_id), "locate_media": prefix_regex(folder_path), "is_folder": False},
+                FILE_PROJECTION
             )
-            if result and "files" in result:
-                files = [file for file in result["files"]
-                         if not file["is_folder"] and file["locate_media"].startswith(folder_path)]
-                return success("Get all files in folder including subfolders successfully", files)
-            else:
-                return error("Cluster or folder does not exist or no files found")
+            return success("Get all files in folder including subfolders successfully", files)
         except Exception as e:
             return error(f"Error retrieving files for folder {folder_path} including subfolders: {e}")
 
     # Verifica se una cartella ha sottocartelle
     async def has_subfolders(self, cluster_id, folder_path):
         try:
-            result = self.clusters_collection.find_one(
-                {"cluster_id": cluster_id},
-                {"files": 1, "_id": 0}
+            locate = prefix_regex(folder_path.rstrip('/') + '/')
+            locate["$ne"] = folder_path
+            subfolder = await run_sync(
+                self.files_collection.find_one,
+                {"cluster_id": int(cluster_id), "locate_media": locate, "is_folder": True},
+                {"_id": 1}
             )
-            if result and "files" in result:
-                subfolders = [
-                    file for file in result["files"]
-                    if file["is_folder"] and
-                       file["locate_media"].startswith(folder_path.rstrip('/') + '/') and
-                       file["locate_media"] != folder_path
-                ]
-                if subfolders:
-                    return success("Subfolders found", True)
-                else:
-                    return success("Any Subfolders found", False)
+            if subfolder:
+                return success("Subfolders found", True)
             else:
-                return error("Cluster or folder does not exist or no files found")
+                return success("Any Subfolders found", False)
+        except Exception as e:
+            return error(f"Error retrieving files for folder {folder_path} including subfolders: {e}")
+
+    # RESUMABLE UPLOAD SESSIONS
+    # The TTL monitor only runs every minute, so expiry is also checked on read
+
+    async def create_upload_session(self, session):
+        try:
+            await run_sync(self.upload_sessions_collection.insert_one, dict(session))
+            return success("Upload session created", session)
+        except Exception as e:
+            return error(f"Error creating upload session: {e}")
+
+    async def get_upload_session(self, session_id, owner):
+        try:
+            session = await run_sync(
+                self.upload_sessions_collection.find_one,
+                {"session_id": session_id, "owner": owner, "expires_at": {"$gt": datetime.now(timezone.utc)}},
+                {"_id": 0}
+            )
+            if session:
+                return success("Upload session found", session)
+            return error("Upload session not found or expired")
+        except Exception as e:
+            return error(f"Error retrieving upload session: {e}")
+
+    # Record saved parts while the session is open; returns the updated session
+    async def add_upload_session_parts(self, session_id, owner, parts):
+        try:
+            session = await run_sync(
+                self.upload_sessions_collection.find_one_and_update,
+                {"session_id": session_id, "owner": owner, "status": "open",
+                 "expires_at": {"$gt": datetime.now(timezone.utc)}},
+                {"$addToSet": {"parts": {"$each": parts}}},
+                projection={"_id": 0},
+                return_document=ReturnDocument.AFTER
+            )
+            if session:
+                return success("Upload session updated", session)
+            return error("Upload session not found, expired or being finalized")
+        except Exception as e:
+            return error(f"Error updating upload session: {e}")
+
+    # Atomically move an open session to 'finalizing' so it is sent only once
+    async def claim_upload_session(self, session_id, owner):
+        try:
+            session = await run_sync(
+                self.upload_sessions_collection.find_one_and_update,
+                {"session_id": session_id, "owner": owner, "status": "open", "expires_at": {"$gt": datetime.now(timezone.utc)}},
+                {"$set": {"status": "finalizing"}},
+                projection={"_id": 0},
+                return_document=ReturnDocument.AFTER
+            )
+            if session:
+                return success("Upload session claimed", session)
+            return error("Upload session not found, expired or already being finalized")
+        except Exception as e:
+            return error(f"Error claiming upload session: {e}")
+
+    async def release_upload_session(self, session_id):
+        try:
+            await run_sync(self.upload_sessions_collection.update_one,
+                           {"session_id": session_id}, {"$set": {"status": "open"}})
+            return success("Upload session released", None)
+        except Exception as e:
+            return error(f"Error releasing upload session: {e}")
+
+    async def delete_upload_session(self, session_id):
+        try:
+            await run_sync(self.upload_sessions_collection.delete_one, {"session_id": session_id})
+            return success("Upload session deleted", None)
         except Exception as e:
-            error(f"Error retrieving files for folder {folder_path} including subfolders: {e}")
+            return error(f"Error deleting upload session: {e}")
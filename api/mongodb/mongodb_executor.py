@@ -0,0 +1,48 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Runs blocking pymongo calls on a dedicated thread pool so they never stall the event loop.
+# max_workers bounds how many queries are in flight at once; extra calls wait in the pool queue.
+class MongoExecutor:
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="mongo")
+
+    async def run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.pool, functools.partial(func, *args, **kwargs))
+
+    def shutdown(self, wait=True):
+        self.pool.shutdown(wait=wait)
+
+
+_executor = None
+
+
+# Process-wide executor, sized by config.MONGO_EXECUTOR_WORKERS
+def get_executor():
+    global _executor
+    if _executor is None:
+        from utils.config import config
+        _executor = MongoExecutor(config.MONGO_EXECUTOR_WORKERS)
+    return _executor
+
+
+# Stop the process-wide executor -- called when the app stops serving. A later get_executor()
+# starts a new one.
+def shutdown_executor(wait=True):
+    global _executor
+    executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=wait)
+
+
+async def run_sync(func, *args, **kwargs):
+    return await get_executor().run(func, *args, **kwargs)
+
+
+# find() materialized off the event loop
+async def find_all(collection, *args, **kwargs):
+    return await run_sync(lambda: list(collection.find(*args, **kwargs)))
@@ -1,20 +1,34 @@
+import asyncio
 import hashlib
 import jwt
 import datetime
-from pymongo import MongoClient
 from typing import Optional, Dict, Any
 from utils.config import config
+from api.mongodb.mongodb_executor import run_sync
+from api.mongodb.mongodb_pool import get_client, close_client
+from api.mongodb.token_cache import TokenCache
 
 
 class MongoDBLogin:
     def __init__(self, secret_key: str):
-        self.client = MongoClient(config.MONGO_URL)
+        self.client = get_client()
         self.db = self.client[config.NAME_CLUSTER]
         self.users_collection = self.db["user-data"]
         self.secret_key = secret_key
+        self.token_cache = TokenCache(config.TOKEN_CACHE_SIZE, config.TOKEN_CACHE_TTL)
 
-    def get_user_by_token(self, token):
-        return self.users_collection.find_one({'token': str(token)})
+    async def get_user_by_token(self, token):
+        entry = self.token_cache.get(token)
+        if entry is not None and entry["user"] is not None:
+            return entry["user"]
+        return await run_sync(self.users_collection.find_one, {'token': str(token)}, {'password': 0})
+
+    def start_revocation_watch(self):
+        """Evict cached tokens when they are revoked by any worker."""
+        self.token_cache.start_watch(self.users_collection)
+
+    def stop_revocation_watch(self):
+        self.token_cache.stop_watch()
 
     def hash_password(self, password: str) -> str:
         """Hash the password using SHA-256."""
@@ -24,8 +38,8 @@ class MongoDBLogin:
         """Validate if the provided password matches the hashed password."""
         return self.hash_password(password) == hashed
 
-    def create_user(self, email: str, password: str, discord_id: str, url_avatar: str, role: str = "user") -> Optional[str]:
-        if self.users_collection.find_one({"email": email}):
+    async def create_user(self, email: str, password: str, discord_id: str, url_avatar: str, role: str = "user") -> Optional[str]:
+        if await run_sync(self.users_collection.find_one, {"email": email}):
             return None  # Email already exists
 
         hashed_password = self.hash_password(password)
@@ -38,12 +52,12 @@ class MongoDBLogin:
             "url_avatar": url_avatar,
             "role": role
         }
-        self.users_collection.insert_one(user_data)
-        return self.login(email, password)
+        await run_sync(self.users_collection.insert_one, user_data)
+        return await self.login(email, password)
 
-    def login(self, email: str, password: str) -> Optional[str]:
+    async def login(self, email: str, password: str) -> Optional[str]:
         """Authenticate the user and return a JWT token."""
-        user = self.users_collection.find_one({"email": email})
+        user = await run_sync(self.users_collection.find_one, {"email": email})
         if user and self.validate_password(password, user['password']):
             payload = {
                 "email": email,
@@ -51,19 +65,29 @@ class MongoDBLogin:
                 "exp": datetime.datetime.utcnow() + datetime.timedelta(hours=1)  # Token valid for 1 HOUR
             }
             token = jwt.encode(payload, self.secret_key, algorithm="HS256")
-            self.users_collection.update_one(
+            last_login = datetime.datetime.utcnow()
+            await run_sync(
+                self.users_collection.update_one,
                 {"email": email},
-                {"$set": {"token": token, "last_login": datetime.datetime.utcnow()}}
+                {"$set": {"token": token, "last_login": last_login}}
             )
+            # Previous tokens of the user are no longer valid
+            self.token_cache.invalidate_user(user["_id"])
+            decoded = jwt.decode(token, self.secret_key, algorithms=["HS256"])
+            self.token_cache.put(token, decoded, user | {"token": token, "last_login": last_login})
             return token
         return None
 
-    def verify_token(self, token: str) -> Optional[Dict[str, Any]]:
+    async def verify_token(self, token: str) -> Optional[Dict[str, Any]]:
         """Verify the JWT token and return the decoded payload if valid."""
+        entry = self.token_cache.get(token)
+        if entry is not None:
+            return entry["decoded"]
         try:
             decoded = jwt.decode(token, self.secret_key, algorithms=["HS256"])
-            user = self.users_collection.find_one({"email": decoded["email"], "token": token})
+            user = await run_sync(self.users_collection.find_one, {"email": decoded["email"], "token": token})
             if user:
+                self.token_cache.put(token, decoded, user)
                 return decoded  # Return the decoded payload including role
         except jwt.ExpiredSignatureError:
             return None
@@ -71,28 +95,29 @@ class MongoDBLogin:
             return None
         return None
 
-    def logout(self, token: str) -> bool:
+    async def logout(self, token: str) -> bool:
         """Logout the user by invalidating the JWT token."""
         try:
             decoded = jwt.decode(token, self.secret_key, algorithms=["HS256"])
-            self.users_collection.update_one({"email": decoded["email"]}, {"$unset": {"token": ""}})
+            self.token_cache.invalidate_token(token)
+            await run_sync(self.users_collection.update_one, {"email": decoded["email"]}, {"$unset": {"token": ""}})
             return True
         except jwt.InvalidTokenError:
             return False
 
-    def get_user_role(self, token: str) -> Optional[str]:
+    async def get_user_role(self, token: str) -> Optional[str]:
         """Retrieve the role of the user based on the JWT token."""
-        decoded = self.verify_token(token)
+        decoded = await self.verify_token(token)
         if decoded:
             return decoded.get("role")
         return None
 
     def close(self):
-        """Close the MongoDB connection."""
-        self.client.close()
+        """Close the shared MongoDB pool (only when the process is done with MongoDB)."""
+        close_client()
 
 
-if __name__ == "__main__":
+async def main():
     secret_key = config.SECRET_KEY
 
     auth = MongoDBLogin(secret_key)
@@ -103,7 +128,7 @@ if __name__ == "__main__":
 
     # Test login
     print("\nAttempting to log in with the same user...")
-    token = auth.login("nghiangogv@gmail.com", "Nghia385685")
+    token = await auth.login("nghiangogv@gmail.com", "Nghia385685")
     if token:
         print("Login successful! Token:", token)
     else:
@@ -111,10 +136,14 @@ if __name__ == "__main__":
 
     # Test get_user_by_token
     print("\nRetrieving user by token...")
-    user = auth.get_user_by_token(token)
+    user = await auth.get_user_by_token(token)
     if user:
         print("User retrieved successfully:", user)
     else:
         print("Failed to retrieve user!")
 
     auth.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
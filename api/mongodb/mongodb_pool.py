@@ -0,0 +1,127 @@
+import threading
+import time
+from pymongo import MongoClient, monitoring
+from pymongo.server_api import ServerApi
+
+from api.mongodb.mongodb_executor import run_sync
+from utils.config import config
+
+
+# Connection pool counters, fed by pymongo's CMAP events
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.open_connections = 0
+        self.in_use = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.pool_clears = 0
+        self.total_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.pool_clears += 1
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self._lock:
+            self.open_connections += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open_connections -= 1
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.checkout_failures += 1
+
+    def connection_checked_out(self, event):
+        # 'duration' (seconds spent waiting for a connection) is reported by pymongo >= 4.7
+        wait_ms = (getattr(event, "duration", None) or 0) * 1000
+        with self._lock:
+            self.in_use += 1
+            self.checkouts += 1
+            self.total_wait_ms += wait_ms
+            self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.in_use -= 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "open_connections": self.open_connections,
+                "in_use": self.in_use,
+                "checkouts": self.checkouts,
+                "checkout_failures": self.checkout_failures,
+                "pool_clears": self.pool_clears,
+                "avg_wait_ms": round(self.total_wait_ms / self.checkouts, 3) if self.checkouts else 0.0,
+                "max_wait_ms": round(self.max_wait_ms, 3)
+            }
+
+
+_client = None
+_metrics = PoolMetrics()
+_lock = threading.Lock()
+
+
+# Process-wide MongoClient shared by auth and drive metadata.
+# Sized by MONGO_MAX_POOL_SIZE / MONGO_MIN_POOL_SIZE / MONGO_WAIT_QUEUE_TIMEOUT_MS.
+def get_client(url=None):
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = MongoClient(
+                    url or config.MONGO_URL,
+                    server_api=ServerApi('1'),
+                    maxPoolSize=config.MONGO_MAX_POOL_SIZE,
+                    minPoolSize=config.MONGO_MIN_POOL_SIZE,
+                    waitQueueTimeoutMS=config.MONGO_WAIT_QUEUE_TIMEOUT_MS,
+                    event_listeners=[_metrics]
+                )
+    return _client
+
+
+# Pool settings and counters, plus a ping round trip
+async def pool_health():
+    stats = {
+        "max_pool_size": config.MONGO_MAX_POOL_SIZE,
+        "min_pool_size": config.MONGO_MIN_POOL_SIZE,
+        "wait_queue_timeout_ms": config.MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        **_metrics.snapshot()
+    }
+    try:
+        started = time.perf_counter()
+        await run_sync(get_client().admin.command, "ping")
+        stats["ping_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        stats["healthy"] = True
+    except Exception as e:
+        stats["healthy"] = False
+        stats["error"] = str(e)
+    return stats
+
+
+# Close every pooled connection -- called when the app stops serving
+def close_client():
+    global _client
+    with _lock:
+        if _client is not None:
+            _client.close()
+            _client = None
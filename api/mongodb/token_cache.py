@@ -0,0 +1,104 @@
+import hashlib
+import threading
+import time
+from pymongo.errors import PyMongoError
+
+from utils.lru_cache import LRUCache
+
+
+# Fields of the user record kept with a cached token (never the password hash)
+USER_FIELDS = ("_id", "email", "discord_id", "role", "url_avatar", "last_login")
+
+
+# Verified tokens and their user record, keyed by the sha256 of the token.
+# Entries never outlive the JWT expiry. Logout anywhere (this worker, another worker or the
+# user management CLI) drops them through a change stream on 'user-data'.
+class TokenCache:
+    def __init__(self, maxsize, ttl):
+        self.ttl = ttl
+        self.entries = LRUCache(maxsize, ttl)
+        self.by_user = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._watcher = None
+        self.watch_available = True
+
+    @staticmethod
+    def key(token):
+        return hashlib.sha256(str(token).encode()).hexdigest()
+
+    def get(self, token):
+        entry = self.entries.get(self.key(token))
+        if entry is None:
+            return None
+        exp = entry["decoded"].get("exp") if entry["decoded"] else None
+        if exp is not None and exp <= time.time():
+            self.invalidate_token(token)
+            return None
+        return entry
+
+    def put(self, token, decoded, user):
+        ttl = self.ttl
+        if decoded and decoded.get("exp") is not None:
+            ttl = min(ttl, decoded["exp"] - time.time())
+        if ttl <= 0:
+            return
+        key = self.key(token)
+        if user is not None:
+            user = {field: user.get(field) for field in USER_FIELDS}
+        self.entries.set(key, {"decoded": decoded, "user": user}, ttl)
+        if user is not None and user.get("_id") is not None:
+            with self._lock:
+                self.by_user.setdefault(user["_id"], set()).add(key)
+
+    def invalidate_token(self, token):
+        self.entries.pop(self.key(token))
+
+    # Every cached token of the user, except keep (the token just issued to them)
+    def invalidate_user(self, user_id, keep=None):
+        kept = self.key(keep) if keep is not None else None
+        with self._lock:
+            keys = self.by_user.pop(user_id, set())
+            if kept in keys:
+                self.by_user[user_id] = {kept}
+        for key in keys - {kept}:
+            self.entries.pop(key)
+
+    # Cross-worker invalidation: any change to a user's token (logout, new login) or removal
+    # of the user evicts every cached token of that user but the new one. Other updates
+    # (last_login, avatar...) are filtered out by the server.
+    def __watch_loop(self, users_collection):
+        pipeline = [{"$match": {"$or": [
+            {"operationType": {"$in": ["replace", "delete"]}},
+            {"operationType": "update", "updateDescription.updatedFields.token": {"$exists": True}},
+            {"operationType": "update", "updateDescription.removedFields": "token"}
+        ]}}]
+        while not self._stop.is_set():
+            try:
+                with users_collection.watch(pipeline, max_await_time_ms=1000) as stream:
+                    while not self._stop.is_set() and stream.alive:
+                        change = stream.try_next()
+                        if change is None:
+                            continue
+                        updated = change.get("updateDescription", {}).get("updatedFields", {})
+                        self.invalidate_user(change["documentKey"]["_id"], updated.get("token"))
+            except PyMongoError as e:
+                # e.g. standalone server without change streams: flush periodically so a logout
+                # elsewhere is honoured within 30s, and retry
+                if self.watch_available:
+                    print(f"[WARNING] Token revocation watch unavailable: {e}")
+                self.watch_available = False
+                self.entries.clear()
+                self._stop.wait(30)
+
+    def start_watch(self, users_collection):
+        if self._watcher is not None:
+            return
+        self._stop.clear()
+        self._watcher = threading.Thread(target=self.__watch_loop, args=(users_collection,),
+                                         name="token-revocation", daemon=True)
+        self._watcher.start()
+
+    def stop_watch(self):
+        self._stop.set()
+        self._watcher = None
@@ -0,0 +1,179 @@
+# Pool of telegram accounts sharing the transfer load.
+#
+# Every account has its own client, scheduler and connections, so each brings its own bandwidth
+# and flood limits. The primary account (the one TelegramAPI is logged in with) keeps doing
+# metadata, syncs and live changes; uploads and downloads go to the least loaded account that
+# is not flood-waited or cooling down after a failure. Extra accounts must be members of every
+# cluster (admins with posting rights, to upload).
+#
+# Channel message ids are the same for every member, but access hashes and file references are
+# not: an extra account fetches the message and resolves the chat through its own session.
+
+import asyncio
+import contextlib
+import time
+from telethon.errors import FloodWaitError
+from telethon.types import PeerChannel, Document
+from telethon.utils import resolve_id
+
+from api.telegram.parallel_transfer import SenderPool, ParallelDownloader, ParallelUploader
+from api.telegram.scheduler import TelegramScheduler, ScheduledTelegramClient, parse_limits
+from utils.config import config
+from utils.lru_cache import LRUCache
+
+
+# "name:phone,name2:phone2" -> [("name", "phone"), ("name2", "phone2")]
+def parse_accounts(spec):
+    accounts = []
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, phone = item.partition(":")
+        accounts.append((name.strip(), phone.strip()))
+    return accounts
+
+
+def new_scheduler():
+    return TelegramScheduler(parse_limits(config.TELEGRAM_RATE_LIMITS),
+                             config.TELEGRAM_MAX_FLOOD_WAIT, config.TELEGRAM_FLOOD_RETRIES)
+
+
+class TransferAccount:
+    def __init__(self, name, client, primary=False):
+        self.name = name
+        self.client = client
+        self.primary = primary
+        self.senders = SenderPool(client, config.DOWNLOAD_WORKERS + config.UPLOAD_WORKERS)
+        self.downloader = ParallelDownloader(self.senders, config.DOWNLOAD_WORKERS, config.DOWNLOAD_PART_SIZE,
+                                             client.scheduler)
+        self.uploader = ParallelUploader(self.senders, config.UPLOAD_WORKERS, config.UPLOAD_PART_SIZE,
+                                         config.UPLOAD_RETRIES, client.scheduler)
+        # This account's copy of the messages it downloads, see resolve_message
+        self.messages = LRUCache(config.MESSAGE_CACHE_SIZE, config.MESSAGE_CACHE_TTL)
+        self.active = 0
+        self.transfers = 0
+        self.failures = 0
+        self.unavailable_until = 0.0
+
+    @classmethod
+    async def login(cls, name, phone):
+        client = ScheduledTelegramClient(new_scheduler(), name, config.API_ID, config.API_HASH)
+        await client.start(phone)
+        # Fill the session's entity cache, so the clusters resolve by id
+        await client.get_dialogs()
+        return cls(name, client)
+
+    def available(self):
+        return self.client.is_connected() and time.monotonic() >= self.unavailable_until
+
+    # Seconds until the account's transfer requests are allowed again after a FloodWait
+    def flood_wait(self):
+        now = time.monotonic()
+        buckets = self.client.scheduler.buckets
+        return max((bucket.paused_until - now for name, bucket in buckets.items()
+                    if name in ("download", "upload", "write")), default=0.0)
+
+    def mark_failed(self, e):
+        self.failures += 1
+        seconds = e.seconds if isinstance(e, FloodWaitError) else config.TELEGRAM_POOL_FAILURE_COOLDOWN
+        self.unavailable_until = max(self.unavailable_until, time.monotonic() + seconds)
+        print(f"[WARNING] Telegram account {self.name} unavailable for {seconds}s: {e}")
+
+    # The chat as seen by this account (access hashes are per account)
+    async def resolve_chat(self, chat):
+        if self.primary:
+            return chat
+        entity = getattr(chat, 'entity', chat)
+        channel_id = getattr(entity, 'id', None) or entity.channel_id
+        return await self.client.get_input_entity(PeerChannel(int(channel_id)))
+
+    # The message as seen by this account (file references are per account). A Document built
+    # from a stored location holds the primary account's file reference: the other accounts
+    # fetch the message it comes from, origin = (cluster id, message id), in their own session.
+    async def resolve_message(self, message, origin=None):
+        if self.primary:
+            return message
+        chat, message_id, key = self.__message_ref(message, origin)
+        own = self.messages.get(key)
+        if own is None:
+            own = await self.client.get_messages(chat, ids=message_id)
+            if own is None or own.file is None:
+                raise ValueError(f"Message {message_id} not visible to account {self.name}")
+            self.messages.set(key, own)
+        return own
+
+    # (chat, message id, cache key) of a message or of the origin of a Document. The key holds
+    # the document id too: an edit replacing the file is a miss.
+    @staticmethod
+    def __message_ref(message, origin):
+        if isinstance(message, Document):
+            if origin is None:
+                raise ValueError("The message of a stored file location is unknown")
+            chat_id, message_id = int(origin[0]), int(origin[1])
+            return PeerChannel(chat_id), message_id, (chat_id, message_id, message.id)
+        chat_id = resolve_id(message.chat_id)[0]
+        document_id = message.document.id if message.document is not None else None
+        return message.chat_id, message.id, (chat_id, message.id, document_id)
+
+    # Drop this account's copy of a message, e.g. after its file reference expired
+    def forget_message(self, message, origin=None):
+        if not self.primary:
+            self.messages.pop(self.__message_ref(message, origin)[2])
+
+    async def close(self):
+        await self.senders.close()
+        if not self.primary and self.client.is_connected():
+            await self.client.disconnect()
+
+    def stats(self):
+        return {
+            "primary": self.primary,
+            "connected": self.client.is_connected(),
+            "available": self.available(),
+            "active_transfers": self.active,
+            "transfers": self.transfers,
+            "failures": self.failures,
+            "flood_wait_seconds": round(max(self.flood_wait(), 0.0), 3),
+            "scheduler": self.client.scheduler.stats()
+        }
+
+
+class ClientPool:
+    def __init__(self, primary):
+        self.primary = primary
+        self.accounts = {primary.name: primary}
+
+    # Log in the extra accounts; one that fails is left out and reported
+    async def connect(self, accounts):
+        async def login(name, phone):
+            try:
+                self.accounts[name] = await TransferAccount.login(name, phone)
+            except Exception as e:
+                print(f"[WARNING] Telegram account {name} not added to the pool: {e}")
+
+        await asyncio.gather(*(login(name, phone) for name, phone in accounts if name not in self.accounts))
+
+    def get(self, name):
+        return self.accounts.get(name) if name else self.primary
+
+    # Accounts to try for a transfer, best first: available ones by flood wait and load, the
+    # unavailable ones last (if every account is down, the least recently failed is retried)
+    def candidates(self):
+        return sorted(self.accounts.values(),
+                      key=lambda a: (not a.available(), a.flood_wait() > 0, a.active, a.unavailable_until))
+
+    def pick(self):
+        return self.candidates()[0]
+
+    @contextlib.contextmanager
+    def use(self, account):
+        account.active += 1
+        account.transfers += 1
+        try:
+            yield account
+        finally:
+            account.active -= 1
+
+    async def close(self):
+        await asyncio.gather(*(account.close() for account in self.accounts.values()), return_exceptions=True)
+
+    def stats(self):
+        return {name: account.stats() for name, account in self.accounts.items()}
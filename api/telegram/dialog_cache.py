@@ -0,0 +1,76 @@
+import asyncio
+
+
+# In-memory index of the dialogs visible to the account, keyed by name and by entity id.
+# Filled with a single iter_dialogs() pass and kept current from Telegram updates, so
+# dialog lookups on the upload/download/delete path are plain dict hits.
+class DialogCache:
+    def __init__(self):
+        self.by_name = {}
+        self.by_id = {}
+        self.loaded = False
+        self._lock = asyncio.Lock()
+
+    @staticmethod
+    def dialog_id(dialog):
+        return int(dialog.entity.id)
+
+    async def __fill(self, client):
+        by_name = {}
+        by_id = {}
+        async for dialog in client.iter_dialogs():
+            by_name[str(dialog.name)] = dialog
+            by_id[self.dialog_id(dialog)] = dialog
+        self.by_name = by_name
+        self.by_id = by_id
+        self.loaded = True
+
+    # Rebuild the whole index with one enumeration pass
+    async def refresh(self, client):
+        async with self._lock:
+            await self.__fill(client)
+
+    # Enumerate only if nothing is loaded yet (or the cache was invalidated).
+    # Concurrent callers share the same pass.
+    async def ensure_loaded(self, client):
+        if self.loaded:
+            return
+        async with self._lock:
+            if not self.loaded:
+                await self.__fill(client)
+
+    def get_by_name(self, name):
+        return self.by_name.get(str(name))
+
+    def get_by_id(self, chat_id):
+        try:
+            return self.by_id.get(int(chat_id))
+        except (TypeError, ValueError):
+            return None
+
+    def put(self, dialog):
+        self.by_name[str(dialog.name)] = dialog
+        self.by_id[self.dialog_id(dialog)] = dialog
+
+    def rename(self, chat_id, new_name):
+        dialog = self.get_by_id(chat_id)
+        if dialog is None:
+            return
+        self.by_name.pop(str(dialog.name), None)
+        dialog.name = new_name
+        self.by_name[str(new_name)] = dialog
+
+    def remove(self, chat_id):
+        dialog = self.by_id.pop(int(chat_id), None)
+        if dialog is not None and self.by_name.get(str(dialog.name)) is dialog:
+            del self.by_name[str(dialog.name)]
+
+    # Drop a single chat, or everything when chat_id is None (next lookup re-enumerates)
+    def invalidate(self, chat_id=None):
+        if chat_id is None:
+            self.by_name = {}
+            self.by_id = {}
+            self.loaded = False
+        else:
+            self.remove(chat_id)
+            self.loaded = False
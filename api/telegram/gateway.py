@@ -0,0 +1,237 @@
+# Telegram gateway: one process owns the telegram sessions, HTTP workers reach it over a Unix socket.
+#
+# Telethon's SQLite session cannot be shared between processes, so to run several Hypercorn
+# workers the telegram side of Layer4 lives in a separate process (gateway.py) and the Layer4
+# of each worker forwards its telegram operations to it (see requires_telegram in layer_4).
+# Auth, JSON and metadata reads / writes stay in the workers.
+#
+# One call per connection, as frames of <type:1 byte><length:4 bytes big endian><payload>:
+#   worker  -> gateway  J {"method", "args", "kwargs"}, then the body as D frames and an E frame
+#   gateway -> worker   J {"result": ...}, or J {"stream": true} then D frames and an E frame
+#                       X {"message": ...} on failure, also in the middle of a stream
+# An argument that is a file (filename + stream) or bytes is sent as the body of the call.
+# Frames are only read as the other side consumes them, so transfers keep the socket's
+# backpressure and neither side buffers a whole file.
+
+import asyncio
+import inspect
+import json
+import os
+from datetime import datetime
+
+from api.telegram.parallel_transfer import iter_parts
+from server.streaming_upload import StreamedFile
+
+JSON = b"J"
+DATA = b"D"
+END = b"E"
+ERROR = b"X"
+
+FILE_ARG = "$file"
+BYTES_ARG = "$bytes"
+
+
+# The connection to the gateway failed or the protocol broke
+class GatewayError(ConnectionError):
+    pass
+
+
+# The gateway ran the operation and it failed (X frame): the gateway itself is fine
+class GatewayOperationError(Exception):
+    pass
+
+
+def json_default(value):
+    if isinstance(value, datetime):
+        return {"$date": value.isoformat()}
+    return str(value)
+
+
+def json_object_hook(value):
+    if len(value) == 1 and "$date" in value:
+        return datetime.fromisoformat(value["$date"])
+    return value
+
+
+def encode(value):
+    return json.dumps(value, default=json_default).encode()
+
+
+def decode(payload):
+    return json.loads(payload, object_hook=json_object_hook)
+
+
+async def write_frame(writer, kind, payload=b""):
+    writer.write(kind + len(payload).to_bytes(4, "big"))
+    if payload:
+        writer.write(payload)
+    await writer.drain()
+
+
+async def read_frame(reader):
+    header = await reader.readexactly(5)
+    return header[:1], await reader.readexactly(int.from_bytes(header[1:], "big"))
+
+
+# D frames up to the E frame
+async def read_body(reader):
+    while True:
+        kind, payload = await read_frame(reader)
+        if kind == END:
+            return
+        if kind == ERROR:
+            raise GatewayOperationError(decode(payload)["message"])
+        if kind != DATA:
+            raise GatewayError(f"Unexpected frame {kind!r}")
+        yield payload
+
+
+class GatewayClient:
+    def __init__(self, path, frame_size):
+        self.path = path
+        self.frame_size = frame_size
+
+    # Replace a file / bytes argument by a marker, returning the body to send after the call
+    @staticmethod
+    def __pack(values, body):
+        packed = []
+        for value in values:
+            if isinstance(value, (bytes, bytearray)):
+                body.append(value)
+                value = {BYTES_ARG: True}
+            elif hasattr(value, "filename") and hasattr(value, "stream"):
+                body.append(value.stream)
+                value = {FILE_ARG: value.filename}
+            packed.append(value)
+        return packed
+
+    # Stops early once the gateway answered (it only does so to fail the call)
+    async def __send_body(self, writer, body, answer):
+        if isinstance(body, (bytes, bytearray)):
+            chunks = self.__slices(body)
+        else:
+            chunks = iter_parts(body, self.frame_size)
+        async for chunk in chunks:
+            # drain() does not yield while the socket takes the data: give the answer a chance
+            await asyncio.sleep(0)
+            if answer.done():
+                return
+            await write_frame(writer, DATA, chunk)
+        await write_frame(writer, END)
+
+    async def __slices(self, body):
+        for offset in range(0, len(body), self.frame_size):
+            yield bytes(body[offset:offset + self.frame_size])
+
+    # Call method on the gateway's Layer4. Returns its result, or an async generator of bytes
+    # when the method streams.
+    async def call(self, method, *args, **kwargs):
+        body = []
+        args = self.__pack(args, body)
+        kwargs = dict(zip(kwargs, self.__pack(kwargs.values(), body)))
+        if len(body) > 1:
+            raise ValueError("A gateway call carries at most one body")
+
+        reader, writer = await asyncio.open_unix_connection(self.path)
+        answer = None
+        try:
+            await write_frame(writer, JSON, encode({"method": method, "args": args, "kwargs": kwargs}))
+            # Read while the body is sent: a gateway failing the call answers and closes before
+            # reading the rest, the answer must not be lost to the write error that follows
+            answer = asyncio.ensure_future(read_frame(reader))
+            if body:
+                try:
+                    await self.__send_body(writer, body[0], answer)
+                except (ConnectionError, OSError):
+                    await asyncio.sleep(0)
+                    if not answer.done():
+                        raise
+            kind, payload = await answer
+            if kind == ERROR:
+                raise GatewayOperationError(decode(payload)["message"])
+            response = decode(payload)
+        except BaseException:
+            if answer is not None:
+                answer.cancel()
+                if answer.done() and not answer.cancelled():
+                    answer.exception()
+            writer.close()
+            raise
+        if not response.get("stream"):
+            writer.close()
+            return response["result"]
+        return self.__stream(reader, writer)
+
+    @staticmethod
+    async def __stream(reader, writer):
+        try:
+            async for chunk in read_body(reader):
+                yield chunk
+        finally:
+            writer.close()
+
+
+class GatewayServer:
+    # Serves the methods of layer4 marked as gateway operations
+    def __init__(self, layer4, path):
+        self.layer4 = layer4
+        self.path = path
+        self.server = None
+
+    async def start(self):
+        if os.path.exists(self.path):
+            # Left behind by a gateway that did not stop cleanly
+            os.unlink(self.path)
+        self.server = await asyncio.start_unix_server(self.__handle, path=self.path)
+        os.chmod(self.path, 0o600)
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    @staticmethod
+    async def __unpack(values, reader):
+        unpacked = []
+        for value in values:
+            if isinstance(value, dict) and len(value) == 1 and FILE_ARG in value:
+                value = StreamedFile(value[FILE_ARG], read_body(reader))
+            elif isinstance(value, dict) and len(value) == 1 and BYTES_ARG in value:
+                value = b"".join([chunk async for chunk in read_body(reader)])
+            unpacked.append(value)
+        return unpacked
+
+    async def __handle(self, reader, writer):
+        try:
+            kind, payload = await read_frame(reader)
+            if kind != JSON:
+                raise GatewayError(f"Unexpected frame {kind!r}")
+            call = decode(payload)
+            operation = getattr(self.layer4, call["method"], None)
+            if not getattr(operation, "gateway_operation", False):
+                raise GatewayError(f"Unknown gateway operation {call['method']}")
+            args = await self.__unpack(call["args"], reader)
+            kwargs = dict(zip(call["kwargs"], await self.__unpack(call["kwargs"].values(), reader)))
+
+            result = await operation(*args, **kwargs)
+            if not inspect.isasyncgen(result):
+                await write_frame(writer, JSON, encode({"result": result}))
+                return
+            await write_frame(writer, JSON, encode({"stream": True}))
+            try:
+                async for chunk in result:
+                    await write_frame(writer, DATA, chunk)
+            finally:
+                await result.aclose()
+            await write_frame(writer, END)
+        except Exception as e:
+            try:
+                await write_frame(writer, ERROR, encode({"message": str(e)}))
+            except (ConnectionError, OSError):
+                # The worker went away (e.g. its HTTP client disconnected mid-download)
+                pass
+        finally:
+            writer.close()
@@ -1,11 +1,22 @@
-from telethon import TelegramClient
-from telethon.tl.functions.channels import CreateChannelRequest, CheckUsernameRequest, UpdateUsernameRequest
-from telethon.errors import UsernameInvalidError, UsernameOccupiedError
-from telethon.types import Message
+from telethon import events
+from telethon.tl.functions.channels import (CreateChannelRequest, CheckUsernameRequest, UpdateUsernameRequest,
+                                            GetChannelsRequest)
+from telethon.errors import (UsernameInvalidError, UsernameOccupiedError, FloodWaitError, RPCError,
+                             FileReferenceExpiredError, ChannelInvalidError, ChannelPrivateError)
+from telethon.types import Message, PeerChannel, Document, Channel
+from telethon.utils import resolve_id, get_input_channel
 from utils.config import config
 from utils.response_handler import success, error
+import asyncio
 import functools
+import io
 from format.Media import Media
+from api.telegram.dialog_cache import DialogCache
+from api.telegram.client_pool import ClientPool, TransferAccount, new_scheduler, parse_accounts
+from api.telegram.scheduler import ScheduledTelegramClient, iter_at_priority, PRIORITY_INTERACTIVE
+from utils.chunk_cache import ChunkCache
+from utils.lru_cache import LRUCache
+from utils.singleflight import SharedStreams
 
 
 # Printing download progress
@@ -34,7 +45,25 @@ class TelegramAPI:
         self.API_HASH = config.API_HASH
         self.PHONE = config.PHONE
         self.Name = "Telegram Drive"
-        self.client = TelegramClient(self.Name, self.API_ID, self.API_HASH)
+        # Every request, including those of the parallel transfer engines, goes through the scheduler
+        self.scheduler = new_scheduler()
+        self.client = ScheduledTelegramClient(self.scheduler, self.Name, self.API_ID, self.API_HASH)
+        self.dialogs = DialogCache()
+        # Channels resolved by id outside the dialogs (see get_channels)
+        self.channels = {}
+        self.messages = LRUCache(config.MESSAGE_CACHE_SIZE, config.MESSAGE_CACHE_TTL)
+        # Uploads and downloads are spread over this account and the extra ones in TELEGRAM_POOL_ACCOUNTS
+        self.pool = ClientPool(TransferAccount(self.Name, self.client, primary=True))
+        # Chunks of recently downloaded documents, on disk (disabled when the size is 0)
+        self.chunk_cache = None
+        if config.DOWNLOAD_CACHE_SIZE > 0:
+            self.chunk_cache = ChunkCache(config.DOWNLOAD_CACHE_DIR, config.DOWNLOAD_CACHE_SIZE,
+                                          config.DOWNLOAD_CACHE_CHUNK_SIZE)
+        self.downloads = SharedStreams(config.DOWNLOAD_SHARED_BUFFER)
+        self.me_id = None
+        self.watched_chats = set()
+        self.on_file_changed = None
+        self.on_files_deleted = None
 
     def __get_API_ID(self):
         return self.API_ID
@@ -46,6 +75,13 @@ class TelegramAPI:
         return self.PHONE
 
 
+    # Load and scheduler stats of every account of the transfer pool
+    def get_pool_stats(self):
+        return self.pool.stats()
+
+    def get_download_cache_stats(self):
+        return self.chunk_cache.stats() if self.chunk_cache is not None else None
+
     def is_connected(self):
         return self.client.is_connected()
 
@@ -54,12 +90,16 @@ class TelegramAPI:
             await self.client.start(self.__get_PHONE())
             if not self.is_connected():
                 raise ConnectionError("Failed to connect to Telegram")
+            self.me_id = (await self.client.get_me()).id
+            self.client.add_event_handler(self.__on_chat_action, events.ChatAction())
+            await self.pool.connect(parse_accounts(config.TELEGRAM_POOL_ACCOUNTS))
             return success("Client connected successfully", None)
         except Exception as e:
             return error("[LAYER-2]" + str(e))
 
     async def disconnect(self):
         try:
+            await self.pool.close()
             if self.is_connected():
                 await self.client.disconnect()
             return success("Client disconnected successfully", None)
@@ -70,51 +110,181 @@ class TelegramAPI:
     async def get_chats(self):
         """Fetch all chat names."""
         try:
-            chats = []
-            async for dialog in self.client.iter_dialogs():
-                chats.append(dialog.name)
+            await self.dialogs.ensure_loaded(self.client)
+            chats = [dialog.name for dialog in self.dialogs.by_id.values()]
             return success("All chats fetched", chats)
         except Exception as e:
             return error("[LAYER-2]" + str(e))
 
+    # Keep the dialog cache current from Telegram updates instead of re-enumerating
+    async def __on_chat_action(self, event):
+        try:
+            chat_id = resolve_id(event.chat_id)[0]
+            if event.new_title:
+                self.dialogs.rename(chat_id, event.new_title)
+            elif (event.user_left or event.user_kicked) and event.user_id == self.me_id:
+                self.dialogs.remove(chat_id)
+                self.channels.pop(chat_id, None)
+            elif event.created or event.user_joined or event.user_added:
+                # New chat visible to the account: resolved lazily on the next cache miss
+                self.dialogs.invalidate(chat_id)
+        except Exception as e:
+            print(f"[LAYER-2] Error updating dialog cache: {e}")
+
+    # Live changes in the watched chats: on_file_changed(chat_id, Media, edited) for new or edited files,
+    # on_files_deleted(chat_id, message_ids) for deletions. chat_ids are entity ids.
+    def watch_changes(self, chat_ids, on_file_changed, on_files_deleted):
+        first = not self.watched_chats and self.on_file_changed is None
+        self.watched_chats = {int(chat_id) for chat_id in chat_ids}
+        self.on_file_changed = on_file_changed
+        self.on_files_deleted = on_files_deleted
+        if first:
+            self.client.add_event_handler(self.__on_message, events.NewMessage())
+            self.client.add_event_handler(self.__on_message, events.MessageEdited())
+            self.client.add_event_handler(self.__on_message_deleted, events.MessageDeleted())
+
+    async def __on_message(self, event):
+        try:
+            chat_id = resolve_id(event.chat_id)[0] if event.chat_id is not None else None
+            if chat_id not in self.watched_chats:
+                return
+            message = event.message
+            self.messages.set(self.__message_key(message), message)
+            # Only captions in the drive's 'name@location' format describe a file
+            if message.file is not None and "@" in str(message.text):
+                await self.on_file_changed(chat_id, Media(message), isinstance(event, events.MessageEdited.Event))
+        except Exception as e:
+            print(f"[LAYER-2] Error handling message update: {e}")
+
+    async def __on_message_deleted(self, event):
+        try:
+            # chat_id is only known for channels -- every cluster is one
+            if event.chat_id is None:
+                return
+            chat_id = resolve_id(event.chat_id)[0]
+            if chat_id not in self.watched_chats:
+                return
+            for message_id in event.deleted_ids:
+                self.messages.pop((chat_id, int(message_id)))
+            await self.on_files_deleted(chat_id, event.deleted_ids)
+        except Exception as e:
+            print(f"[LAYER-2] Error handling message deletion: {e}")
+
+    # Explicit invalidation -- whole cache or a single chat
+    def invalidate_dialog_cache(self, chat_id=None):
+        self.dialogs.invalidate(chat_id)
+        if chat_id is None:
+            self.channels = {}
+        else:
+            self.channels.pop(int(chat_id), None)
+
+    @ensure_connected
+    async def load_dialogs(self):
+        """Fill the dialog cache with a single enumeration pass."""
+        try:
+            await self.dialogs.refresh(self.client)
+            return success("Dialogs loaded", len(self.dialogs.by_id))
+        except Exception as e:
+            return error("[LAYER-2]" + str(e))
+
     @ensure_connected
     async def get_dialog_object_by_name(self, chat_name):
         """Fetch dialog object (telethon object) by chat name."""
         try:
-            async for dialog in self.client.iter_dialogs():
-                if str(dialog.name) == str(chat_name):
-                    return success("Dialog object found", dialog)
+            dialog = self.dialogs.get_by_name(chat_name)
+            if dialog is None and not self.dialogs.loaded:
+                await self.dialogs.ensure_loaded(self.client)
+                dialog = self.dialogs.get_by_name(chat_name)
+            if dialog is not None:
+                return success("Dialog object found", dialog)
             return success("[LAYER-2] Dialog object not found", None)
         except Exception as e:
             return error(str(e))
 
+    # The clusters among chat_ids this account can still use, as {id: Channel}, fetched with one
+    # GetChannels request: deleted, left or forbidden channels and ids unknown to the session are
+    # missing from the result
+    async def get_channels(self, chat_ids):
+        inputs = []
+        for chat_id in chat_ids:
+            try:
+                inputs.append(get_input_channel(await self.client.get_input_entity(PeerChannel(int(chat_id)))))
+            except (ValueError, TypeError):
+                pass
+        try:
+            chats = (await self.client(GetChannelsRequest(inputs))).chats if inputs else []
+        except (ChannelInvalidError, ChannelPrivateError):
+            # One bad channel fails the whole request: ask for them one by one
+            if len(inputs) == 1:
+                return {}
+            chats = []
+            for channel in inputs:
+                try:
+                    chats += (await self.client(GetChannelsRequest([channel]))).chats
+                except (ChannelInvalidError, ChannelPrivateError):
+                    pass
+        channels = {chat.id: chat for chat in chats if isinstance(chat, Channel) and not chat.left}
+        self.channels.update(channels)
+        return channels
+
     @ensure_connected
     async def get_dialog_object_by_id(self, chat_id):
-        """Fetch dialog object (telethon object) by chat name."""
+        """Fetch the chat entity (telethon Channel) by chat id."""
         try:
-            async for dialog in self.client.iter_dialogs():
-                if int(dialog.draft.entity.id) == int(chat_id):
-                    return success("Dialog object found", dialog)
+            key = int(chat_id)
+            dialog = self.dialogs.get_by_id(key)
+            if dialog is not None:
+                return success("Dialog object found", dialog.entity)
+            channel = self.channels.get(key)
+            if channel is None and not self.dialogs.loaded:
+                # Channels known to the session resolve without enumerating the dialogs
+                channel = (await self.get_channels([key])).get(key)
+            if channel is not None:
+                return success("Dialog object found", channel)
+            await self.dialogs.ensure_loaded(self.client)
+            dialog = self.dialogs.get_by_id(key)
+            if dialog is not None:
+                return success("Dialog object found", dialog.entity)
             return error("[LAYER-2] Dialog object not found")
         except Exception as e:
             return error(str(e))
 
     @ensure_connected
-    async def get_all_messages(self, chat_id):
-        """Fetch all messages from a chat."""
+    async def get_all_messages(self, chat_id, min_id=0):
+        """Fetch all messages from a chat, only those newer than min_id when given."""
         try:
             messages = []
-            async for message in self.client.iter_messages(chat_id):
+            async for message in self.client.iter_messages(chat_id, min_id=min_id):
                 messages.append(message)
             return success("All messages fetched", messages)
+        except FloodWaitError:
+            # Callers syncing several chats back off together
+            raise
+        except Exception as e:
+            return error("[LAYER-2] " + str(e))
+
+    @ensure_connected
+    async def get_last_message_id(self, chat_id):
+        """Id of the newest message of a chat, 0 if it is empty."""
+        try:
+            messages = await self.client.get_messages(chat_id, limit=1)
+            return success("Last message id", messages[0].id if messages else 0)
+        except FloodWaitError:
+            raise
         except Exception as e:
             return error("[LAYER-2] " + str(e))
 
-    async def get_all_file_by_chatId(self, chat_id):
-        """Fetch all file messages from a chat."""
+    async def iter_file_message_ids(self, chat_id, max_id=0):
+        """Stream the ids of the file messages of a chat (up to max_id when given) without keeping the messages."""
+        async for message in self.client.iter_messages(chat_id, max_id=max_id + 1 if max_id else 0):
+            if message.file is not None:
+                yield message.id
+
+    async def get_all_file_by_chatId(self, chat_id, min_id=0):
+        """Fetch all file messages from a chat, only those newer than min_id when given."""
         result = []
         try:
-            t = await self.get_all_messages(chat_id)
+            t = await self.get_all_messages(chat_id, min_id)
             if t["status"] == "error":
                 return error("[LAYER-2] " + t['message'])
 
@@ -122,20 +292,68 @@ class TelegramAPI:
                 if isinstance(message, Message) and message.file is not None:
                     result.append(Media(message))
             return success("All files fetched", result)
+        except FloodWaitError:
+            raise
+        except Exception as e:
+            return error("[LAYER-2] " + str(e))
+
+    # Normalize a chat reference (Dialog, entity, id or name) to the key used by the message cache
+    def __chat_key(self, chat):
+        entity = getattr(chat, 'entity', chat)
+        if hasattr(entity, 'id'):
+            return int(entity.id)
+        if hasattr(entity, 'channel_id'):
+            return int(entity.channel_id)
+        if isinstance(entity, int) or str(entity).lstrip('-').isdigit():
+            return resolve_id(int(entity))[0]
+        dialog = self.dialogs.get_by_name(entity)
+        return self.dialogs.dialog_id(dialog) if dialog is not None else str(entity)
+
+    def __message_key(self, message):
+        return resolve_id(message.chat_id)[0], int(message.id)
+
+    # Drop cached messages -- a single message or every message of a chat
+    def invalidate_message_cache(self, chat_id, message_id=None):
+        key = self.__chat_key(chat_id)
+        if message_id is None:
+            self.messages.pop_where(lambda k: k[0] == key)
+        else:
+            self.messages.pop((key, int(message_id)))
+
+    @ensure_connected
+    async def get_messages_by_ids(self, chat_id, message_ids):
+        """Fetch only the requested messages, batched, serving repeats from the LRU cache."""
+        try:
+            key = self.__chat_key(chat_id)
+            result = {}
+            missing = []
+            for message_id in message_ids:
+                message = self.messages.get((key, int(message_id)))
+                if message is None:
+                    missing.append(int(message_id))
+                else:
+                    result[int(message_id)] = message
+
+            if missing:
+                fetched = await self.client.get_messages(chat_id, ids=missing)
+                for message_id, message in zip(missing, fetched):
+                    if isinstance(message, Message):
+                        self.messages.set((key, message_id), message)
+                    result[message_id] = message if isinstance(message, Message) else None
+            return success("Messages fetched", result)
         except Exception as e:
             return error("[LAYER-2] " + str(e))
 
     async def get_native_message_instance(self, chat_id, message_id):
         """Fetch native message instance from a chat by message_id."""
         try:
-            t = await self.get_all_messages(chat_id)
+            t = await self.get_messages_by_ids(chat_id, [message_id])
             if t["status"] == "error":
                 return error("[LAYER-2] " + t['message'])
 
-            for message in t['data']:
-                if isinstance(message, Message) and message.file is not None:
-                    if str(message.id) == str(message_id):
-                        return success("Message fetched", message)
+            message = t['data'].get(int(message_id))
+            if message is not None and message.file is not None:
+                return success("Message fetched", message)
             return error("[LAYER-2] Message not found")
         except Exception as e:
             return error("[LAYER-2] " + str(e))
@@ -143,14 +361,10 @@ class TelegramAPI:
     async def get_file_by_message_id(self, chat_id, message_id):
         """Fetch a specific file by message ID."""
         try:
-            t = await self.get_all_file_by_chatId(chat_id)
+            t = await self.get_native_message_instance(chat_id, message_id)
             if t["status"] == "error":
-                return error("[LAYER-2] " + t['message'])
-
-            for media in t['data']:
-                if str(media.get_id_message()) == str(message_id):
-                    return success("File exists", media)
-            return error("[LAYER-2] File doesn't exist")
+                return error("[LAYER-2] File doesn't exist")
+            return success("File exists", Media(t['data']))
         except Exception as e:
             return error("[LAYER-2] " + str(e))
 
@@ -183,22 +397,227 @@ class TelegramAPI:
         async for chunk in self.client.iter_download(media, chunk_size=chunk_size):
             yield chunk
 
+    # Document built from a stored location (see Media.get_location): downloads it with no
+    # dialog or message request
+    @staticmethod
+    def location_document(location):
+        return Document(
+            id=location["document_id"],
+            access_hash=location["access_hash"],
+            file_reference=bytes(location["file_reference"]),
+            date=location.get("date"),
+            mime_type=location.get("mime_type", ""),
+            size=location["size"],
+            dc_id=location["dc_id"],
+            attributes=[]
+        )
+
+    async def iter_download_range(self, media, start, end, request_size=None, origin=None):
+        """Stream bytes start..end (inclusive) of a media, fetching only the parts that cover them."""
+        # media is a message, or a Document built from a stored location; origin is then
+        # (cluster id, message id) of its message, for the pool accounts other than the primary
+        document = media if isinstance(media, Document) else getattr(media.media, 'document', None)
+        if document is None:
+            async for chunk in self.__iter_telegram_range(media, start, end, request_size, origin):
+                yield chunk
+            return
+
+        # Concurrent downloads of the same range of a document share one fetch
+        async for chunk in self.downloads.stream(
+                (document.id, start, end),
+                lambda: self.__iter_cached_range(media, document, start, end, request_size, origin)):
+            yield chunk
+
+    async def __iter_cached_range(self, media, document, start, end, request_size, origin):
+        if self.chunk_cache is None:
+            async for chunk in self.__iter_telegram_range(media, start, end, request_size, origin):
+                yield chunk
+            return
+
+        # Cached chunks are read from disk; each run of missing chunks is fetched from telegram
+        # in one range, streamed as its chunks complete and stored on the way
+        cache = self.chunk_cache
+        size = cache.chunk_size
+        index = start // size
+        last = end // size
+        while index <= last:
+            data = await asyncio.to_thread(cache.get, document.id, index)
+            if data is not None:
+                yield self.__chunk_slice(data, index * size, start, end)
+                index += 1
+                continue
+
+            run_end = index
+            while run_end < last and (document.id, run_end + 1) not in cache:
+                run_end += 1
+            # cache.get counted the first chunk of the run
+            cache.count_misses(run_end - index)
+            fetch_end = min((run_end + 1) * size, document.size) - 1
+            buffer = bytearray()
+            async for chunk in self.__iter_telegram_range(media, index * size, fetch_end, request_size, origin):
+                buffer.extend(chunk)
+                while len(buffer) >= size or (buffer and index * size + len(buffer) > fetch_end):
+                    data = bytes(buffer[:size])
+                    del buffer[:size]
+                    await asyncio.to_thread(cache.put, document.id, index, data)
+                    yield self.__chunk_slice(data, index * size, start, end)
+                    index += 1
+            if index <= run_end:
+                # Never cache (nor skip over) a partial chunk
+                raise ConnectionError(f"Short read of document {document.id}: "
+                                      f"{index * size + len(buffer) - 1} instead of {fetch_end}")
+
+    # Part of the chunk starting at byte chunk_start that falls in start..end
+    @staticmethod
+    def __chunk_slice(data, chunk_start, start, end):
+        if chunk_start >= start and chunk_start + len(data) <= end + 1:
+            return data
+        return data[max(start - chunk_start, 0):end + 1 - chunk_start]
+
+    async def __iter_telegram_range(self, media, start, end, request_size, origin=None):
+        # Served by the least loaded account of the pool. If it fails, the rest of the range is
+        # fetched through the next one, the caller only sees a continuous stream.
+        position = start
+        last_error = None
+        for account in self.pool.candidates():
+            if position > end:
+                return
+            try:
+                with self.pool.use(account):
+                    message = await account.resolve_message(media, origin)
+                    # Downloads are interactive: served ahead of uploads and syncs
+                    async for chunk in iter_at_priority(PRIORITY_INTERACTIVE, self.__iter_account_range(
+                            account, message, position, end, request_size)):
+                        position += len(chunk)
+                        yield chunk
+                return
+            except FileReferenceExpiredError:
+                # Not the account's fault: the caller refreshes the reference
+                account.forget_message(media, origin)
+                raise
+            except (RPCError, ConnectionError, OSError, ValueError) as e:
+                account.mark_failed(e)
+                last_error = e
+        raise last_error
+
+    async def __iter_account_range(self, account, media, start, end, request_size):
+        # Large ranges go through the parallel engine (several connections to the file's DC)
+        if config.DOWNLOAD_WORKERS > 1 and end - start + 1 >= config.PARALLEL_DOWNLOAD_MIN_SIZE:
+            async for chunk in account.downloader.download(media, start, end):
+                yield chunk
+            return
+
+        request_size = request_size or config.DOWNLOAD_REQUEST_SIZE
+        aligned = start - start % request_size
+        skip = start - aligned
+        remaining = end - start + 1
+        parts = -(-(end + 1 - aligned) // request_size)
+        async for chunk in account.client.iter_download(media, offset=aligned, limit=parts,
+                                                        request_size=request_size, chunk_size=request_size):
+            if skip:
+                chunk = chunk[skip:]
+                skip = 0
+            if len(chunk) >= remaining:
+                yield chunk[:remaining]
+                return
+            remaining -= len(chunk)
+            yield chunk
+
+    # Upload result carrying the sent message as Media, so callers can record it without a sync.
+    # Only messages of the primary account are cached: the others are bound to their own client.
+    def __uploaded(self, account, sent):
+        if account.primary:
+            self.messages.set(self.__message_key(sent), sent)
+        return {'status': 'success', 'message': "File caricato con successo", 'data': Media(sent)}
+
     @ensure_connected
     async def upload_file(self, chat, file_storage, message, file_size):
-        try:
-            input_file = await self.client.upload_file(
+        stream = file_storage.stream
+        # A seekable source is retried from the start on the next account of the pool; a
+        # streamed body is consumed as it is sent, so it only gets one account.
+        seekable = hasattr(stream, "seek") and getattr(stream, "seekable", lambda: True)()
+        last_error = None
+        for account in self.pool.candidates():
+            try:
+                with self.pool.use(account):
+                    sent = await self.__upload_with(account, chat, file_storage, message, file_size)
+                return self.__uploaded(account, sent)
+            except (RPCError, ConnectionError, OSError) as e:
+                account.mark_failed(e)
+                last_error = e
+                if not seekable:
+                    break
+                stream.seek(0)
+            except Exception as e:
+                last_error = e
+                break
+        return {'status': 'error', 'message': "[LAYER-2] " + str(last_error)}
+
+    async def __upload_with(self, account, chat, file_storage, message, file_size):
+        # Parts are saved concurrently over pooled connections to the account's home DC.
+        # Streamed request bodies (async iterables) always go through the uploader.
+        if config.UPLOAD_WORKERS > 1 or not hasattr(file_storage.stream, "read"):
+            input_file = await account.uploader.upload(file_storage.stream, file_size,
+                                                       file_storage.filename, account.client.session.dc_id)
+        else:
+            input_file = await account.client.upload_file(
                 file=file_storage.stream,
                 file_size=file_size,
                 file_name=file_storage.filename
             )
 
-            await self.client.send_file(
-                chat,
-                file=input_file,
+        return await account.client.send_file(
+            await account.resolve_chat(chat),
+            file=input_file,
+            caption=message,
+            force_document=True
+        )
+
+    # Resumable uploads: parts are saved under a file_id chosen when the session is created and
+    # the file is sent once every part is there. Parts saved earlier are reused, telegram keeps
+    # them until the file is sent (or they expire). Saved parts belong to the account that saved
+    # them, so the upload is pinned to the account picked here.
+    def new_upload(self, file_size):
+        account = self.pool.pick()
+        if file_size <= 0 or file_size > account.uploader.max_file_size():
+            raise ValueError(f"file_size must be between 1 and {account.uploader.max_file_size()} bytes")
+        return {
+            "file_id": account.uploader.new_file_id(),
+            "part_size": account.uploader.part_size,
+            "total_parts": account.uploader.total_parts(file_size),
+            "account": account.name
+        }
+
+    def __upload_account(self, name):
+        account = self.pool.get(name)
+        if account is None or not account.client.is_connected():
+            raise ConnectionError(f"Telegram account {name} of this upload is not connected")
+        return account
+
+    # Save the parts covered by data, starting at part first_part
+    @ensure_connected
+    async def upload_parts(self, file_id, file_size, first_part, data, account=None):
+        try:
+            account = self.__upload_account(account)
+            count = -(-len(data) // account.uploader.part_size)
+            with self.pool.use(account):
+                await account.uploader.save_parts(io.BytesIO(data), file_size, account.client.session.dc_id,
+                                                  file_id, first_part, count)
+            return success("Parts uploaded successfully", list(range(first_part, first_part + count)))
+        except Exception as e:
+            return error("[LAYER-2] " + str(e))
+
+    @ensure_connected
+    async def send_uploaded_file(self, chat, file_id, file_size, file_name, message, account=None):
+        try:
+            account = self.__upload_account(account)
+            sent = await account.client.send_file(
+                await account.resolve_chat(chat),
+                file=account.uploader.input_file(file_id, file_size, file_name),
                 caption=message,
                 force_document=True
             )
-            return {'status': 'success', 'message': "File caricato con successo"}
+            return self.__uploaded(account, sent)
         except Exception as e:
             return {'status': 'error', 'message': "[LAYER-2] " + str(e)}
 
@@ -208,6 +627,7 @@ class TelegramAPI:
         try:
             t = await self.client.edit_message(mess, new_message)
             # print(t)
+            self.messages.set(self.__message_key(t), t)
             if str(t.message) == str(new_message):
                 return success("Message edited successfully", None)
         except Exception as e:
@@ -218,6 +638,7 @@ class TelegramAPI:
         """Delete a file by message instance."""
         try:
             await mess.delete()
+            self.messages.pop(self.__message_key(mess))
             return success("File deleted successfully", None)
         except Exception as e:
             return error("[LAYER-2] " + str(e))
@@ -240,12 +661,15 @@ class TelegramAPI:
                 megagroup=megagroup
             ))
             channel = result.chats[0]
+            # The new chat has no Dialog yet -- a name lookup re-enumerates once, lookups by id
+            # resolve it from the session (the channel entity was stored with the result)
+            self.dialogs.invalidate(channel.id)
 
-            return success({
+            return success("Group created successfully", {
                 "id": channel.id,
                 "title": channel.title,
                 "access_hash": channel.access_hash
-            }, None)
+            })
 
         except Exception as e:
             return error(f"Error creating the group: {e}")
@@ -6,7 +6,12 @@
 
 # Telegram is used by layer to store data and not organised metadata. Only folder logic is implemented in layer
 
+import asyncio
+import json
+from telethon.errors import FileReferenceExpiredError
 from api.telegram.layer_2 import TelegramAPI
+from format.Media import Media
+from utils.config import config
 from utils.response_handler import success, error
 
 
@@ -18,56 +23,107 @@ class Layer3_2:
         self.shared_drive_object_dialog = None
         self.users = users
 
+    def private_cluster_name(self, user):
+        return "Drive_Layer_Private_" + str(user)
+
+    # Persistent name -> id map of the clusters, written after discovery so warm restarts skip it.
+    # Ignored when it was written for another telegram account.
+    def __load_cluster_map(self):
+        try:
+            with open(config.CLUSTER_MAP_FILE) as f:
+                data = json.load(f)
+            if data.get("account") == self.client.me_id:
+                return dict(data.get("clusters", {}))
+        except (OSError, ValueError):
+            pass
+        return {}
+
+    def __save_cluster_map(self, clusters):
+        try:
+            with open(config.CLUSTER_MAP_FILE, "w") as f:
+                json.dump({"account": self.client.me_id, "clusters": clusters}, f, indent=2)
+        except OSError as e:
+            print(f"[WARNING] Could not write cluster map: {e}")
+
+    # Create missing clusters, at most config.CLUSTER_CREATE_CONCURRENCY at a time.
+    # Returns (name -> id of the created ones, name -> exception of the failed ones)
+    async def __create_clusters(self, names):
+        semaphore = asyncio.Semaphore(config.CLUSTER_CREATE_CONCURRENCY)
+
+        async def create(name):
+            async with semaphore:
+                s = await self.client.create_group(name)
+                if s["status"] == "error":
+                    raise Exception(s["message"])
+                print(f"[INFO] Created cluster {name}")
+                return name, str(s["data"]["id"])
+
+        results = await asyncio.gather(*(create(name) for name in names), return_exceptions=True)
+        created = dict(r for r in results if not isinstance(r, BaseException))
+        failed = {name: r for name, r in zip(names, results) if isinstance(r, BaseException)}
+        return created, failed
+
+    # name -> id of every cluster in names: one dialog pass for those not already in clusters,
+    # then creation of the ones that do not exist
+    async def __discover_clusters(self, names, clusters):
+        missing = [name for name in names if name not in clusters]
+        if missing:
+            r = await self.client.load_dialogs()
+            if r["status"] == "error":
+                raise Exception(r["message"])
+            for name in missing:
+                r = await self.client.get_dialog_object_by_name(name)
+                if r["status"] == "success" and r["data"] is not None:
+                    clusters[name] = str(r["data"].entity.id)
+            missing = [name for name in names if name not in clusters]
+        if missing:
+            created, failed = await self.__create_clusters(missing)
+            clusters.update(created)
+            if failed:
+                # Keep the channels already created in the map, or they would be orphaned
+                self.__save_cluster_map(clusters)
+                raise Exception("Could not create clusters: " +
+                                ", ".join(f"{name} ({e})" for name, e in failed.items()))
+        return clusters
+
     async def __init_telegram_storage(self):
         try:
             # Connect telegram
             s = await self.client.connect()
             print(s)
-            r = await self.client.get_dialog_object_by_name(self.cluster_name_shared)
 
-            if r["status"] == "success" and r["data"] is None:
-                # Init drive -- create shared drive
-                s = await self.client.create_group(self.cluster_name_shared)
-                if s["status"] == "error":
-                    raise Exception(s["status"])
-
-            r = await self.client.get_dialog_object_by_name(self.cluster_name_shared)
-
-            # Cluster doesn't exist
-            if r["data"] == 0:
-                # You must create MANUALLY group in telegram chat -- api doesn't designed to do it
-                raise Exception("Telegram chat group 'Drive_Layer_Shared' does not exist. Please create it manually.")
-            else:
-                self.shared_drive_object_dialog = r["data"]
-                self.clusters_info["Drive_Layer_Shared"] = str(
-                    self.shared_drive_object_dialog.draft.entity.id)
-                # print(self.shared_drive_object_dialog)
-                # Init name of cluster private
-                for n in self.users:
-                    name = "Drive_Layer_Private_" + str(n)
-                    # GET ID
-                    r = await self.client.get_dialog_object_by_name(name)
-
-                    if r["status"] == "error":
-                        raise Exception(r['message'])
-
-                    if r["status"] == "success" and r["data"] == None:
-                        #Create channel for new users
-                        s = await self.client.create_group(name)
-                        if s["status"] == "error":
-                            raise Exception(s["status"])
-
-                    r = await self.client.get_dialog_object_by_name(name)
-                    self.clusters_info[name] = str(r["data"].draft.entity.id)
+            names = [self.cluster_name_shared] + [self.private_cluster_name(n) for n in self.users]
+            clusters = await self.__discover_clusters(names, self.__load_cluster_map())
+
+            # Stale map entries (cluster deleted, left or forbidden) are rediscovered from the dialogs
+            valid = await self.client.get_channels([clusters[name] for name in names])
+            stale = [name for name in names if int(clusters[name]) not in valid]
+            if stale:
+                print(f"[WARNING] Stale clusters in the map: {', '.join(stale)}")
+                clusters = await self.__discover_clusters(
+                    names, {name: clusters[name] for name in names if name not in stale})
+
+            r = await self.client.get_dialog_object_by_id(clusters[self.cluster_name_shared])
+            if r["status"] == "error":
+                raise Exception(r["message"])
+
+            self.shared_drive_object_dialog = r["data"]
+            self.clusters_info = {name: clusters[name] for name in names}
+            self.__save_cluster_map(clusters)
             return True
 
         except Exception as e:
             raise Exception(str(e))
 
+    # A failed start disconnects its client: the session file stays free for the next attempt
     @classmethod
     async def create(cls, users):
         instance = cls(users)
-        await instance.__init_telegram_storage()
+        try:
+            await instance.__init_telegram_storage()
+        except BaseException:
+            await instance.client.disconnect()
+            raise
         return instance
 
     # Verify if client is connected
@@ -82,12 +138,26 @@ class Layer3_2:
     async def disconnect(self):
         return await self.client.disconnect()
 
+    # Load and scheduler stats of every telegram account of the pool
+    def get_scheduler_stats(self):
+        return self.client.get_pool_stats()
+
+    # Stats of the on-disk download cache
+    def get_download_cache_stats(self):
+        return self.client.get_download_cache_stats()
+
     # Get json clusters info (private and shared)
     def get_clusters_info(self):
         return self.clusters_info
 
+    # Live changes on every cluster -- see TelegramAPI.watch_changes
+    def watch_changes(self, on_file_changed, on_files_deleted):
+        self.client.watch_changes([int(c) for c in self.clusters_info.values()], on_file_changed, on_files_deleted)
+
     # Get chat id by name
     async def get_chat_id_by_name(self, cluster_name):
+        if cluster_name in self.clusters_info:
+            return success("Get chat id successfully", int(self.clusters_info[cluster_name]))
         r = await self.client.get_dialog_object_by_name(cluster_name)
         if r["status"] == "error":
             return error(r["message"])
@@ -96,9 +166,17 @@ class Layer3_2:
         except Exception as e:
             return error(f"[LAYER-3] Error getting chat id: {e}")
 
-    # Get all files from private cluster
-    async def get_all_file_by_cluster_id(self, cluster_id):
-        r = await self.client.get_all_file_by_chatId(cluster_id)
+    # Newest message id of a cluster -- upper bound of a reconcile pass
+    async def get_last_message_id(self, cluster_id):
+        return await self.client.get_last_message_id(cluster_id)
+
+    # Ids of the file messages of a cluster, streamed
+    def iter_file_ids(self, cluster_id, max_id=0):
+        return self.client.iter_file_message_ids(cluster_id, max_id)
+
+    # Get all files from private cluster -- only messages newer than min_id when given
+    async def get_all_file_by_cluster_id(self, cluster_id, min_id=0):
+        r = await self.client.get_all_file_by_chatId(cluster_id, min_id)
         if r["status"] == "error":
             return error(r["message"])
 
@@ -126,8 +204,62 @@ class Layer3_2:
         except Exception as e:
             return {'status': 'error', 'message': "[LAYER-3] " + str(e)}
 
+    # Resumable upload -- file_id, part_size and total_parts of a new upload
+    def new_upload(self, file_size):
+        return self.client.new_upload(file_size)
+
+    # Resumable upload -- save the parts covered by data
+    async def upload_parts(self, file_id, file_size, first_part, data, account=None):
+        return await self.client.upload_parts(file_id, file_size, first_part, data, account)
+
+    # Resumable upload -- send the file once every part is saved
+    async def finalize_upload(self, file_id, file_name, scr_destination, cluster_id, file_size, account=None):
+        n = await self.client.get_dialog_object_by_id(cluster_id)
+        if n["status"] == "error":
+            return {'status': 'error', 'message': n["message"]}
+
+        try:
+            message = f"{file_name}@{scr_destination}"
+            return await self.client.send_uploaded_file(n["data"], file_id, file_size, file_name, message, account)
+        except Exception as e:
+            return {'status': 'error', 'message': "[LAYER-3] " + str(e)}
+
+    # Size and validators of a stored file -- needed to answer Range requests
+    async def get_download_info(self, message_id, cluster_id):
+        n = await self.client.get_dialog_object_by_id(cluster_id)
+        if n["status"] == "error":
+            return error(n["message"])
+
+        m = await self.client.get_native_message_instance(n["data"], message_id)
+        if m["status"] == "error":
+            return error(m["message"])
+
+        document = m["data"].file
+        return success("Download info", {
+            "size": document.size,
+            "mime_type": document.mime_type,
+            "document_id": m["data"].media.document.id,
+            "date": m["data"].date
+        })
+
     # Download file - OK
-    async def download_file(self, message_id, cluster_id):
+    # Only bytes start..end (inclusive) are pulled from telegram; the whole file by default.
+    # With the file's stored location no dialog or message is fetched. on_location(location) is
+    # awaited with a fresh location when none was given or its file reference expired.
+    async def download_file(self, message_id, cluster_id, start=0, end=None, location=None, on_location=None):
+        if location is not None:
+            if end is None:
+                end = location["size"] - 1
+            return self.__iter_location_range(message_id, cluster_id, location, start, end, on_location)
+
+        message = await self.__file_message(message_id, cluster_id)
+        if on_location is not None:
+            await on_location(Media(message).get_location())
+        if end is None:
+            end = message.file.size - 1
+        return self.client.iter_download_range(message, start, end)
+
+    async def __file_message(self, message_id, cluster_id):
         n = await self.client.get_dialog_object_by_id(cluster_id)
         if n["status"] == "error":
             raise Exception(n["message"])
@@ -135,8 +267,27 @@ class Layer3_2:
         m = await self.client.get_native_message_instance(n["data"], message_id)
         if m["status"] == "error":
             raise Exception(m["message"])
+        return m["data"]
+
+    async def __iter_location_range(self, message_id, cluster_id, location, start, end, on_location):
+        position = start
+        try:
+            async for chunk in self.client.iter_download_range(self.client.location_document(location), start, end,
+                                                               origin=(cluster_id, message_id)):
+                position += len(chunk)
+                yield chunk
+            return
+        except FileReferenceExpiredError:
+            print(f"[INFO] File reference of message {message_id} expired, refreshing it")
 
-        return self.client.iter_download_file_by_Media(m["data"])
+        # Continue from the message, fetched again: a cached one may hold the same stale reference
+        self.client.invalidate_message_cache(cluster_id, message_id)
+        message = await self.__file_message(message_id, cluster_id)
+        if on_location is not None:
+            await on_location(Media(message).get_location())
+        if position <= end:
+            async for chunk in self.client.iter_download_range(message, position, end):
+                yield chunk
 
     # Remove definitive object from database -
     async def delete_file(self, message_id, cluster_id):
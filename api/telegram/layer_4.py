@@ -1,19 +1,125 @@
 import asyncio
+import functools
+import uuid
+from datetime import datetime, timedelta, timezone
+from api.telegram.gateway import GatewayClient, GatewayOperationError
 from api.telegram.layer_3_2 import Layer3_2
+from api.telegram.scheduler import priority, PRIORITY_BACKGROUND
 from api.mongodb.mongodb_drive import DriveMongo
 from utils.response_handler import success, error
+from utils.singleflight import SingleFlight
 from utils.config import config
 
 
+# Operations run by the telegram gateway process when this Layer4 has one (several HTTP
+# workers); otherwise here. Errors reaching the gateway are raised.
+def via_gateway(func):
+    @functools.wraps(func)
+    async def wrapper(self, *args, **kwargs):
+        if self.gateway is not None:
+            return await self.gateway.call(func.__name__, *args, **kwargs)
+        return await func(self, *args, **kwargs)
+
+    wrapper.gateway_operation = True
+    return wrapper
+
+
+# Error of an operation that telegram can't serve yet (the HTTP layer answers 503)
+def unavailable(message):
+    return error(message) | {'unavailable': True}
+
+
+# Operations needing telegram: run by the gateway when there is one, and answering with an
+# error until the background startup connected telegram
+def requires_telegram(func):
+    @functools.wraps(func)
+    async def wrapper(self, *args, **kwargs):
+        if self.gateway is not None:
+            try:
+                return await self.gateway.call(func.__name__, *args, **kwargs)
+            except GatewayOperationError as e:
+                return error(str(e))
+            except (ConnectionError, OSError, EOFError) as e:
+                return unavailable(f"Telegram gateway unavailable: {e}")
+        if self.client is None:
+            return unavailable("Telegram is still starting, retry later")
+        return await func(self, *args, **kwargs)
+
+    wrapper.gateway_operation = True
+    return wrapper
+
+
 class Layer4:
-    def __init__(self):
+    # gateway: socket of the telegram gateway process. Without one, this process owns telegram.
+    def __init__(self, gateway=None):
+        self.gateway = GatewayClient(gateway, config.TELEGRAM_GATEWAY_FRAME_SIZE) if gateway else None
         self.client = None
         self.mongo = None
-
+        self.sync_task = None
+        self.startup_task = None
+        self.phase = "starting"
+        self.startup_error = None
+        # Concurrent identical listings share one mongodb query
+        self.listings = SingleFlight()
+
+    # Only mongodb is connected here. Telegram connection, cluster discovery and the first sync
+    # run in the background, metadata reads are served from mongodb meanwhile. Behind a gateway
+    # that is all: the gateway process connects telegram, syncs and applies live changes.
     async def initialize(self):
         self.mongo = await DriveMongo().create(config.MONGO_URL, False)
-        self.client = await Layer3_2.create(self.mongo.get_users_discord_id())
-        await self.mongo.sync_data(self.client)
+        if self.gateway is None:
+            self.startup_task = asyncio.create_task(self.__start_telegram())
+
+    # Retried every config.STARTUP_RETRY_DELAY seconds until it succeeds
+    async def __start_telegram(self):
+        while True:
+            try:
+                if self.client is None:
+                    self.phase = "connecting"
+                    self.client = await Layer3_2.create(await self.mongo.get_users_discord_id())
+                # Edits, deletions and new files in telegram are applied as they happen -- also
+                # during the first sync, writes on both paths are idempotent
+                self.client.watch_changes(self.__on_file_changed, self.__on_files_deleted)
+                self.phase = "syncing"
+                with priority(PRIORITY_BACKGROUND):
+                    await self.mongo.sync_data(self.client)
+                self.phase = "ready"
+                self.startup_error = None
+                return
+            except Exception as e:
+                self.phase = "failed"
+                self.startup_error = str(e)
+                print(f"[ERROR] Startup failed: {e} -- retrying in {config.STARTUP_RETRY_DELAY}s")
+                await asyncio.sleep(config.STARTUP_RETRY_DELAY)
+
+    # Readiness: telegram connected and clusters known. The first sync may still be running,
+    # its per-cluster progress is reported.
+    def readiness(self):
+        return {
+            "ready": self.mongo is not None and self.client is not None,
+            "phase": self.phase,
+            "error": self.startup_error,
+            "sync": dict(self.mongo.sync_progress) if self.mongo is not None else {}
+        }
+
+    # Readiness of the process owning telegram -- the gateway's when there is one
+    @via_gateway
+    async def check_readiness(self):
+        return self.readiness()
+
+    async def __on_file_changed(self, cluster_id, media, edited):
+        self.mongo.file_changed(media, cluster_id, edited)
+
+    async def __on_files_deleted(self, cluster_id, message_ids):
+        self.mongo.files_deleted(cluster_id, message_ids)
+
+    # Stop the background startup and write pending live changes -- called when the server stops
+    async def shutdown(self):
+        if self.startup_task is not None and not self.startup_task.done():
+            self.startup_task.cancel()
+            await asyncio.gather(self.startup_task, return_exceptions=True)
+        if self.mongo is not None:
+            await self.mongo.changes.close()
 
     # ------------------------------------------------------------------------------------------
 
@@ -23,28 +129,68 @@ class Layer4:
 
     # Verify if client is connected -- OK
     def is_connect(self):
-        return self.client.is_connected()
+        return self.client is not None and self.client.is_connected()
 
     # Connect client to telegram api -- OK
+    @requires_telegram
     async def connect(self):
         return await self.client.connect()
 
     # Close connection -- end
+    @requires_telegram
     async def disconnect(self):
         return await self.client.disconnect()
 
     # Update method telegram - mongodb
     # Sync data from telegram drive to mongodb -- OK
-    async def sync_drive(self):
-        return await self.mongo.sync_data(self.client)
+    # full=True ignores the per-cluster watermarks and re-reads every message
+    # reconcile="delete" / "flag" also drops or flags files whose telegram message was deleted
+    # Sync requests queue behind downloads and uploads in the telegram scheduler
+    @requires_telegram
+    async def sync_drive(self, full=False, reconcile=None):
+        with priority(PRIORITY_BACKGROUND):
+            return await self.mongo.sync_data(self.client, full, reconcile)
+
+    # Background sync, at most one at a time -- reconciles whatever a direct insert missed
+    def schedule_sync(self):
+        if self.sync_task is None or self.sync_task.done():
+            self.sync_task = asyncio.create_task(self.sync_drive())
+        return self.sync_task
+
+    # Record a file sent by an upload (Media in r['data']) instead of resyncing the whole drive.
+    # Returns r with the stored document as data.
+    async def __record_upload(self, r, cluster_id):
+        media = r.pop('data', None)
+        if media is None:
+            return r
+        w = await self.mongo.insert_file(media, cluster_id)
+        if w['status'] == 'error':
+            print(f"[WARNING] {w['message']} -- falling back to a background sync")
+            self.schedule_sync()
+            return r
+        return success(r['message'], w['data'])
+
+    # Load of every telegram account, with the queue depth, waits and flood waits of its scheduler
+    @requires_telegram
+    async def get_telegram_stats(self):
+        return success("Telegram scheduler stats", self.client.get_scheduler_stats())
+
+    # Size, hits / misses and evictions of the on-disk download cache (None when disabled)
+    @requires_telegram
+    async def get_download_cache_stats(self):
+        return success("Download cache stats", self.client.get_download_cache_stats())
 
     # Get all cluster info -- OK
+    # Read from mongodb while telegram is still starting
     async def get_clusters_info(self):
+        if self.client is None:
+            return await self.mongo.get_clusters_info()
         return self.client.get_clusters_info()
 
     # Get all file by cluster_id -- OK
     async def get_all_file(self, cluster_id):
-        return await self.mongo.get_all_files_by_cluster_id(cluster_id)
+        return await self.listings.do(("files", str(cluster_id)),
+                                      lambda: self.mongo.get_all_files_by_cluster_id(cluster_id))
 
     # Get file info by cluster_id & file_id -- OK
     async def get_file_info(self, cluster_id, file_id):
@@ -66,7 +212,8 @@ class Layer4:
 
     # Get all folders by cluster_id
     async def get_all_folders_by_cluster_id(self, cluster_id):
-        return await self.get_mongo_client().get_all_folders_by_cluster_id(cluster_id)
+        return await self.listings.do(("folders", str(cluster_id)),
+                                      lambda: self.get_mongo_client().get_all_folders_by_cluster_id(cluster_id))
 
     # --------------------------------------------------------------------
     # --------------------------------------------------------------------
@@ -81,6 +228,7 @@ class Layer4:
         return await self.mongo.update_file_location(cluster_id, file_id, new_location)
 
     # Delete file -- OK
+    @requires_telegram
     async def delete_file(self, cluster_id, file_id):
 
         file = await self.mongo.get_file_by_id(cluster_id, file_id)
@@ -106,20 +254,162 @@ class Layer4:
                 return await self.mongo.trash_file(cluster_id, file_id)
 
     # Upload file -- OK
+    @requires_telegram
     async def upload_file(self, file, scr_destination, cluster_id, file_size):
         try:
             r1 = await self.client.upload_file(file, scr_destination, cluster_id, file_size)
             if r1['status'] == 'error':
                 return {'status': 'error', 'message': r1["message"]}
             else:
-                await self.sync_drive()
-                return r1
+                return await self.__record_upload(r1, cluster_id)
         except Exception as e:
             return {'status': 'error', 'message': str(e)}
 
-    async def download_file(self, cluster_id, file_id):
+    # RESUMABLE UPLOAD
+    # create session -> PUT byte ranges (whole parts, any order, in parallel) -> finalize.
+    # Saved parts are recorded in 'upload-sessions', so after a failure the client asks for the
+    # session status and only re-sends the missing parts.
+
+    # Public view of a session
+    @staticmethod
+    def upload_session_status(session):
+        parts = sorted(session["parts"])
+        done = set(parts)
+        last = session["total_parts"] - 1
+        uploaded_bytes = len(parts) * session["part_size"]
+        if last in done:
+            uploaded_bytes -= (last + 1) * session["part_size"] - session["file_size"]
+        return {
+            "session_id": session["session_id"],
+            "file_name": session["file_name"],
+            "file_size": session["file_size"],
+            "part_size": session["part_size"],
+            "total_parts": session["total_parts"],
+            "uploaded_parts": parts,
+            "missing_parts": [i for i in range(session["total_parts"]) if i not in done],
+            "uploaded_bytes": max(uploaded_bytes, 0),
+            "status": session["status"],
+            "expires_at": session["expires_at"]
+        }
+
+    # A session belongs to the user (email) who created it; the other calls only find it for them
+    @requires_telegram
+    async def create_upload_session(self, cluster_id, scr_destination, file_name, file_size, owner):
+        try:
+            upload = self.client.new_upload(file_size)
+        except ValueError as e:
+            return error(str(e))
+        now = datetime.now(timezone.utc)
+        session = {
+            "session_id": uuid.uuid4().hex,
+            "owner": owner,
+            "cluster_id": int(cluster_id),
+            "destination": scr_destination,
+            "file_name": file_name,
+            "file_size": file_size,
+            **upload,
+            "parts": [],
+            "status": "open",
+            "created_at": now,
+            "expires_at": now + timedelta(seconds=config.UPLOAD_SESSION_TTL)
+        }
+        r = await self.mongo.create_upload_session(session)
+        if r["status"] == "error":
+            return r
+        return success("Upload session created", self.upload_session_status(r["data"]))
+
+    async def get_upload_session(self, session_id, owner):
+        r = await self.mongo.get_upload_session(session_id, owner)
+        if r["status"] == "error":
+            return r
+        return success("Upload session found", self.upload_session_status(r["data"]))
+
+    # data holds whole parts starting at byte offset; only the last part of the file may be short
+    @requires_telegram
+    async def upload_session_part(self, session_id, offset, data, owner):
+        r = await self.mongo.get_upload_session(session_id, owner)
+        if r["status"] == "error":
+            return r
+        session = r["data"]
+        if session["status"] != "open":
+            return error("Upload session is being finalized")
+
+        part_size, file_size = session["part_size"], session["file_size"]
+        end = offset + len(data)
+        if not data or offset < 0 or offset % part_size or end > file_size \
+                or (len(data) % part_size and end != file_size):
+            return error(f"Data must cover whole parts of {part_size} bytes starting at a part boundary")
+
+        r = await self.client.upload_parts(session["file_id"], file_size, offset // part_size, data,
+                                           session.get("account"))
+        if r["status"] == "error":
+            return r
+        r = await self.mongo.add_upload_session_parts(session_id, owner, r["data"])
+        if r["status"] == "error":
+            return r
+        return success("Parts uploaded successfully", self.upload_session_status(r["data"]))
+
+    @requires_telegram
+    async def finalize_upload_session(self, session_id, owner):
+        r = await self.mongo.claim_upload_session(session_id, owner)
+        if r["status"] == "error":
+            return r
+        session = r["data"]
+
+        missing = self.upload_session_status(session)["missing_parts"]
+        if missing:
+            await self.mongo.release_upload_session(session_id)
+            return error(f"{len(missing)} parts are missing, see the session status")
+
+        r = await self.client.finalize_upload(session["file_id"], session["file_name"], session["destination"],
+                                              session["cluster_id"], session["file_size"], session.get("account"))
+        if r["status"] == "error":
+            await self.mongo.release_upload_session(session_id)
+            return r
+        await self.mongo.delete_upload_session(session_id)
+        return await self.__record_upload(r, session["cluster_id"])
+
+    # Telegram location stored with the file record, None if missing -- the message is used then
+    async def __file_location(self, cluster_id, file_id):
+        try:
+            return await self.mongo.get_file_location(cluster_id, file_id)
+        except Exception as e:
+            print(f"[WARNING] Error reading the location of file {file_id}: {e}")
+            return None
+
+    async def __store_location(self, cluster_id, file_id, location):
+        try:
+            await self.mongo.set_file_location(cluster_id, file_id, location)
+        except Exception as e:
+            print(f"[WARNING] Error storing the location of file {file_id}: {e}")
+
+    # Size / etag data of a file for Range requests -- from the stored location when there is one
+    @requires_telegram
+    async def get_download_info(self, cluster_id, file_id):
+        location = await self.__file_location(cluster_id, file_id)
+        if location is None:
+            return await self.client.get_download_info(file_id, cluster_id)
+        date = location["date"]
+        if date.tzinfo is None:
+            # mongodb returns naive UTC datetimes
+            date = date.replace(tzinfo=timezone.utc)
+        return success("Download info", {
+            "size": location["size"],
+            "mime_type": location["mime_type"],
+            "document_id": location["document_id"],
+            "date": date
+        })
+
+    # Download file -- bytes start..end (inclusive), whole file by default
+    # Built from the stored location; a missing or expired one is written back on the way
+    # An error dict instead of the generator when telegram is not ready
+    @requires_telegram
+    async def download_file(self, cluster_id, file_id, start=0, end=None):
         try:
-            async_gen = await self.client.download_file(file_id, cluster_id)
+            location = await self.__file_location(cluster_id, file_id)
+            async_gen = await self.client.download_file(
+                file_id, cluster_id, start, end, location,
+                lambda fresh: self.__store_location(cluster_id, file_id, fresh))
             return async_gen
         except Exception as e:
             raise e
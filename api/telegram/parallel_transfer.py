@@ -0,0 +1,310 @@
+# Parallel transfers over several MTProto connections.
+#
+# Telethon's iter_download() / upload_file() move one part at a time over a single connection,
+# so a transfer is bound by round-trip latency. The downloader here splits the document into
+# aligned parts and fetches them concurrently over a pool of extra senders connected to the
+# file's home DC, then hands them back in order with a bounded reorder window. The uploader
+# reads the source sequentially and keeps a bounded number of parts in flight.
+
+import asyncio
+import inspect
+from telethon import utils
+from telethon.helpers import generate_random_long
+from telethon.network import MTProtoSender
+from telethon.tl.alltlobjects import LAYER
+from telethon.tl.functions import InvokeWithLayerRequest
+from telethon.tl.functions.auth import ExportAuthorizationRequest, ImportAuthorizationRequest
+from telethon.tl.functions.upload import GetFileRequest, SaveBigFilePartRequest, SaveFilePartRequest
+from telethon.tl.types import InputFile, InputFileBig
+from telethon.tl.types.upload import File
+
+MAX_RETRIES = 3
+
+# Telegram requires saveBigFilePart above this size
+BIG_FILE_SIZE = 10 * 1024 * 1024
+
+# Most parts a file can be saved in (telegram limit, 2000 MB with 512 KB parts)
+MAX_PARTS = 4000
+
+
+# Send a request over one of our own senders, through the scheduler when there is one
+async def send_request(scheduler, sender, request):
+    if scheduler is None:
+        return await sender.send(request)
+    return await scheduler.run(request, lambda: sender.send(request))
+
+
+# Idle MTProto senders per DC, reused across transfers
+class SenderPool:
+    def __init__(self, client, max_idle):
+        self.client = client
+        self.max_idle = max_idle
+        self.idle = {}
+        self.auth_keys = {}
+        self._export_lock = asyncio.Lock()
+
+    async def __create_sender(self, dc_id):
+        dc = await self.client._get_dc(dc_id)
+        auth_key = self.client.session.auth_key if dc_id == self.client.session.dc_id else self.auth_keys.get(dc_id)
+        sender = MTProtoSender(auth_key, loggers=self.client._log)
+        await sender.connect(self.client._connection(dc.ip_address, dc.port, dc.id,
+                                                     loggers=self.client._log, proxy=self.client._proxy))
+        if auth_key is None:
+            # Foreign DC: import our authorization once, then reuse its key for every sender
+            async with self._export_lock:
+                auth = await self.client(ExportAuthorizationRequest(dc_id))
+                self.client._init_request.query = ImportAuthorizationRequest(id=auth.id, bytes=auth.bytes)
+                await sender.send(InvokeWithLayerRequest(LAYER, self.client._init_request))
+                self.auth_keys[dc_id] = sender.auth_key
+        return sender
+
+    async def acquire(self, dc_id):
+        idle = self.idle.get(dc_id)
+        if idle:
+            return idle.pop()
+        return await self.__create_sender(dc_id)
+
+    async def release(self, dc_id, sender, broken=False):
+        idle = self.idle.setdefault(dc_id, [])
+        if broken or len(idle) >= self.max_idle:
+            await sender.disconnect()
+        else:
+            idle.append(sender)
+
+    async def close(self):
+        for senders in self.idle.values():
+            for sender in senders:
+                await sender.disconnect()
+        self.idle = {}
+
+
+class ParallelDownloader:
+    def __init__(self, senders, workers, part_size, scheduler=None):
+        # part_size must be a multiple of 4096 that divides 1 MB (telegram upload.getFile limits)
+        self.senders = senders
+        self.workers = workers
+        self.part_size = part_size
+        self.scheduler = scheduler
+
+    # Fetch one part; slot[0] is the worker's sender and is replaced if its connection drops
+    async def __fetch(self, dc_id, slot, location, index):
+        # Without cdn_supported telegram serves every file from its DC, never a FileCdnRedirect
+        request = GetFileRequest(location, offset=index * self.part_size, limit=self.part_size,
+                                 cdn_supported=False)
+        for attempt in range(MAX_RETRIES):
+            try:
+                result = await send_request(self.scheduler, slot[0], request)
+                if not isinstance(result, File):
+                    raise ValueError(f"Unexpected {type(result).__name__} for part {index}")
+                return result.bytes
+            except (ConnectionError, OSError, EOFError):
+                if attempt == MAX_RETRIES - 1:
+                    raise
+                sender, slot[0] = slot[0], None
+                await self.senders.release(dc_id, sender, broken=True)
+                slot[0] = await self.senders.acquire(dc_id)
+        raise ConnectionError(f"Part {index} failed after {MAX_RETRIES} attempts")
+
+    # Stream bytes start..end (inclusive) of a media. At most workers * 2 parts are held in memory.
+    async def download(self, media, start, end):
+        dc_id, location = utils.get_input_location(media)
+        first = start // self.part_size
+        last = end // self.part_size
+        window = self.workers * 2
+        state = {"next_part": first, "next_yield": first, "error": None}
+        parts = {}
+        cond = asyncio.Condition()
+
+        async def worker():
+            slot = [await self.senders.acquire(dc_id)]
+            broken = False
+            try:
+                while True:
+                    async with cond:
+                        await cond.wait_for(lambda: state["next_part"] - state["next_yield"] < window)
+                        if state["next_part"] > last:
+                            return
+                        index = state["next_part"]
+                        state["next_part"] += 1
+                    data = await self.__fetch(dc_id, slot, location, index)
+                    async with cond:
+                        parts[index] = data
+                        cond.notify_all()
+            except asyncio.CancelledError:
+                # A request may still be in flight on this connection
+                broken = True
+                raise
+            except Exception as e:
+                broken = True
+                async with cond:
+                    state["error"] = state["error"] or e
+                    cond.notify_all()
+            finally:
+                if slot[0] is not None:
+                    await self.senders.release(dc_id, slot[0], broken)
+
+        tasks = [asyncio.create_task(worker()) for _ in range(min(self.workers, last - first + 1))]
+        try:
+            while state["next_yield"] <= last:
+                async with cond:
+                    await cond.wait_for(lambda: state["next_yield"] in parts or state["error"] is not None)
+                    if state["next_yield"] not in parts:
+                        raise state["error"]
+                    index = state["next_yield"]
+                    data = parts.pop(index)
+                    state["next_yield"] += 1
+                    cond.notify_all()
+
+                # Trim the first and last part to the requested range
+                part_start = index * self.part_size
+                data = data[max(start - part_start, 0):end + 1 - part_start]
+                if data:
+                    yield data
+        finally:
+            # Finished normally: idle workers exit on their own and keep their connections pooled
+            if state["next_yield"] <= last or state["error"] is not None:
+                for task in tasks:
+                    task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+# Split a source into part_size blocks. The source is either a file-like object (read() may be
+# sync or async) or an async iterable of byte chunks of any size.
+async def iter_parts(source, part_size):
+    if hasattr(source, "read"):
+        while True:
+            if inspect.iscoroutinefunction(source.read):
+                data = await source.read(part_size)
+            else:
+                data = await asyncio.to_thread(source.read, part_size)
+            if not data:
+                return
+            yield data
+    else:
+        buffer = bytearray()
+        async for chunk in source:
+            buffer.extend(chunk)
+            while len(buffer) >= part_size:
+                yield bytes(buffer[:part_size])
+                del buffer[:part_size]
+        if buffer:
+            yield bytes(buffer)
+
+
+class ParallelUploader:
+    def __init__(self, senders, workers, part_size, retries=MAX_RETRIES, scheduler=None):
+        # part_size must be a multiple of 1024 that divides 512 KB (telegram upload.saveFilePart limits)
+        self.senders = senders
+        self.workers = workers
+        self.part_size = part_size
+        self.retries = retries
+        self.scheduler = scheduler
+
+    @staticmethod
+    def new_file_id():
+        return generate_random_long()
+
+    def total_parts(self, file_size):
+        return max(-(-file_size // self.part_size), 1)
+
+    def max_file_size(self):
+        return MAX_PARTS * self.part_size
+
+    # InputFile referencing every saved part of file_id, passed to send_file
+    def input_file(self, file_id, file_size, file_name):
+        if file_size > BIG_FILE_SIZE:
+            return InputFileBig(file_id, self.total_parts(file_size), file_name)
+        return InputFile(file_id, self.total_parts(file_size), file_name, md5_checksum="")
+
+    # Build the request saving one part of file_id
+    def part_request(self, file_id, index, total_parts, data, big):
+        if big:
+            return SaveBigFilePartRequest(file_id, index, total_parts, data)
+        return SaveFilePartRequest(file_id, index, data)
+
+    # Send one part, retrying on dropped connections; slot[0] is the worker's sender. FloodWaits are
+    # handled by the scheduler, one it gives up on is raised.
+    async def send_part(self, dc_id, slot, request):
+        for attempt in range(self.retries):
+            try:
+                if await send_request(self.scheduler, slot[0], request):
+                    return
+                raise ConnectionError("Part not saved")
+            except (ConnectionError, OSError, EOFError):
+                if attempt == self.retries - 1:
+                    raise
+                sender, slot[0] = slot[0], None
+                await self.senders.release(dc_id, sender, broken=True)
+                await asyncio.sleep(2 ** attempt)
+                slot[0] = await self.senders.acquire(dc_id)
+        raise ConnectionError(f"Part {request.file_part} failed after {self.retries} attempts")
+
+    # Save parts first_part .. first_part + count - 1 of file_id, read sequentially from source
+    # (the rest of the file by default). At most workers parts are buffered or in flight, so
+    # memory is O(workers * part_size).
+    async def save_parts(self, source, file_size, dc_id, file_id, first_part=0, count=None):
+        big = file_size > BIG_FILE_SIZE
+        total_parts = self.total_parts(file_size)
+        if count is None:
+            count = total_parts - first_part
+        end_part = first_part + count
+        if first_part < 0 or count < 1 or end_part > total_parts:
+            raise ValueError("Parts out of range")
+        queue = asyncio.Queue(maxsize=self.workers)
+        errors = []
+
+        async def worker():
+            slot = [None]
+            broken = False
+            try:
+                slot[0] = await self.senders.acquire(dc_id)
+                while True:
+                    item = await queue.get()
+                    if item is None:
+                        return
+                    index, data = item
+                    await self.send_part(dc_id, slot, self.part_request(file_id, index, total_parts, data, big))
+            except asyncio.CancelledError:
+                broken = True
+                raise
+            except Exception as e:
+                broken = True
+                errors.append(e)
+            finally:
+                if slot[0] is not None:
+                    await self.senders.release(dc_id, slot[0], broken)
+            # Failed: keep draining so the reader never blocks on a full queue, it stops at its next part
+            while await queue.get() is not None:
+                pass
+
+        tasks = [asyncio.create_task(worker()) for _ in range(min(self.workers, count))]
+        try:
+            index = first_part
+            async for data in iter_parts(source, self.part_size):
+                if errors:
+                    raise errors[0]
+                if index >= end_part:
+                    raise ValueError("Source is larger than the announced size")
+                await queue.put((index, data))
+                index += 1
+            if file_size == 0 and index == first_part:
+                # An empty file is still sent as one (empty) part
+                await queue.put((index, b""))
+                index += 1
+            if index != end_part:
+                raise ValueError("Source is smaller than the announced size")
+            for _ in tasks:
+                await queue.put(None)
+            await asyncio.gather(*tasks)
+            if errors:
+                raise errors[0]
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    # Upload the whole source and return the InputFile to pass to send_file
+    async def upload(self, source, file_size, file_name, dc_id):
+        file_id = self.new_file_id()
+        await self.save_parts(source, file_size, dc_id, file_id)
+        return self.input_file(file_id, file_size, file_name)
@@ -0,0 +1,230 @@
+# Central scheduler for every request sent to Telegram.
+#
+# Requests are grouped in method classes (download, upload, write, read, other), each with its
+# own token bucket. When a bucket is empty, callers queue by priority: interactive downloads go
+# ahead of uploads, which go ahead of background syncs. A FloodWait pauses the whole class for
+# the time Telegram asks and the request is retried. Short waits are absorbed here, longer ones
+# are raised to the caller. Queue depth, wait times and flood waits are kept per class.
+
+import asyncio
+import contextlib
+import contextvars
+import heapq
+import itertools
+import time
+from telethon import TelegramClient
+from telethon.errors import FloodWaitError
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BACKGROUND = 2
+
+# Priority of the telegram requests made by the current task (inherited by the tasks it creates)
+telegram_priority = contextvars.ContextVar("telegram_priority", default=PRIORITY_NORMAL)
+
+
+@contextlib.contextmanager
+def priority(level):
+    token = telegram_priority.set(level)
+    try:
+        yield
+    finally:
+        telegram_priority.reset(token)
+
+
+# Iterate an async iterator whose telegram requests are made at the given priority. A context
+# variable set inside an async generator would leak into the consumer between yields (and
+# could not be reset from another context on close), so each step runs in a task of its own
+# context instead; the tasks it creates inherit the priority.
+async def iter_at_priority(level, iterator):
+    context = contextvars.copy_context()
+    context.run(telegram_priority.set, level)
+
+    async def step():
+        return await iterator.__anext__()
+
+    async def close():
+        await iterator.aclose()
+
+    try:
+        while True:
+            try:
+                item = await asyncio.create_task(step(), context=context)
+            except StopAsyncIteration:
+                return
+            yield item
+    finally:
+        await asyncio.create_task(close(), context=context)
+
+
+METHOD_CLASSES = {
+    "upload.getFile": "download",
+    "upload.saveFilePart": "upload",
+    "upload.saveBigFilePart": "upload",
+    "messages.sendMedia": "write",
+    "messages.sendMessage": "write",
+    "messages.editMessage": "write",
+    "messages.deleteMessages": "write",
+    "channels.deleteMessages": "write",
+    "channels.createChannel": "write",
+    "messages.getHistory": "read",
+    "messages.getMessages": "read",
+    "channels.getMessages": "read",
+    "messages.getDialogs": "read",
+}
+
+
+def method_class(request):
+    return METHOD_CLASSES.get(getattr(request, "QUALIFIED_NAME", None), "other")
+
+
+# "download=100:200,write=1:5" -> {"download": (100.0, 200.0), "write": (1.0, 5.0)}
+# (requests per second : burst). A rate of 0 disables the limit of that class.
+def parse_limits(spec):
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, value = item.partition("=")
+        rate, _, burst = value.partition(":")
+        limits[name.strip()] = (float(rate), float(burst or rate or 1))
+    return limits
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.waiters = []
+        self._seq = itertools.count()
+        self._wakeup = None
+
+    def __take(self):
+        now = time.monotonic()
+        if now < self.paused_until:
+            return False
+        if self.rate <= 0:
+            return True
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def __schedule(self):
+        if self._wakeup is not None or not self.waiters:
+            return
+        now = time.monotonic()
+        delay = max(self.paused_until - now, 0.0)
+        if self.rate > 0 and self.tokens < 1:
+            delay = max(delay, (1 - self.tokens) / self.rate)
+        self._wakeup = asyncio.get_running_loop().call_later(delay, self.__dispatch)
+
+    def __dispatch(self):
+        self._wakeup = None
+        while self.waiters:
+            future = self.waiters[0][2]
+            if future.done():
+                # Waiter cancelled
+                heapq.heappop(self.waiters)
+                continue
+            if not self.__take():
+                break
+            heapq.heappop(self.waiters)
+            future.set_result(None)
+        self.__schedule()
+
+    # Wait for a token; lower priority values are served first, FIFO within a priority
+    async def acquire(self, level):
+        if not self.waiters and self.__take():
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (level, next(self._seq), future))
+        self.__schedule()
+        await future
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        if self._wakeup is not None:
+            self._wakeup.cancel()
+            self._wakeup = None
+        if self.waiters:
+            self.__schedule()
+
+    def queued(self):
+        return sum(1 for waiter in self.waiters if not waiter[2].done())
+
+
+class TelegramScheduler:
+    # limits: {class: (rate, burst)}. FloodWaits up to max_flood_wait seconds are slept through
+    # and retried at most retries times.
+    def __init__(self, limits, max_flood_wait, retries):
+        self.limits = limits
+        self.max_flood_wait = max_flood_wait
+        self.retries = retries
+        self.buckets = {}
+        self.metrics = {}
+
+    def __bucket(self, name):
+        bucket = self.buckets.get(name)
+        if bucket is None:
+            rate, burst = self.limits.get(name, self.limits.get("other", (0, 1)))
+            bucket = self.buckets[name] = TokenBucket(rate, burst)
+            self.metrics[name] = {"calls": 0, "flood_waits": 0, "flood_wait_seconds": 0,
+                                  "total_wait_ms": 0.0, "max_wait_ms": 0.0}
+        return bucket
+
+    # Run call() -- which sends request -- when its class allows it
+    async def run(self, request, call):
+        name = method_class(request)
+        bucket = self.__bucket(name)
+        metrics = self.metrics[name]
+        for attempt in range(self.retries + 1):
+            started = time.perf_counter()
+            await bucket.acquire(telegram_priority.get())
+            wait_ms = (time.perf_counter() - started) * 1000
+            metrics["calls"] += 1
+            metrics["total_wait_ms"] += wait_ms
+            metrics["max_wait_ms"] = max(metrics["max_wait_ms"], wait_ms)
+            try:
+                return await call()
+            except FloodWaitError as e:
+                bucket.pause(e.seconds)
+                metrics["flood_waits"] += 1
+                metrics["flood_wait_seconds"] += e.seconds
+                print(f"[WARNING] FloodWait of {e.seconds}s on {name} requests")
+                if e.seconds > self.max_flood_wait or attempt == self.retries:
+                    raise
+
+    def stats(self):
+        now = time.monotonic()
+        result = {}
+        for name, bucket in self.buckets.items():
+            metrics = self.metrics[name]
+            result[name] = {
+                "rate": bucket.rate,
+                "burst": bucket.burst,
+                "queued": bucket.queued(),
+                "paused_seconds": round(max(bucket.paused_until - now, 0.0), 3),
+                "calls": metrics["calls"],
+                "flood_waits": metrics["flood_waits"],
+                "flood_wait_seconds": metrics["flood_wait_seconds"],
+                "avg_wait_ms": round(metrics["total_wait_ms"] / metrics["calls"], 3) if metrics["calls"] else 0.0,
+                "max_wait_ms": round(metrics["max_wait_ms"], 3)
+            }
+        return result
+
+
+# TelegramClient whose every request (including those made by iter_messages, send_file, ...)
+# goes through the scheduler. Telethon's own flood sleeping is disabled, the scheduler does it.
+class ScheduledTelegramClient(TelegramClient):
+    def __init__(self, scheduler, *args, **kwargs):
+        kwargs.setdefault("flood_sleep_threshold", 0)
+        super().__init__(*args, **kwargs)
+        self.scheduler = scheduler
+
+    async def _call(self, sender, request, ordered=False, flood_sleep_threshold=None):
+        return await self.scheduler.run(
+            request, lambda: super(ScheduledTelegramClient, self)._call(sender, request, ordered, flood_sleep_threshold))
@@ -0,0 +1,79 @@
+# Event-loop latency under mixed load: a streaming task (like a /download forwarding chunks)
+# runs next to concurrent metadata queries.
+#
+#   before -- the blocking pymongo call runs directly inside the coroutine (old DriveMongo)
+#   after  -- the call goes through MongoExecutor (api/mongodb/mongodb_executor.py)
+#
+# A query is emulated with time.sleep(query_ms): pymongo spends its time blocked on the socket,
+# so this reproduces its effect on the loop without needing a MongoDB server.
+# Usage: python -m benchmarks.event_loop_latency [--clients 20] [--queries 10] [--query-ms 15]
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from api.mongodb.mongodb_executor import MongoExecutor
+
+TICK = 0.005
+
+
+def blocking_query(query_ms):
+    time.sleep(query_ms / 1000)
+    return True
+
+
+async def streamer(stop, lags):
+    # Expected to wake every TICK seconds; any extra delay is event-loop lag
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append((time.perf_counter() - start - TICK) * 1000)
+
+
+async def client(run_query, queries):
+    for _ in range(queries):
+        await run_query()
+
+
+async def scenario(mode, clients, queries, query_ms, workers):
+    executor = MongoExecutor(workers)
+
+    async def run_query():
+        if mode == "before":
+            return blocking_query(query_ms)
+        return await executor.run(blocking_query, query_ms)
+
+    lags = []
+    stop = asyncio.Event()
+    stream_task = asyncio.create_task(streamer(stop, lags))
+    started = time.perf_counter()
+    await asyncio.gather(*(client(run_query, queries) for _ in range(clients)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await stream_task
+    executor.shutdown()
+
+    lags.sort()
+    return {
+        "mode": mode,
+        "queries/s": round(clients * queries / elapsed, 1),
+        "lag_p50_ms": round(statistics.median(lags), 2) if lags else None,
+        "lag_p99_ms": round(lags[int(len(lags) * 0.99) - 1], 2) if lags else None,
+        "lag_max_ms": round(lags[-1], 2) if lags else None,
+        "stream_ticks": len(lags),
+    }
+
+
+async def main(args):
+    for mode in ("before", "after"):
+        print(await scenario(mode, args.clients, args.queries, args.query_ms, args.workers))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Event-loop latency with blocking vs executor MongoDB calls")
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--queries", type=int, default=10)
+    parser.add_argument("--query-ms", type=float, default=15)
+    parser.add_argument("--workers", type=int, default=16)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,120 @@
+# Upload throughput of the parallel upload engine (api/telegram/parallel_transfer.py) against a
+# local stand-in for a Telegram DC.
+#
+# The stand-in accepts one saveFilePart / saveBigFilePart at a time per connection, waits
+# rtt_ms (round trip + server processing) plus the time the part takes at conn_mbps (the
+# per-connection bandwidth Telegram grants), then acknowledges it. workers=1 is the sequential
+# upload Telethon's upload_file() performs; higher values keep that many parts in flight.
+# Usage: python -m benchmarks.upload_throughput [--size-mb 50] [--rtt-ms 80] [--conn-mbps 8] [--workers 1 2 4 8]
+
+import argparse
+import asyncio
+import io
+import os
+import struct
+import time
+
+from api.telegram.parallel_transfer import ParallelUploader
+
+
+async def serve_connection(reader, writer, rtt_ms, conn_mbps):
+    try:
+        while True:
+            (length,) = struct.unpack("<I", await reader.readexactly(4))
+            await reader.readexactly(length)
+            await asyncio.sleep(rtt_ms / 1000 + length / (conn_mbps * 1024 * 1024))
+            writer.write(b"\x01")
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    except asyncio.CancelledError:
+        # Server shutting down: end quietly, the results are already printed
+        pass
+    finally:
+        writer.close()
+
+
+# Stand-in for an MTProto sender: one request in flight per connection
+class StandInSender:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    async def send(self, request):
+        payload = bytes(request)
+        self.writer.write(struct.pack("<I", len(payload)) + payload)
+        await self.writer.drain()
+        return await self.reader.readexactly(1) == b"\x01"
+
+    async def disconnect(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+# Same interface as SenderPool, connecting to the stand-in server
+class StandInSenderPool:
+    def __init__(self, port):
+        self.port = port
+        self.idle = []
+        self.connections = 0
+
+    async def acquire(self, dc_id):
+        if self.idle:
+            return self.idle.pop()
+        self.connections += 1
+        return StandInSender(*await asyncio.open_connection("127.0.0.1", self.port))
+
+    async def release(self, dc_id, sender, broken=False):
+        if broken:
+            await sender.disconnect()
+        else:
+            self.idle.append(sender)
+
+    async def close(self):
+        for sender in self.idle:
+            await sender.disconnect()
+        self.idle = []
+
+
+async def scenario(port, data, workers, part_size):
+    senders = StandInSenderPool(port)
+    uploader = ParallelUploader(senders, workers, part_size)
+    started = time.perf_counter()
+    input_file = await uploader.upload(io.BytesIO(data), len(data), "benchmark.bin", dc_id=0)
+    elapsed = time.perf_counter() - started
+    await senders.close()
+    return {
+        "workers": workers,
+        "parts": input_file.parts,
+        "connections": senders.connections,
+        "seconds": round(elapsed, 2),
+        "MB/s": round(len(data) / elapsed / (1024 * 1024), 2),
+    }
+
+
+async def main(args):
+    handlers = set()
+
+    def handle(reader, writer):
+        task = asyncio.ensure_future(serve_connection(reader, writer, args.rtt_ms, args.conn_mbps))
+        handlers.add(task)
+        task.add_done_callback(handlers.discard)
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    data = os.urandom(int(args.size_mb * 1024 * 1024))
+    async with server:
+        for workers in args.workers:
+            print(await scenario(port, data, workers, args.part_size))
+            # The scenario closed its connections: let the server side finish them
+            await asyncio.gather(*handlers)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sequential vs parallel upload throughput against a stand-in DC")
+    parser.add_argument("--size-mb", type=float, default=50)
+    parser.add_argument("--rtt-ms", type=float, default=80)
+    parser.add_argument("--conn-mbps", type=float, default=8)
+    parser.add_argument("--part-size", type=int, default=512 * 1024)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    asyncio.run(main(parser.parse_args()))
@@ -51,6 +51,19 @@ class Media:
     def get_date(self):
         return self.get_mediaTelegram().document.date
 
+    # Where telegram serves the document from -- enough to download it without the message
+    def get_location(self):
+        document = self.get_mediaTelegram().document
+        return {
+            "document_id": document.id,
+            "access_hash": document.access_hash,
+            "file_reference": document.file_reference,
+            "dc_id": document.dc_id,
+            "size": document.size,
+            "mime_type": document.mime_type,
+            "date": document.date
+        }
+
     def __str__(self):
         result = [
             f"ID Message: {self.get_id_message()}",
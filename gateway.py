@@ -0,0 +1,38 @@
+import asyncio
+import signal
+from api.mongodb.mongodb_executor import shutdown_executor
+from api.mongodb.mongodb_pool import close_client
+from api.telegram.gateway import GatewayServer
+from api.telegram.layer_4 import Layer4
+from utils.config import config
+
+
+# Telegram gateway process: owns the telegram sessions (connection, syncs, live changes) and
+# serves the telegram operations of the HTTP workers started with the same TELEGRAM_GATEWAY
+async def serve():
+    if not config.TELEGRAM_GATEWAY:
+        raise SystemExit("[ERROR] TELEGRAM_GATEWAY (socket path) is not set")
+
+    layer4 = Layer4()
+    await layer4.initialize()
+    server = GatewayServer(layer4, config.TELEGRAM_GATEWAY)
+    await server.start()
+    print(f"[INFO] Telegram gateway listening on {config.TELEGRAM_GATEWAY}")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+    print("[INFO] Stopping telegram gateway")
+    await server.close()
+    await layer4.shutdown()
+    if layer4.client is not None:
+        await layer4.disconnect()
+    close_client()
+    shutdown_executor(wait=False)
+
+
+if __name__ == "__main__":
+    asyncio.run(serve())
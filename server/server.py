@@ -1,9 +1,13 @@
 from quart import Quart, session, request, jsonify, g, Response
 from api.mongodb.mongodb_login import MongoDBLogin
+from api.mongodb.mongodb_pool import pool_health, close_client
+from api.mongodb.mongodb_executor import shutdown_executor
 from api.telegram.layer_4 import Layer4
+from server.streaming_upload import StreamingUploadMiddleware
 from utils.config import config
 from functools import wraps
-from utils.utils_functions import get_value_from_string
+from utils.utils_functions import get_value_from_string, parse_range_header, if_range_matches
+from email.utils import format_datetime
 from quart_cors import cors, route_cors
 
 app = Quart(__name__)
@@ -15,7 +19,9 @@ app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB
 
 app = cors(app,allow_origin="*")
 
-layer4 = Layer4()
+# With TELEGRAM_GATEWAY set, telegram operations go to the gateway process (gateway.py)
+layer4 = Layer4(config.TELEGRAM_GATEWAY or None)
+auth_mongo = None
 
 
 async def initialize():
@@ -24,13 +30,24 @@ async def initialize():
 
 @app.before_serving
 async def setup():
+    get_mongo_connection().start_revocation_watch()
     await initialize()
 
 
+@app.after_serving
+async def shutdown():
+    get_mongo_connection().stop_revocation_watch()
+    await layer4.shutdown()
+    close_client()
+    shutdown_executor(wait=False)
+
+
+# One MongoDBLogin for the whole process -- it runs on the shared connection pool
 def get_mongo_connection():
-    if 'mongo' not in g:
-        g.mongo = MongoDBLogin(config.SECRET_KEY)
-    return g.mongo
+    global auth_mongo
+    if auth_mongo is None:
+        auth_mongo = MongoDBLogin(config.SECRET_KEY)
+    return auth_mongo
 
 
 def token_required(f):
@@ -40,10 +57,12 @@ def token_required(f):
         auth = get_mongo_connection()
         if not token:
             return jsonify({'status': 'error', 'message': 'Token not provided in headers'}), 400
-        if not auth.verify_token(token):
+        decoded = await auth.verify_token(token)
+        if not decoded:
             return jsonify({'status': 'error', 'message': 'Invalid or expired token'}), 401
 
         g.token = token
+        g.user = decoded
         return await f(*args, **kwargs)
 
     return decorated
@@ -61,9 +80,9 @@ async def login():
         return jsonify({'status': 'error', 'message': 'Invalid parameters'}), 400
 
     auth = get_mongo_connection()
-    token = auth.login(email, password)
+    token = await auth.login(email, password)
     if token:
-        usr = auth.get_user_by_token(token)
+        usr = await auth.get_user_by_token(token)
         if not usr:
             return jsonify({'status': 'error', 'message': "Internal Error -- can't retrieve usr"}), 401
 
@@ -94,13 +113,56 @@ async def ping():
     auth = get_mongo_connection()
 
     print('kiquan')
-    token = auth.create_user("nghiangogv@gmail.com", "Nghia385685", "869892121446998056", "")
+    token = await auth.create_user("nghiangogv@gmail.com", "Nghia385685", "869892121446998056", "")
     if token:
         print("User registered and logged in successfully! Token:", token)
 
     return jsonify({'status': 'success', 'message': layer4.is_connect(), 'data': token})
 
 
+# Liveness -- the process and its event loop respond
+@app.route('/healthz', methods=['GET'])
+async def healthz():
+    return jsonify({'status': 'success', 'message': 'alive'}), 200
+
+
+# Readiness -- telegram connected and clusters known (503 until then), with startup sync progress
+@app.route('/readyz', methods=['GET'])
+async def readyz():
+    try:
+        state = await layer4.check_readiness()
+    except (ConnectionError, OSError, EOFError) as e:
+        return jsonify({'status': 'error', 'message': f'Telegram gateway unavailable: {e}'}), 503
+    if state['ready']:
+        return jsonify({'status': 'success', 'data': state}), 200
+    return jsonify({'status': 'error', 'message': 'Starting', 'data': state}), 503
+
+
+# MongoDB connection pool settings and health
+@app.route('/mongo-pool', methods=['GET'])
+@route_cors(allow_origin='*')
+@token_required
+async def mongo_pool():
+    stats = await pool_health()
+    return jsonify({'status': 'success' if stats['healthy'] else 'error', 'data': stats}), 200 if stats['healthy'] else 503
+
+
+# On-disk download cache: size, hits / misses and evictions
+@app.route('/download-cache', methods=['GET'])
+@route_cors(allow_origin='*')
+@token_required
+async def download_cache_stats():
+    return jsonify(await layer4.get_download_cache_stats())
+
+
+# Telegram accounts: load, and scheduler queue depth, wait time and flood waits per method class
+@app.route('/telegram-stats', methods=['GET'])
+@route_cors(allow_origin='*')
+@token_required
+async def telegram_stats():
+    return jsonify(await layer4.get_telegram_stats())
+
+
 # Logout
 @app.route('/logout', methods=['POST'])
 @route_cors(allow_origin='*')
@@ -109,18 +171,25 @@ async def logout():
     token = request.headers.get('Authorization')
     auth = get_mongo_connection()
 
-    if auth.logout(token):
+    if await auth.logout(token):
         return jsonify({'status': 'success', 'message': 'Logout successful'}), 200
     else:
         return jsonify({'status': 'error', 'message': 'Error during logout'}), 400
 
 
 # Layer4 - Sync Drive -- Sync drive-telegram -- OK
+# ?full=true re-reads the whole telegram history instead of only new messages
+# ?reconcile=delete|flag removes or flags files whose telegram message no longer exists
 @app.route('/sync-drive', methods=['GET'])
 @route_cors(allow_origin='*')
 @token_required
 async def sync_drive():
-    return jsonify(await layer4.sync_drive())
+    full = request.args.get('full', '').lower() in ('1', 'true', 'yes')
+    reconcile = request.args.get('reconcile') or None
+    if reconcile not in (None, 'delete', 'flag'):
+        return jsonify({'status': 'error', 'message': "reconcile must be 'delete' or 'flag'"}), 400
+    result = await layer4.sync_drive(full, reconcile)
+    return jsonify(result), {'success': 200, 'partial': 207}.get(result['status'], 500)
 
 
 # Layer4 - Get All Files in private cluster -- OK
@@ -267,11 +336,74 @@ async def upload_file():
     return jsonify(result)
 
 
-@app.route('/download', methods=['POST'])
+# Layer4 - Resumable upload: create session
+@app.route('/upload-session', methods=['POST'])
 @route_cors(allow_origin='*')
 @token_required
-async def download_file():
+async def create_upload_session():
     data = await request.json
+    id_cluster = data.get('c')
+    scr_destination = data.get('destination')
+    file_name = data.get('file_name')
+    file_size = data.get('file_size')
+
+    if not id_cluster or not scr_destination or not file_name or file_size is None:
+        return jsonify({'status': 'error', 'message': 'c, destination, file_name e file_size sono richiesti'}), 400
+
+    try:
+        file_size = int(file_size)
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'file_size deve essere un intero'}), 400
+
+    result = await layer4.create_upload_session(id_cluster, scr_destination, file_name, file_size,
+                                                g.user["email"])
+    return jsonify(result), 201 if result['status'] == 'success' else 400
+
+
+# Layer4 - Resumable upload: session status (GET) / upload whole parts at ?offset= (PUT)
+@app.route('/upload-session/<session_id>', methods=['GET', 'PUT'])
+@route_cors(allow_origin='*', allow_methods=['GET', 'PUT'])
+@token_required
+async def upload_session(session_id):
+    if request.method == 'GET':
+        result = await layer4.get_upload_session(session_id, g.user["email"])
+        return jsonify(result), 200 if result['status'] == 'success' else 404
+
+    try:
+        offset = int(request.args.get('offset', ''))
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'offset deve essere un intero'}), 400
+
+    result = await layer4.upload_session_part(session_id, offset, await request.get_data(), g.user["email"])
+    return jsonify(result), 200 if result['status'] == 'success' else 400
+
+
+# Layer4 - Resumable upload: send the file once every part is uploaded
+@app.route('/upload-session/<session_id>/finalize', methods=['POST'])
+@route_cors(allow_origin='*')
+@token_required
+async def finalize_upload_session(session_id):
+    result = await layer4.finalize_upload_session(session_id, g.user["email"])
+    return jsonify(result), 200 if result['status'] == 'success' else 409
+
+
+# Layer4 - Streaming upload (POST /upload-stream, see server/streaming_upload.py)
+# The body is piped into the telegram upload as it arrives, so MAX_CONTENT_LENGTH does not apply
+async def authenticate_upload(token):
+    return await get_mongo_connection().verify_token(token)
+
+
+app.asgi_app = StreamingUploadMiddleware(app.asgi_app, '/upload-stream', authenticate_upload, layer4.upload_file)
+
+
+# Layer4 - Download File
+# GET/HEAD take query parameters and honour Range / If-Range (206 Partial Content);
+# POST with a JSON body is kept for older clients.
+@app.route('/download', methods=['GET', 'HEAD', 'POST'])
+@route_cors(allow_origin='*', expose_headers=['Content-Range', 'Content-Length', 'Accept-Ranges', 'ETag'])
+@token_required
+async def download_file():
+    data = await request.json if request.method == 'POST' else request.args
     cluster_id = data.get('cluster_id')
     file_id = data.get('file_id')
     name_file = data.get('name_file')
@@ -281,7 +413,42 @@ async def download_file():
             {'status': 'error', 'message': 'Cluster ID, File ID, and File Name are required'}), 400
 
     try:
-        async_gen = await layer4.download_file(cluster_id, file_id)
+        info = await layer4.get_download_info(cluster_id, file_id)
+        if info['status'] == 'error':
+            return jsonify(info), 503 if info.get('unavailable') else 404
+
+        size = info['data']['size']
+        etag = f'"{info["data"]["document_id"]}-{size}"'
+        last_modified = format_datetime(info['data']['date'], usegmt=True)
+        headers = {
+            'Content-Disposition': f'attachment; filename="{name_file}"',
+            'Accept-Ranges': 'bytes',
+            'ETag': etag,
+            'Last-Modified': last_modified
+        }
+
+        byte_range = None
+        if size > 0 and if_range_matches(request.headers.get('If-Range'), etag, last_modified):
+            byte_range = parse_range_header(request.headers.get('Range'), size)
+            if byte_range is False:
+                headers['Content-Range'] = f'bytes */{size}'
+                return Response(b'', status=416, headers=headers)
+
+        status = 200
+        start, end = 0, size - 1
+        if byte_range:
+            status = 206
+            start, end = byte_range
+            headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+
+        if request.method == 'HEAD' or size == 0:
+            response = Response(b'', status=status, headers=headers, content_type='application/octet-stream')
+            response.content_length = end - start + 1
+            return response
+
+        async_gen = await layer4.download_file(cluster_id, file_id, start, end)
+        if isinstance(async_gen, dict):
+            return jsonify(async_gen), 503 if async_gen.get('unavailable') else 500
 
         async def generate():
             try:
@@ -290,10 +457,9 @@ async def download_file():
             except Exception as e:
                 print(f"Errore durante il download: {e}")
 
-        headers = {
-            'Content-Disposition': f'attachment; filename="{name_file}"'
-        }
-        return Response(generate(), headers=headers, content_type='application/octet-stream')
+        response = Response(generate(), status=status, headers=headers, content_type='application/octet-stream')
+        response.content_length = end - start + 1
+        return response
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
@@ -0,0 +1,153 @@
+# Streaming upload endpoint, mounted in front of the Quart app as raw ASGI middleware.
+#
+# Quart's request.files / request.form spool the whole body before a handler runs, and its
+# request.body buffers every received chunk whether or not it has been consumed. Here the
+# body is pulled from ASGI receive() only when the Telegram uploader asks for the next part,
+# so the server stops reading the socket while parts are in flight (backpressure) and memory
+# per upload stays O(UPLOAD_WORKERS * UPLOAD_PART_SIZE) whatever the file size.
+#
+#   POST /upload-stream?c=<cluster_id>&destination=<path>&file_size=<bytes>[&name=<file name>]
+#
+# The body is either the raw file (any non-multipart Content-Type, 'name' required) or a
+# multipart/form-data body whose first file part is uploaded. Metadata travels in the query
+# string because multipart fields placed after the file would only be seen once it is uploaded.
+
+import json
+from datetime import date
+from urllib.parse import parse_qs
+from werkzeug.http import parse_options_header, http_date
+from werkzeug.sansio.multipart import MultipartDecoder, NeedData, File, Data, Epilogue
+
+
+# What the upload layers need from a file: mirrors werkzeug FileStorage's filename / stream
+class StreamedFile:
+    def __init__(self, filename, stream):
+        self.filename = filename
+        self.stream = stream
+
+
+# Dates as Quart's jsonify writes them (the stored file document of an upload has one)
+def json_default(value):
+    if isinstance(value, date):
+        return http_date(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+# Request body chunks straight from ASGI receive()
+async def body_chunks(receive):
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            raise ConnectionError("Client disconnected during upload")
+        if message.get("body"):
+            yield message["body"]
+        if not message.get("more_body", False):
+            return
+
+
+# Incremental multipart/form-data reader exposing the first file part as a byte stream
+class MultipartFileReader:
+    def __init__(self, chunks, boundary):
+        self.chunks = chunks
+        self.decoder = MultipartDecoder(boundary)
+        self.complete = False
+
+    async def __next_event(self):
+        while True:
+            event = self.decoder.next_event()
+            if not isinstance(event, NeedData):
+                return event
+            if self.complete:
+                raise ValueError("Truncated multipart body")
+            try:
+                self.decoder.receive_data(await self.chunks.__anext__())
+            except StopAsyncIteration:
+                self.complete = True
+                self.decoder.receive_data(None)
+
+    # Skip to the first file part and return its file name
+    async def open(self):
+        while True:
+            event = await self.__next_event()
+            if isinstance(event, File):
+                return event.filename
+            if isinstance(event, Epilogue):
+                raise ValueError("No file in multipart body")
+
+    async def read_file(self):
+        while True:
+            event = await self.__next_event()
+            if isinstance(event, Data):
+                if event.data:
+                    yield event.data
+                if not event.more_data:
+                    return
+
+
+class StreamingUploadMiddleware:
+    # authenticate(token) -> bool and upload(file, destination, cluster_id, file_size) -> dict
+    # are coroutines supplied by the server
+    def __init__(self, app, path, authenticate, upload):
+        self.app = app
+        self.path = path
+        self.authenticate = authenticate
+        self.upload = upload
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] != self.path:
+            return await self.app(scope, receive, send)
+        if scope["method"] == "OPTIONS":
+            return await self.__respond(send, 204, None)
+        if scope["method"] != "POST":
+            return await self.__respond(send, 405, {'status': 'error', 'message': 'Method not allowed'})
+
+        headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope["headers"]}
+        token = headers.get("authorization")
+        if not token:
+            return await self.__respond(send, 400, {'status': 'error', 'message': 'Token not provided in headers'})
+        if not await self.authenticate(token):
+            return await self.__respond(send, 401, {'status': 'error', 'message': 'Invalid or expired token'})
+
+        args = {k: v[0] for k, v in parse_qs(scope["query_string"].decode("latin-1")).items()}
+        id_cluster = args.get('c')
+        scr_destination = args.get('destination')
+        try:
+            file_size = int(args.get('file_size', ''))
+        except ValueError:
+            return await self.__respond(send, 400, {'status': 'error', 'message': 'file_size deve essere un intero'})
+        if not scr_destination or not id_cluster:
+            return await self.__respond(send, 400, {'status': 'error', 'message': 'Destination e id_cluster sono richiesti'})
+
+        chunks = body_chunks(receive)
+        try:
+            content_type, options = parse_options_header(headers.get("content-type", ""))
+            if content_type == "multipart/form-data":
+                if "boundary" not in options:
+                    raise ValueError("Missing multipart boundary")
+                reader = MultipartFileReader(chunks, options["boundary"].encode("latin-1"))
+                part_filename = await reader.open()
+                file = StreamedFile(args.get('name') or part_filename, reader.read_file())
+            else:
+                file = StreamedFile(args.get('name'), chunks)
+            if not file.filename:
+                return await self.__respond(send, 400, {'status': 'error', 'message': 'Il nome del file è richiesto'})
+        except (ValueError, ConnectionError) as e:
+            return await self.__respond(send, 400, {'status': 'error', 'message': str(e)})
+
+        result = await self.upload(file, scr_destination, id_cluster, file_size)
+        await self.__respond(send, 200, result)
+
+    @staticmethod
+    async def __respond(send, status, payload):
+        headers = [
+            (b"access-control-allow-origin", b"*"),
+            (b"access-control-allow-methods", b"POST, OPTIONS"),
+            (b"access-control-allow-headers", b"Authorization, Content-Type"),
+        ]
+        body = b""
+        if payload is not None:
+            body = json.dumps(payload, default=json_default).encode()
+            headers.append((b"content-type", b"application/json"))
+        headers.append((b"content-length", str(len(body)).encode()))
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
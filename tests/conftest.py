@@ -0,0 +1,6 @@
+import os
+
+# utils.config exits when the required settings are missing: give the tests dummy ones
+for name, value in {"API_ID": "1", "API_HASH": "test", "PHONE": "+10000000000",
+                    "MONGO_URL": "mongodb://localhost:27017", "SECRET_KEY": "test"}.items():
+    os.environ.setdefault(name, value)
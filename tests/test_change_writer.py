@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("pymongo")
+
+from pymongo import UpdateOne, DeleteOne  # noqa: E402
+
+from api.mongodb.mongodb_change_writer import ChangeWriter  # noqa: E402
+
+
+class FakeCollection:
+    def __init__(self, failures=0):
+        self.batches = []
+        self.failures = failures
+
+    def bulk_write(self, operations, ordered=True):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("mongo down")
+        self.batches.append(operations)
+
+
+def document(id_message, **fields):
+    return {"cluster_id": 1, "id_message": str(id_message), "is_folder": False, **fields}
+
+
+KEY = {"cluster_id": 1, "id_message": "5", "is_folder": False}
+
+
+def test_changes_to_one_message_collapse_into_one_write():
+    async def main():
+        collection = FakeCollection()
+        writer = ChangeWriter(collection, delay=0.01, max_batch=100)
+        writer.insert(document(5, name_file="a"))
+        writer.insert(document(5, name_file="b"))
+        writer.update(document(5, name_file="c", message_text="c@/", media_size=3))
+        writer.update(document(5, name_file="d", message_text="d@/", media_size=4))
+        writer.delete(1, ["6"])
+        await asyncio.sleep(0.05)
+        return collection
+
+    collection = asyncio.run(main())
+    assert collection.batches == [[
+        UpdateOne(KEY, {"$set": {"message_text": "d@/", "media_size": 4},
+                        "$setOnInsert": {**KEY, "name_file": "d"}}, upsert=True),
+        DeleteOne({**KEY, "id_message": "6"}),
+    ]]
+
+
+def test_insert_keeps_the_first_document():
+    async def main():
+        collection = FakeCollection()
+        writer = ChangeWriter(collection, delay=10, max_batch=100)
+        writer.insert(document(5, name_file="a"))
+        writer.insert(document(5, name_file="b"))
+        await writer.close()
+        return collection
+
+    assert asyncio.run(main()).batches == [[UpdateOne(KEY, {"$setOnInsert": document(5, name_file="a")},
+                                                      upsert=True)]]
+
+
+def test_a_full_batch_is_written_at_once():
+    async def main():
+        collection = FakeCollection()
+        writer = ChangeWriter(collection, delay=10, max_batch=3)
+        for id_message in range(3):
+            writer.insert(document(id_message))
+        await asyncio.sleep(0.05)
+        written = [len(batch) for batch in collection.batches]
+        await writer.close()
+        return written
+
+    assert asyncio.run(main()) == [3]
+
+
+def test_failed_writes_are_retried_without_overwriting_newer_changes():
+    async def main():
+        collection = FakeCollection(failures=1)
+        writer = ChangeWriter(collection, delay=10, max_batch=100)
+        writer.update(document(5, message_text="old@/"))
+        assert await writer.flush() == 0
+        writer.update(document(5, message_text="new@/"))
+        writer.insert(document(6))
+        assert await writer.flush() == 2
+        await writer.close()
+        return collection
+
+    batch = asyncio.run(main()).batches[0]
+    assert batch[0] == UpdateOne(KEY, {"$set": {"message_text": "new@/"}, "$setOnInsert": KEY}, upsert=True)
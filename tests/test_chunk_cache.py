@@ -0,0 +1,76 @@
+import os
+import time
+
+from utils.chunk_cache import ChunkCache
+
+
+def test_put_get(tmp_path):
+    cache = ChunkCache(tmp_path, 1024, 16)
+    cache.put(1, 0, b"a" * 16)
+    assert cache.get(1, 0) == b"a" * 16
+    assert (1, 0) in cache
+    assert cache.get(1, 1) is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["chunks"], stats["bytes"]) == (1, 1, 1, 16)
+
+
+def test_empty_and_oversized_chunks_are_not_stored(tmp_path):
+    cache = ChunkCache(tmp_path, 8, 16)
+    cache.put(1, 0, b"")
+    cache.put(1, 1, b"x" * 9)
+    assert cache.stats()["chunks"] == 0
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = ChunkCache(tmp_path, 32, 16)
+    cache.put(1, 0, b"a" * 16)
+    cache.put(1, 1, b"b" * 16)
+    cache.get(1, 0)
+    cache.put(1, 2, b"c" * 16)
+    assert (1, 0) in cache and (1, 2) in cache
+    assert (1, 1) not in cache
+    assert not os.path.exists(tmp_path / "1_1")
+    assert cache.stats()["evictions"] == 1
+
+
+def test_hit_refreshes_mtime_for_the_order_after_restart(tmp_path):
+    cache = ChunkCache(tmp_path, 32, 16)
+    cache.put(1, 0, b"a" * 16)
+    cache.put(1, 1, b"b" * 16)
+    past = time.time() - 100
+    os.utime(tmp_path / "1_0", (past, past))
+    os.utime(tmp_path / "1_1", (past + 1, past + 1))
+    cache.get(1, 0)
+    assert os.path.getmtime(tmp_path / "1_0") > past + 1
+
+    # Reloaded: 1_1 is now the least recently used
+    cache = ChunkCache(tmp_path, 32, 16)
+    cache.put(1, 2, b"c" * 16)
+    assert (1, 0) in cache and (1, 2) in cache
+    assert (1, 1) not in cache
+
+
+def test_load_skips_interrupted_writes_and_foreign_files(tmp_path):
+    (tmp_path / "1_0.123.tmp").write_bytes(b"partial")
+    (tmp_path / "notes.txt").write_bytes(b"x")
+    (tmp_path / "2_3").write_bytes(b"abcd")
+    cache = ChunkCache(tmp_path, 1024, 16)
+    assert not (tmp_path / "1_0.123.tmp").exists()
+    assert cache.get(2, 3) == b"abcd"
+    assert cache.stats()["chunks"] == 1
+
+
+def test_file_removed_behind_the_cache_is_a_miss(tmp_path):
+    cache = ChunkCache(tmp_path, 1024, 16)
+    cache.put(1, 0, b"a" * 16)
+    os.unlink(tmp_path / "1_0")
+    assert cache.get(1, 0) is None
+    assert cache.stats()["bytes"] == 0
+    assert cache.stats()["misses"] == 1
+
+
+def test_count_misses(tmp_path):
+    cache = ChunkCache(tmp_path, 1024, 16)
+    cache.get(1, 0)
+    cache.count_misses(3)
+    assert cache.stats()["misses"] == 4
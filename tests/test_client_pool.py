@@ -0,0 +1,95 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("telethon")
+pytest.importorskip("dotenv")
+
+from telethon.types import Document, PeerChannel  # noqa: E402
+
+from api.telegram.client_pool import TransferAccount, parse_accounts  # noqa: E402
+from utils.lru_cache import LRUCache  # noqa: E402
+
+
+class FakeClient:
+    def __init__(self, messages):
+        self.messages = messages
+        self.requests = []
+
+    async def get_messages(self, chat, ids):
+        self.requests.append((chat, ids))
+        return self.messages.get(ids)
+
+
+def new_account(client, primary=False):
+    account = TransferAccount.__new__(TransferAccount)
+    account.name = "primary" if primary else "extra"
+    account.client = client
+    account.primary = primary
+    account.messages = LRUCache(16)
+    return account
+
+
+def own_message(message_id, document_id):
+    return SimpleNamespace(id=message_id, chat_id=-1001234, file=object(), document=SimpleNamespace(id=document_id))
+
+
+def stored_document(document_id=99):
+    return Document(id=document_id, access_hash=1, file_reference=b"primary", date=None, mime_type="",
+                    size=10, dc_id=2, attributes=[])
+
+
+def test_primary_uses_the_stored_location_as_is():
+    client = FakeClient({})
+    document = stored_document()
+    assert asyncio.run(new_account(client, primary=True).resolve_message(document, (1234, 5))) is document
+    assert client.requests == []
+
+
+def test_other_accounts_fetch_the_message_of_a_stored_location_once():
+    own = own_message(5, 99)
+    client = FakeClient({5: own})
+    account = new_account(client)
+
+    async def main():
+        return [await account.resolve_message(stored_document(), ("1234", "5")) for _ in range(3)]
+
+    assert asyncio.run(main()) == [own] * 3
+    assert client.requests == [(PeerChannel(1234), 5)]
+
+    # Forgotten after its reference expired: fetched again
+    account.forget_message(stored_document(), ("1234", "5"))
+    asyncio.run(account.resolve_message(stored_document(), ("1234", "5")))
+    assert len(client.requests) == 2
+
+
+def test_stored_location_without_origin_is_refused_by_other_accounts():
+    with pytest.raises(ValueError):
+        asyncio.run(new_account(FakeClient({})).resolve_message(stored_document()))
+
+
+def test_other_accounts_cache_their_copy_of_a_message():
+    own = own_message(5, 99)
+    client = FakeClient({5: own})
+    account = new_account(client)
+
+    async def main():
+        return [await account.resolve_message(own_message(5, 99)) for _ in range(3)]
+
+    assert asyncio.run(main()) == [own] * 3
+    assert len(client.requests) == 1
+    # The file of the message was replaced: its document id changed
+    asyncio.run(account.resolve_message(own_message(5, 100)))
+    assert len(client.requests) == 2
+
+
+def test_message_not_visible_to_the_account():
+    with pytest.raises(ValueError):
+        asyncio.run(new_account(FakeClient({})).resolve_message(own_message(5, 99)))
+
+
+def test_parse_accounts():
+    assert parse_accounts("main:+100, second : +200 ,") == [("main", "+100"), ("second", "+200")]
+    assert parse_accounts("") == []
+    assert parse_accounts("lonely") == [("lonely", "")]
@@ -0,0 +1,67 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("telethon")
+pytest.importorskip("dotenv")
+
+from api.telegram.layer_2 import TelegramAPI  # noqa: E402
+from utils.chunk_cache import ChunkCache  # noqa: E402
+
+DATA = bytes(range(40))
+DOCUMENT = SimpleNamespace(id=7, size=len(DATA))
+
+
+# TelegramAPI reading through a chunk cache, with telegram replaced by DATA (cut short at
+# available bytes) served in pieces of 5 bytes
+def new_api(cache, available=len(DATA)):
+    api = TelegramAPI.__new__(TelegramAPI)
+    api.chunk_cache = cache
+    api.fetched = []
+
+    async def iter_telegram_range(media, start, end, request_size, origin=None):
+        api.fetched.append((start, end))
+        for offset in range(start, min(end + 1, available), 5):
+            yield DATA[offset:min(offset + 5, end + 1, available)]
+
+    api._TelegramAPI__iter_telegram_range = iter_telegram_range
+    return api
+
+
+async def read(api, start, end):
+    chunks = []
+    async for chunk in api._TelegramAPI__iter_cached_range(None, DOCUMENT, start, end, None, None):
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def test_fills_the_cache_and_counts_every_fetched_chunk(tmp_path):
+    cache = ChunkCache(tmp_path, 1024, 16)
+    api = new_api(cache)
+    assert asyncio.run(read(api, 3, 39)) == DATA[3:]
+    assert api.fetched == [(0, 39)]
+    assert [cache.get(7, index) for index in range(3)] == [DATA[0:16], DATA[16:32], DATA[32:40]]
+    assert cache.stats()["misses"] == 3
+
+    # Served from disk now
+    assert asyncio.run(read(api, 10, 20)) == DATA[10:21]
+    assert api.fetched == [(0, 39)]
+
+
+def test_fetches_only_the_missing_runs(tmp_path):
+    cache = ChunkCache(tmp_path, 1024, 16)
+    cache.put(7, 1, DATA[16:32])
+    api = new_api(cache)
+    assert asyncio.run(read(api, 0, 39)) == DATA
+    assert api.fetched == [(0, 15), (32, 39)]
+
+
+def test_short_read_raises_without_caching_the_partial_chunk(tmp_path):
+    cache = ChunkCache(tmp_path, 1024, 16)
+    api = new_api(cache, available=20)
+    with pytest.raises(ConnectionError):
+        asyncio.run(read(api, 0, 39))
+    assert (7, 0) in cache
+    assert (7, 1) not in cache
+    assert (7, 2) not in cache
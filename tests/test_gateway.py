@@ -0,0 +1,136 @@
+import asyncio
+import io
+from datetime import datetime, timezone
+
+import pytest
+
+pytest.importorskip("telethon")
+pytest.importorskip("werkzeug")
+
+from api.telegram.gateway import GatewayClient, GatewayServer, GatewayOperationError  # noqa: E402
+
+
+def operation(func):
+    func.gateway_operation = True
+    return func
+
+
+class FakeLayer4:
+    @operation
+    async def echo(self, value, date=None):
+        return {"value": value, "date": date}
+
+    @operation
+    async def count(self, data):
+        return len(data)
+
+    @operation
+    async def upload(self, file):
+        return {"name": file.filename, "data": b"".join([chunk async for chunk in file.stream]).decode()}
+
+    @operation
+    async def stream(self, parts, fail=False):
+        async def chunks():
+            for i in range(parts):
+                yield bytes([i]) * 3
+            if fail:
+                raise ValueError("Download failed")
+        return chunks()
+
+    @operation
+    async def fail(self):
+        raise ValueError("Not found")
+
+    async def private(self):
+        return "never served"
+
+
+class Upload:
+    def __init__(self, filename, data):
+        self.filename = filename
+        self.stream = io.BytesIO(data)
+
+
+def with_gateway(tmp_path, test):
+    async def main():
+        path = str(tmp_path / "gateway.sock")
+        server = GatewayServer(FakeLayer4(), path)
+        await server.start()
+        try:
+            return await test(GatewayClient(path, frame_size=4))
+        finally:
+            await server.close()
+
+    return asyncio.run(main())
+
+
+def test_results_round_trip_with_dates(tmp_path):
+    date = datetime(2024, 5, 1, 12, 30, tzinfo=timezone.utc)
+
+    async def test(client):
+        return await client.call("echo", [1, "a"], date=date)
+
+    assert with_gateway(tmp_path, test) == {"value": [1, "a"], "date": date}
+
+
+def test_bytes_and_file_arguments_travel_as_the_body(tmp_path):
+    async def test(client):
+        return (await client.call("count", b"x" * 10),
+                await client.call("upload", Upload("a.txt", b"hello gateway")))
+
+    assert with_gateway(tmp_path, test) == (10, {"name": "a.txt", "data": "hello gateway"})
+
+
+def test_only_one_body_per_call(tmp_path):
+    async def test(client):
+        with pytest.raises(ValueError):
+            await client.call("count", b"a", b"b")
+
+    with_gateway(tmp_path, test)
+
+
+def test_streams_are_forwarded_chunk_by_chunk(tmp_path):
+    async def test(client):
+        return [chunk async for chunk in await client.call("stream", 3)]
+
+    assert with_gateway(tmp_path, test) == [b"\x00" * 3, b"\x01" * 3, b"\x02" * 3]
+
+
+def test_operation_errors_are_not_connection_errors(tmp_path):
+    async def test(client):
+        with pytest.raises(GatewayOperationError, match="Not found") as failure:
+            await client.call("fail")
+        assert not isinstance(failure.value, ConnectionError)
+        with pytest.raises(GatewayOperationError, match="Unknown gateway operation"):
+            await client.call("private")
+
+    with_gateway(tmp_path, test)
+
+
+def test_error_in_the_middle_of_a_stream(tmp_path):
+    async def test(client):
+        chunks = []
+        with pytest.raises(GatewayOperationError, match="Download failed"):
+            async for chunk in await client.call("stream", 2, fail=True):
+                chunks.append(chunk)
+        return chunks
+
+    assert with_gateway(tmp_path, test) == [b"\x00" * 3, b"\x01" * 3]
+
+
+def test_error_sent_before_the_body_is_read(tmp_path):
+    # The gateway rejects the call and closes while the body is still being sent
+    async def test(client):
+        client.frame_size = 64 * 1024
+        with pytest.raises(GatewayOperationError, match="Unknown gateway operation"):
+            await client.call("private", b"x" * (32 * 1024 * 1024))
+
+    with_gateway(tmp_path, test)
+
+
+def test_unreachable_gateway_is_a_connection_error(tmp_path):
+    async def main():
+        await GatewayClient(str(tmp_path / "missing.sock"), 4).call("echo", 1)
+
+    with pytest.raises((ConnectionError, OSError)):
+        asyncio.run(main())
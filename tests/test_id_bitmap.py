@@ -0,0 +1,21 @@
+from utils.id_bitmap import IdBitmap
+
+
+def test_add_and_contains():
+    ids = IdBitmap(16)
+    for value in (0, 7, 8, 15):
+        ids.add(value)
+    ids.add(7)
+    assert len(ids) == 4
+    assert 7 in ids and 8 in ids
+    assert 1 not in ids
+    assert -1 not in ids
+    assert 10 ** 6 not in ids
+
+
+def test_grows_past_capacity():
+    ids = IdBitmap()
+    ids.add(100000)
+    ids.add(3)
+    assert 100000 in ids
+    assert list(ids) == [3, 100000]
@@ -0,0 +1,48 @@
+import asyncio
+import json
+
+import pytest
+
+pytest.importorskip("telethon")
+pytest.importorskip("dotenv")
+
+from api.telegram.layer_3_2 import Layer3_2  # noqa: E402
+from utils.config import config  # noqa: E402
+from utils.response_handler import success, error  # noqa: E402
+
+
+class FakeClient:
+    me_id = 42
+
+    def __init__(self, failing):
+        self.failing = failing
+
+    async def load_dialogs(self):
+        return success("Dialogs loaded", None)
+
+    async def get_dialog_object_by_name(self, name):
+        return success("Dialog object not found", None)
+
+    async def create_group(self, name):
+        if name in self.failing:
+            return error("FloodWait")
+        return success("Group created successfully", {"id": len(name)})
+
+
+def test_failed_creations_keep_the_created_clusters_in_the_map(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "CLUSTER_MAP_FILE", str(tmp_path / "clusters.json"))
+    layer = Layer3_2.__new__(Layer3_2)
+    layer.client = FakeClient({"b"})
+
+    with pytest.raises(Exception, match="b"):
+        asyncio.run(layer._Layer3_2__discover_clusters(["a", "b", "ccc"], {"known": "7"}))
+
+    saved = json.loads((tmp_path / "clusters.json").read_text())
+    assert saved == {"account": 42, "clusters": {"known": "7", "a": "1", "ccc": "3"}}
+
+
+def test_discovery_creates_every_missing_cluster(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "CLUSTER_MAP_FILE", str(tmp_path / "clusters.json"))
+    layer = Layer3_2.__new__(Layer3_2)
+    layer.client = FakeClient(set())
+    assert asyncio.run(layer._Layer3_2__discover_clusters(["a", "bb"], {})) == {"a": "1", "bb": "2"}
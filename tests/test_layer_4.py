@@ -0,0 +1,25 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("telethon")
+pytest.importorskip("dotenv")
+
+from api.telegram.layer_4 import Layer4  # noqa: E402
+
+
+def starting_layer4():
+    layer4 = Layer4.__new__(Layer4)
+    layer4.gateway = None
+    layer4.client = None
+    return layer4
+
+
+@pytest.mark.parametrize("operation, args", [
+    ("download_file", ("1", "2")),
+    ("get_download_info", ("1", "2")),
+])
+def test_telegram_operations_answer_unavailable_while_starting(operation, args):
+    r = asyncio.run(getattr(starting_layer4(), operation)(*args))
+    assert r["status"] == "error"
+    assert r["unavailable"]
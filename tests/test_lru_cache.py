@@ -0,0 +1,41 @@
+import time
+
+from utils.lru_cache import LRUCache
+
+
+def test_evicts_least_recently_used():
+    cache = LRUCache(2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert len(cache) == 2
+
+
+def test_entries_expire():
+    cache = LRUCache(10, ttl=0.01)
+    cache.set("a", 1)
+    cache.set("b", 2, ttl=60)
+    time.sleep(0.02)
+    assert cache.get("a", "gone") == "gone"
+    assert cache.get("b") == 2
+
+
+def test_pop_and_pop_where():
+    cache = LRUCache(10)
+    for key in [(1, 1), (1, 2), (2, 1)]:
+        cache.set(key, key)
+    assert cache.pop((2, 1)) == (2, 1)
+    assert cache.pop((2, 1), "missing") == "missing"
+    assert cache.pop_where(lambda k: k[0] == 1) == 2
+    assert len(cache) == 0
+
+
+def test_stats():
+    cache = LRUCache(10)
+    cache.set("a", 1)
+    cache.get("a")
+    cache.get("b")
+    assert cache.stats() == {"size": 1, "maxsize": 10, "hits": 1, "misses": 1}
@@ -0,0 +1,184 @@
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip("telethon")
+
+from telethon.errors import FloodWaitError  # noqa: E402
+
+from api.telegram.scheduler import (TokenBucket, TelegramScheduler, parse_limits, iter_at_priority,  # noqa: E402
+                                    telegram_priority, PRIORITY_INTERACTIVE, PRIORITY_NORMAL)
+
+
+def test_parse_limits():
+    assert parse_limits("download=20:40, upload=10,other=5:") == {
+        "download": (20.0, 40.0), "upload": (10.0, 10.0), "other": (5.0, 5.0)}
+    assert parse_limits("") == {}
+
+
+def test_burst_then_rate():
+    async def main():
+        bucket = TokenBucket(50, 2)
+        started = time.monotonic()
+        for _ in range(4):
+            await bucket.acquire(0)
+        return time.monotonic() - started
+
+    # 2 tokens at once, the next 2 at 50/s
+    assert 0.03 <= asyncio.run(main()) < 0.5
+
+
+def test_unlimited_rate_never_waits():
+    async def main():
+        bucket = TokenBucket(0, 1)
+        for _ in range(100):
+            await bucket.acquire(0)
+        return bucket.queued()
+
+    assert asyncio.run(main()) == 0
+
+
+def test_waiters_served_by_priority_then_fifo():
+    async def main():
+        bucket = TokenBucket(100, 1)
+        await bucket.acquire(0)
+        order = []
+
+        async def take(name, level):
+            await bucket.acquire(level)
+            order.append(name)
+
+        tasks = [asyncio.create_task(take(name, level))
+                 for name, level in [("background", 2), ("normal-1", 1), ("interactive", 0), ("normal-2", 1)]]
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(main()) == ["interactive", "normal-1", "normal-2", "background"]
+
+
+def test_cancelled_waiter_is_skipped():
+    async def main():
+        bucket = TokenBucket(50, 1)
+        await bucket.acquire(0)
+        cancelled = asyncio.create_task(bucket.acquire(0))
+        waiting = asyncio.create_task(bucket.acquire(1))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.wait_for(waiting, 1)
+        return bucket.queued()
+
+    assert asyncio.run(main()) == 0
+
+
+def test_pause_holds_every_request():
+    async def main():
+        bucket = TokenBucket(0, 1)
+        bucket.pause(0.05)
+        started = time.monotonic()
+        await bucket.acquire(0)
+        return time.monotonic() - started
+
+    assert asyncio.run(main()) >= 0.04
+
+
+class FloodWait(FloodWaitError):
+    def __init__(self, seconds):
+        Exception.__init__(self, f"FloodWait of {seconds}s")
+        self.seconds = seconds
+
+
+def new_scheduler(max_flood_wait=1, retries=2):
+    return TelegramScheduler({"other": (0, 1)}, max_flood_wait, retries)
+
+
+def test_run_sleeps_through_short_flood_waits_and_retries():
+    async def main():
+        scheduler = new_scheduler()
+        attempts = []
+
+        async def call():
+            attempts.append(time.monotonic())
+            if len(attempts) == 1:
+                raise FloodWait(0.05)
+            return "done"
+
+        return scheduler, attempts, await scheduler.run(object(), call)
+
+    scheduler, attempts, result = asyncio.run(main())
+    assert result == "done"
+    assert len(attempts) == 2
+    assert attempts[1] - attempts[0] >= 0.04
+    stats = scheduler.stats()["other"]
+    assert (stats["calls"], stats["flood_waits"]) == (2, 1)
+
+
+def test_run_raises_long_flood_waits_and_pauses_the_class():
+    async def main():
+        scheduler = new_scheduler(max_flood_wait=1)
+
+        async def call():
+            raise FloodWait(30)
+
+        with pytest.raises(FloodWaitError):
+            await scheduler.run(object(), call)
+        return scheduler
+
+    stats = asyncio.run(main()).stats()["other"]
+    assert stats["calls"] == 1
+    assert stats["paused_seconds"] > 25
+
+
+def test_run_gives_up_after_the_retries():
+    async def main():
+        scheduler = new_scheduler(retries=2)
+        attempts = []
+
+        async def call():
+            attempts.append(1)
+            raise FloodWait(0)
+
+        with pytest.raises(FloodWaitError):
+            await scheduler.run(object(), call)
+        return attempts
+
+    assert len(asyncio.run(main())) == 3
+
+
+def test_iter_at_priority_applies_to_the_steps_only():
+    async def main():
+        seen = []
+
+        async def source():
+            for i in range(2):
+                seen.append(telegram_priority.get())
+                yield i
+
+        items = []
+        async for item in iter_at_priority(PRIORITY_INTERACTIVE, source()):
+            # Not leaked to the consumer between items
+            assert telegram_priority.get() == PRIORITY_NORMAL
+            items.append(item)
+        return items, seen
+
+    assert asyncio.run(main()) == ([0, 1], [PRIORITY_INTERACTIVE] * 2)
+
+
+def test_iter_at_priority_closes_the_source_from_another_task():
+    async def main():
+        closed = []
+
+        async def source():
+            try:
+                while True:
+                    yield telegram_priority.get()
+            finally:
+                closed.append(telegram_priority.get())
+
+        stream = iter_at_priority(PRIORITY_INTERACTIVE, source())
+        assert await stream.__anext__() == PRIORITY_INTERACTIVE
+        # Abandoned stream closed elsewhere, as the server does when a client disconnects
+        await asyncio.create_task(stream.aclose())
+        return closed
+
+    assert asyncio.run(main()) == [PRIORITY_INTERACTIVE]
@@ -0,0 +1,187 @@
+import asyncio
+
+import pytest
+
+from utils.singleflight import SingleFlight, SharedStreams
+
+
+def test_single_flight_shares_one_call():
+    async def main():
+        flight = SingleFlight()
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "value"
+
+        results = await asyncio.gather(*(flight.do("key", fetch) for _ in range(5)))
+        return flight, calls, results
+
+    flight, calls, results = asyncio.run(main())
+    assert results == ["value"] * 5
+    assert len(calls) == 1
+    assert flight.stats() == {"in_flight": 0, "executed": 1, "shared": 4}
+
+
+def test_single_flight_shares_the_exception():
+    async def main():
+        flight = SingleFlight()
+
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+
+        return await asyncio.gather(flight.do("key", fail), flight.do("key", fail), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(r, ValueError) for r in results)
+
+
+def test_single_flight_cancelled_caller_does_not_cancel_the_call():
+    async def main():
+        flight = SingleFlight()
+        release = asyncio.Event()
+
+        async def fetch():
+            await release.wait()
+            return "value"
+
+        first = asyncio.create_task(flight.do("key", fetch))
+        second = asyncio.create_task(flight.do("key", fetch))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        return first, await second
+
+    first, value = asyncio.run(main())
+    assert first.cancelled()
+    assert value == "value"
+
+
+def test_single_flight_runs_again_once_done():
+    async def main():
+        flight = SingleFlight()
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            return len(calls)
+
+        return await flight.do("key", fetch), await flight.do("key", fetch)
+
+    assert asyncio.run(main()) == (1, 2)
+
+
+async def collect(stream):
+    return [chunk async for chunk in stream]
+
+
+def test_shared_streams_share_one_upstream():
+    async def main():
+        streams = SharedStreams(2)
+        started = []
+
+        async def upstream():
+            started.append(1)
+            await asyncio.sleep(0.01)
+            for chunk in (b"a", b"b", b"c"):
+                yield chunk
+
+        results = await asyncio.gather(*(collect(streams.stream("key", upstream)) for _ in range(3)))
+        return streams, started, results
+
+    streams, started, results = asyncio.run(main())
+    assert results == [[b"a", b"b", b"c"]] * 3
+    assert len(started) == 1
+    assert streams.stats() == {"in_flight": 0, "executed": 1, "shared": 2}
+
+
+def test_shared_streams_late_subscriber_starts_a_new_upstream():
+    async def main():
+        streams = SharedStreams(4)
+        started = []
+
+        async def upstream():
+            started.append(1)
+            for chunk in (b"a", b"b"):
+                yield chunk
+                await asyncio.sleep(0.01)
+
+        first = streams.stream("key", upstream)
+        assert await first.__anext__() == b"a"
+        late = await collect(streams.stream("key", upstream))
+        rest = await collect(first)
+        return started, late, rest
+
+    started, late, rest = asyncio.run(main())
+    assert len(started) == 2
+    assert late == [b"a", b"b"]
+    assert rest == [b"b"]
+
+
+def test_shared_streams_failure_reaches_every_subscriber():
+    async def main():
+        streams = SharedStreams(2)
+
+        async def upstream():
+            await asyncio.sleep(0.01)
+            yield b"a"
+            raise ConnectionError("short read")
+
+        return await asyncio.gather(*(collect(streams.stream("key", upstream)) for _ in range(2)),
+                                    return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(r, ConnectionError) and str(r) == "short read" for r in results)
+
+
+def test_shared_streams_cancel_upstream_when_last_subscriber_leaves():
+    async def main():
+        streams = SharedStreams(1)
+        closed = asyncio.Event()
+
+        async def upstream():
+            try:
+                while True:
+                    yield b"x"
+            finally:
+                closed.set()
+
+        first = streams.stream("key", upstream)
+        second = streams.stream("key", upstream)
+        await asyncio.gather(first.__anext__(), second.__anext__())
+        assert streams.stats()["shared"] == 1
+        await first.aclose()
+        # The other subscriber still reads
+        assert await second.__anext__() == b"x"
+        await second.aclose()
+        await asyncio.wait_for(closed.wait(), 1)
+        return streams
+
+    streams = asyncio.run(main())
+    assert streams.stats()["in_flight"] == 0
+
+
+def test_shared_streams_rejoin_after_cancel_starts_a_new_upstream():
+    async def main():
+        streams = SharedStreams(1)
+        started = []
+
+        async def upstream():
+            started.append(1)
+            await asyncio.sleep(0.01)
+            yield b"a"
+
+        task = asyncio.create_task(collect(streams.stream("key", upstream)))
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        # Same key right after: must not join the cancelled flight
+        return await collect(streams.stream("key", upstream)), started
+
+    chunks, started = asyncio.run(main())
+    assert chunks == [b"a"]
+    assert len(started) == 2
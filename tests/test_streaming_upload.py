@@ -0,0 +1,150 @@
+import asyncio
+import json
+from datetime import datetime, timezone
+
+import pytest
+
+pytest.importorskip("werkzeug")
+
+from server.streaming_upload import StreamingUploadMiddleware  # noqa: E402
+
+QUERY = b"c=-100123&destination=/docs&file_size=11&name=hello.txt"
+
+
+async def authenticate(token):
+    return token == "good"
+
+
+# Run one request through the middleware; returns (status, decoded JSON body, uploads seen)
+def run(body_chunks, headers=None, query=QUERY, method="POST"):
+    uploads = []
+
+    async def upload(file, destination, cluster_id, file_size):
+        data = b"".join([chunk async for chunk in file.stream])
+        uploads.append((file.filename, destination, cluster_id, file_size, data))
+        return {"status": "success", "message": "File caricato con successo",
+                "data": {"name": file.filename, "date": datetime(2024, 5, 1, tzinfo=timezone.utc)}}
+
+    async def app(scope, receive, send):
+        raise AssertionError("Not an /upload-stream request")
+
+    async def main():
+        messages = [{"type": "http.request", "body": chunk, "more_body": i < len(body_chunks) - 1}
+                    for i, chunk in enumerate(body_chunks)]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {"type": "http", "path": "/upload-stream", "method": method, "query_string": query,
+                 "headers": [(b"authorization", b"good")] + (headers or [])}
+        await StreamingUploadMiddleware(app, "/upload-stream", authenticate, upload)(scope, receive, send)
+        body = b"".join(m.get("body", b"") for m in sent if m["type"] == "http.response.body")
+        return sent[0]["status"], json.loads(body) if body else None
+
+    status, payload = asyncio.run(main())
+    return status, payload, uploads
+
+
+def test_raw_body_upload_returns_the_stored_document():
+    status, payload, uploads = run([b"hello ", b"world"])
+    assert status == 200
+    assert payload["data"] == {"name": "hello.txt", "date": "Wed, 01 May 2024 00:00:00 GMT"}
+    assert uploads == [("hello.txt", "/docs", "-100123", 11, b"hello world")]
+
+
+def multipart(filename, data, boundary=b"XyZ"):
+    return (b"--" + boundary + b"\r\n"
+            b'Content-Disposition: form-data; name="note"\r\n\r\n'
+            b"ignored\r\n"
+            b"--" + boundary + b"\r\n"
+            b'Content-Disposition: form-data; name="file"; filename="' + filename + b'"\r\n'
+            b"Content-Type: application/octet-stream\r\n\r\n"
+            + data + b"\r\n--" + boundary + b"--\r\n")
+
+
+MULTIPART = [(b"content-type", b"multipart/form-data; boundary=XyZ")]
+
+
+def test_multipart_upload_streams_the_first_file_part():
+    body = multipart(b"report.bin", b"hello world")
+    # Chunk boundaries fall anywhere, also inside the headers and the closing boundary
+    chunks = [body[i:i + 7] for i in range(0, len(body), 7)]
+    status, payload, uploads = run(chunks, MULTIPART, b"c=1&destination=/docs&file_size=11")
+    assert status == 200
+    assert uploads == [("report.bin", "/docs", "1", 11, b"hello world")]
+
+
+def test_multipart_name_argument_overrides_the_part_filename():
+    status, _, uploads = run([multipart(b"report.bin", b"hello world")], MULTIPART)
+    assert status == 200
+    assert uploads[0][0] == "hello.txt"
+
+
+@pytest.mark.parametrize("body, headers", [
+    ([b"--XyZ\r\nContent-Disposition: form-data; name=\"a\"\r\n\r\nb\r\n--XyZ--\r\n"], MULTIPART),
+    ([b"abc"], [(b"content-type", b"multipart/form-data")]),
+])
+def test_bad_multipart_bodies_are_rejected(body, headers):
+    status, payload, uploads = run(body, headers, b"c=1&destination=/docs&file_size=3")
+    assert status == 400
+    assert payload["status"] == "error"
+
+
+# Past the start of the file the error reaches the upload, which reads the part
+def test_truncated_multipart_file_fails_the_upload():
+    body = multipart(b"a.bin", b"hello world")[:-20]
+    with pytest.raises(ValueError):
+        run([body], MULTIPART, b"c=1&destination=/docs&file_size=11")
+
+
+@pytest.mark.parametrize("query", [b"c=1&destination=/docs", b"c=1&destination=/docs&file_size=x",
+                                   b"destination=/docs&file_size=3", b"c=1&file_size=3&name=a"])
+def test_missing_arguments_are_rejected(query):
+    status, _, uploads = run([b"abc"], query=query)
+    assert status == 400
+    assert uploads == []
+
+
+def test_raw_body_needs_a_name():
+    status, _, uploads = run([b"abc"], query=b"c=1&destination=/docs&file_size=3")
+    assert status == 400
+    assert uploads == []
+
+
+def test_methods():
+    assert run([b""], method="OPTIONS")[:2] == (204, None)
+    assert run([b""], method="GET")[0] == 405
+
+
+def test_token_is_required():
+    async def main(token_headers):
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        async def upload(*args):
+            raise AssertionError("Uploaded without a valid token")
+
+        scope = {"type": "http", "path": "/upload-stream", "method": "POST", "query_string": QUERY,
+                 "headers": token_headers}
+        await StreamingUploadMiddleware(None, "/upload-stream", authenticate, upload)(scope, None, send)
+        return sent[0]["status"]
+
+    assert asyncio.run(main([])) == 400
+    assert asyncio.run(main([(b"authorization", b"bad")])) == 401
+
+
+def test_other_paths_reach_the_app():
+    seen = []
+
+    async def app(scope, receive, send):
+        seen.append(scope["path"])
+
+    scope = {"type": "http", "path": "/upload", "method": "POST"}
+    asyncio.run(StreamingUploadMiddleware(app, "/upload-stream", authenticate, None)(scope, None, None))
+    assert seen == ["/upload"]
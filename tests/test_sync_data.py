@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("telethon")
+pytest.importorskip("dotenv")
+
+from telethon.errors import FloodWaitError  # noqa: E402
+
+from api.mongodb.mongodb_drive import DriveMongo  # noqa: E402
+from utils.config import config  # noqa: E402
+
+
+class FloodWait(FloodWaitError):
+    def __init__(self, seconds):
+        Exception.__init__(self, "flood")
+        self.seconds = seconds
+
+
+class Layer:
+    def get_clusters_info(self):
+        return ["a", "b"]
+
+
+# Run sync_data with one scripted outcome list per cluster; returns (result, drive, calls)
+def run(outcomes, monkeypatch, retries=1):
+    monkeypatch.setattr(config, "SYNC_CONCURRENCY", 2)
+    monkeypatch.setattr(config, "SYNC_FLOOD_RETRIES", retries)
+    drive = DriveMongo.__new__(DriveMongo)
+    calls = []
+
+    async def sync_cluster(layer, cluster_name, full=False, reconcile=None):
+        calls.append(cluster_name)
+        outcome = outcomes[cluster_name].pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    drive.sync_cluster = sync_cluster
+    result = asyncio.run(drive.sync_data(Layer()))
+    return result, drive, calls
+
+
+DONE = {"status": "success", "new": 1}
+
+
+def test_every_cluster_synced(monkeypatch):
+    result, drive, _ = run({"a": [DONE], "b": [DONE]}, monkeypatch)
+    assert result["status"] == "success"
+    assert result["data"] == {"a": DONE, "b": DONE}
+    assert drive.sync_progress == {"a": "done", "b": "done"}
+
+
+def test_one_failed_cluster_is_a_partial_sync(monkeypatch):
+    result, drive, calls = run({"a": [DONE], "b": [RuntimeError("boom"), DONE]}, monkeypatch)
+    assert result["status"] == "partial"
+    assert result["data"]["a"] == DONE
+    assert result["data"]["b"]["status"] == "error"
+    assert "boom" in result["data"]["b"]["message"]
+    assert drive.sync_progress == {"a": "done", "b": "error"}
+    # Other errors are not retried
+    assert calls.count("b") == 1
+
+
+def test_every_cluster_failed_is_an_error(monkeypatch):
+    result, _, _ = run({"a": [RuntimeError("x")], "b": [RuntimeError("y")]}, monkeypatch)
+    assert result["status"] == "error"
+    assert set(result["data"]) == {"a", "b"}
+
+
+def test_flood_wait_is_waited_out_and_retried(monkeypatch):
+    result, drive, calls = run({"a": [FloodWait(0.01), DONE], "b": [DONE]}, monkeypatch)
+    assert result["status"] == "success"
+    assert calls.count("a") == 2
+    assert drive.sync_progress["a"] == "done"
+
+
+def test_flood_wait_past_the_retries_is_reported(monkeypatch):
+    result, drive, calls = run({"a": [FloodWait(0.01), FloodWait(0.01)], "b": [DONE]}, monkeypatch)
+    assert result["status"] == "partial"
+    assert "FloodWait of 0.01s" in result["data"]["a"]["message"]
+    assert drive.sync_progress["a"] == "error"
+    assert calls.count("a") == 2
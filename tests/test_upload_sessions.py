@@ -0,0 +1,108 @@
+import asyncio
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("telethon")
+pytest.importorskip("dotenv")
+
+from api.telegram.layer_2 import TelegramAPI  # noqa: E402
+from api.telegram.layer_4 import Layer4  # noqa: E402
+from api.telegram.parallel_transfer import ParallelUploader  # noqa: E402
+from utils.response_handler import success, error  # noqa: E402
+
+PART = 10
+
+
+def new_session(file_size=25, parts=(), status="open"):
+    return {"session_id": "s1", "owner": "a@b.c", "cluster_id": 1, "destination": "/", "file_name": "f.bin",
+            "file_size": file_size, "file_id": 7, "part_size": PART, "total_parts": -(-file_size // PART),
+            "account": None, "parts": list(parts), "status": status,
+            "expires_at": datetime(2030, 1, 1, tzinfo=timezone.utc)}
+
+
+class FakeMongo:
+    def __init__(self, session):
+        self.session = session
+
+    async def get_upload_session(self, session_id, owner):
+        if self.session is None or owner != self.session["owner"]:
+            return error("Upload session not found or expired")
+        return success("Upload session found", dict(self.session))
+
+    async def add_upload_session_parts(self, session_id, owner, parts):
+        self.session["parts"] = sorted(set(self.session["parts"]) | set(parts))
+        return success("Upload session updated", dict(self.session))
+
+
+class FakeClient:
+    def __init__(self):
+        self.saved = []
+
+    async def upload_parts(self, file_id, file_size, first_part, data, account):
+        count = -(-len(data) // PART)
+        self.saved.append((first_part, data))
+        return success("Parts uploaded successfully", list(range(first_part, first_part + count)))
+
+
+def new_layer4(session):
+    layer4 = Layer4.__new__(Layer4)
+    layer4.gateway = None
+    layer4.client = FakeClient()
+    layer4.mongo = FakeMongo(session)
+    return layer4
+
+
+def test_status_reports_uploaded_and_missing_parts():
+    status = Layer4.upload_session_status(new_session(parts=[2, 0]))
+    assert status["uploaded_parts"] == [0, 2]
+    assert status["missing_parts"] == [1]
+    # The last part is 5 bytes
+    assert status["uploaded_bytes"] == 15
+
+
+@pytest.mark.parametrize("offset, data", [
+    (0, b""),             # nothing
+    (-10, b"x" * 10),     # before the file
+    (5, b"x" * 10),       # not on a part boundary
+    (0, b"x" * 15),       # a partial part that is not the end of the file
+    (20, b"x" * 10),      # past the end of the file
+])
+def test_part_ranges_must_cover_whole_parts(offset, data):
+    layer4 = new_layer4(new_session())
+    r = asyncio.run(layer4.upload_session_part("s1", offset, data, "a@b.c"))
+    assert r["status"] == "error"
+    assert layer4.client.saved == []
+
+
+def test_parts_are_saved_and_recorded():
+    layer4 = new_layer4(new_session())
+    r = asyncio.run(layer4.upload_session_part("s1", 10, b"x" * 15, "a@b.c"))
+    assert r["status"] == "success"
+    assert r["data"]["uploaded_parts"] == [1, 2]
+    assert layer4.client.saved == [(1, b"x" * 15)]
+
+
+def test_sessions_are_only_found_for_their_owner():
+    layer4 = new_layer4(new_session())
+    assert asyncio.run(layer4.get_upload_session("s1", "other@b.c"))["status"] == "error"
+    r = asyncio.run(layer4.upload_session_part("s1", 0, b"x" * 10, "other@b.c"))
+    assert r["status"] == "error"
+    assert layer4.client.saved == []
+
+
+def test_no_parts_while_finalizing():
+    layer4 = new_layer4(new_session(status="finalizing"))
+    r = asyncio.run(layer4.upload_session_part("s1", 0, b"x" * 10, "a@b.c"))
+    assert r["status"] == "error"
+
+
+@pytest.mark.parametrize("file_size", [0, -1, 4000 * 512 * 1024 + 1])
+def test_new_upload_rejects_sizes_telegram_cannot_take(file_size):
+    api = TelegramAPI.__new__(TelegramAPI)
+    account = SimpleNamespace(name="primary", uploader=ParallelUploader(None, 1, 512 * 1024))
+    api.pool = SimpleNamespace(pick=lambda: account)
+    with pytest.raises(ValueError):
+        api.new_upload(file_size)
+    assert api.new_upload(4000 * 512 * 1024)["total_parts"] == 4000
@@ -0,0 +1,36 @@
+import pytest
+
+from utils.utils_functions import parse_range_header, if_range_matches
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", (0, 99)),
+    ("bytes=100-", (100, 999)),
+    ("bytes=900-5000", (900, 999)),
+    ("bytes=-100", (900, 999)),
+    ("bytes=-5000", (0, 999)),
+    ("bytes=999-999", (999, 999)),
+])
+def test_parse_range_header(header, expected):
+    assert parse_range_header(header, 1000) == expected
+
+
+@pytest.mark.parametrize("header", [None, "", "items=0-1", "bytes=0-1,5-6", "bytes=a-b", "bytes=5-1"])
+def test_parse_range_header_ignored(header):
+    assert parse_range_header(header, 1000) is None
+
+
+@pytest.mark.parametrize("header", ["bytes=1000-", "bytes=2000-3000", "bytes=-0"])
+def test_parse_range_header_unsatisfiable(header):
+    assert parse_range_header(header, 1000) is False
+
+
+def test_if_range_matches():
+    etag = '"abc"'
+    last_modified = "Wed, 21 Oct 2015 07:28:00 GMT"
+    assert if_range_matches(None, etag, last_modified)
+    assert if_range_matches('"abc"', etag, last_modified)
+    assert not if_range_matches('"old"', etag, last_modified)
+    assert not if_range_matches('W/"abc"', etag, last_modified)
+    assert if_range_matches(last_modified, etag, last_modified)
+    assert not if_range_matches("Tue, 20 Oct 2015 07:28:00 GMT", etag, last_modified)
@@ -0,0 +1,119 @@
+import os
+import threading
+from collections import OrderedDict
+
+
+# Size-capped on-disk cache of file chunks, keyed by (document id, chunk index).
+# A telegram document never changes (an edited file gets a new document id), so cached chunks
+# never go stale and are shared by every message / user pointing at the same document. Chunks
+# are evicted least recently used first; after a restart the order is rebuilt from the files'
+# modification times. Blocking file I/O: call it from a thread (asyncio.to_thread).
+class ChunkCache:
+    def __init__(self, directory, max_bytes, chunk_size):
+        self.directory = directory
+        self.max_bytes = int(max_bytes)
+        self.chunk_size = int(chunk_size)
+        self._index = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.hit_bytes = 0
+        self.stored_bytes = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+        self.__load()
+
+    def __load(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith(".tmp"):
+                # Interrupted write
+                os.unlink(path)
+                continue
+            document_id, _, index = name.partition("_")
+            if not document_id.isdigit() or not index.isdigit():
+                continue
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, (int(document_id), int(index)), stat.st_size))
+        for _, key, size in sorted(entries):
+            self._index[key] = size
+            self._bytes += size
+        self.__evict()
+
+    def __path(self, key):
+        return os.path.join(self.directory, f"{key[0]}_{key[1]}")
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._index
+
+    def get(self, document_id, index):
+        key = (int(document_id), int(index))
+        with self._lock:
+            if key not in self._index:
+                self.misses += 1
+                return None
+            self._index.move_to_end(key)
+        path = self.__path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            # The modification time orders the chunks for eviction after a restart
+            os.utime(path)
+        except OSError:
+            # Removed behind our back
+            with self._lock:
+                self._bytes -= self._index.pop(key, 0)
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+            self.hit_bytes += len(data)
+        return data
+
+    # Misses found without a get (e.g. the rest of a run of missing chunks)
+    def count_misses(self, count):
+        with self._lock:
+            self.misses += count
+
+    def put(self, document_id, index, data):
+        key = (int(document_id), int(index))
+        if not data or len(data) > self.max_bytes:
+            return
+        path = self.__path(key)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with self._lock:
+            self._bytes += len(data) - self._index.pop(key, 0)
+            self._index[key] = len(data)
+            self.stored_bytes += len(data)
+            self.__evict()
+
+    # Called with the lock held (or before the cache is shared)
+    def __evict(self):
+        while self._bytes > self.max_bytes and self._index:
+            key, size = self._index.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+            try:
+                os.unlink(self.__path(key))
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "chunks": len(self._index),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "chunk_size": self.chunk_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_bytes": self.hit_bytes,
+                "stored_bytes": self.stored_bytes,
+                "evictions": self.evictions
+            }
@@ -32,6 +32,84 @@ class Config:
         # Fetch the port, using 5000 as the default if not set
         self.PORT = os.getenv('PORT', '5000')
 
+        # Telegram message cache (entries / seconds)
+        self.MESSAGE_CACHE_SIZE = int(os.getenv('MESSAGE_CACHE_SIZE', '1024'))
+        self.MESSAGE_CACHE_TTL = int(os.getenv('MESSAGE_CACHE_TTL', '600'))
+
+        # Number of file documents pushed per batch during telegram -> mongodb sync
+        self.SYNC_BATCH_SIZE = int(os.getenv('SYNC_BATCH_SIZE', '500'))
+
+        # Threads running blocking MongoDB calls (max concurrent queries)
+        self.MONGO_EXECUTOR_WORKERS = int(os.getenv('MONGO_EXECUTOR_WORKERS', '16'))
+
+        # Shared MongoDB connection pool
+        self.MONGO_MAX_POOL_SIZE = int(os.getenv('MONGO_MAX_POOL_SIZE', '50'))
+        self.MONGO_MIN_POOL_SIZE = int(os.getenv('MONGO_MIN_POOL_SIZE', '0'))
+        self.MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv('MONGO_WAIT_QUEUE_TIMEOUT_MS', '10000'))
+
+        # Bytes requested from telegram per download request (multiple of 4096, divides 1 MB)
+        self.DOWNLOAD_REQUEST_SIZE = int(os.getenv('DOWNLOAD_REQUEST_SIZE', str(512 * 1024)))
+
+        # Parallel download engine: connections per download, part size (multiple of 4096 that
+        # divides 1 MB) and the smallest range worth splitting
+        self.DOWNLOAD_WORKERS = int(os.getenv('DOWNLOAD_WORKERS', '4'))
+        self.DOWNLOAD_PART_SIZE = int(os.getenv('DOWNLOAD_PART_SIZE', str(1024 * 1024)))
+        self.PARALLEL_DOWNLOAD_MIN_SIZE = int(os.getenv('PARALLEL_DOWNLOAD_MIN_SIZE', str(10 * 1024 * 1024)))
+
+        # On-disk cache of downloaded chunks: directory, size cap in bytes (0 = disabled) and
+        # chunk size
+        self.DOWNLOAD_CACHE_DIR = os.getenv('DOWNLOAD_CACHE_DIR', 'download_cache')
+        self.DOWNLOAD_CACHE_SIZE = int(os.getenv('DOWNLOAD_CACHE_SIZE', str(1024 * 1024 * 1024)))
+        self.DOWNLOAD_CACHE_CHUNK_SIZE = int(os.getenv('DOWNLOAD_CACHE_CHUNK_SIZE', str(1024 * 1024)))
+
+        # Chunks buffered per client when concurrent downloads of the same range share one fetch
+        self.DOWNLOAD_SHARED_BUFFER = int(os.getenv('DOWNLOAD_SHARED_BUFFER', '4'))
+
+        # Parallel upload engine: parts in flight per upload, part size (multiple of 1024 that
+        # divides 512 KB) and attempts per part
+        self.UPLOAD_WORKERS = int(os.getenv('UPLOAD_WORKERS', '4'))
+        self.UPLOAD_PART_SIZE = int(os.getenv('UPLOAD_PART_SIZE', str(512 * 1024)))
+        self.UPLOAD_RETRIES = int(os.getenv('UPLOAD_RETRIES', '3'))
+
+        # Seconds a resumable upload session stays valid; keep it below the time telegram
+        # retains uploaded parts that were never sent
+        self.UPLOAD_SESSION_TTL = int(os.getenv('UPLOAD_SESSION_TTL', str(6 * 3600)))
+
+        # Clusters synced concurrently, and retries of a cluster after a FloodWait
+        self.SYNC_CONCURRENCY = int(os.getenv('SYNC_CONCURRENCY', '4'))
+        self.SYNC_FLOOD_RETRIES = int(os.getenv('SYNC_FLOOD_RETRIES', '3'))
+
+        # Seconds live telegram changes are collected before being written to mongodb
+        self.CHANGE_FLUSH_DELAY = float(os.getenv('CHANGE_FLUSH_DELAY', '1.0'))
+
+        # Cluster discovery: name -> id map kept between restarts, and groups created in parallel
+        self.CLUSTER_MAP_FILE = os.getenv('CLUSTER_MAP_FILE', 'clusters_map.json')
+        self.CLUSTER_CREATE_CONCURRENCY = int(os.getenv('CLUSTER_CREATE_CONCURRENCY', '2'))
+
+        # Seconds between attempts of the background telegram startup
+        self.STARTUP_RETRY_DELAY = int(os.getenv('STARTUP_RETRY_DELAY', '30'))
+
+        # Telegram request scheduler: per method class "rate:burst" in requests per second (0 = no
+        # limit), FloodWaits slept through up to TELEGRAM_MAX_FLOOD_WAIT seconds and retried
+        self.TELEGRAM_RATE_LIMITS = os.getenv(
+            'TELEGRAM_RATE_LIMITS', 'download=0,upload=0,write=1:5,read=10:20,other=5:10')
+        self.TELEGRAM_MAX_FLOOD_WAIT = int(os.getenv('TELEGRAM_MAX_FLOOD_WAIT', '60'))
+        self.TELEGRAM_FLOOD_RETRIES = int(os.getenv('TELEGRAM_FLOOD_RETRIES', '3'))
+
+        # Extra accounts sharing uploads / downloads ("session_name:phone,..."), and how many
+        # seconds an account that failed a transfer is skipped
+        self.TELEGRAM_POOL_ACCOUNTS = os.getenv('TELEGRAM_POOL_ACCOUNTS', '')
+        self.TELEGRAM_POOL_FAILURE_COOLDOWN = int(os.getenv('TELEGRAM_POOL_FAILURE_COOLDOWN', '30'))
+
+        # Unix socket of the telegram gateway process shared by several HTTP workers (empty: the
+        # server owns telegram itself), and the size of the frames streamed through it
+        self.TELEGRAM_GATEWAY = os.getenv('TELEGRAM_GATEWAY', '')
+        self.TELEGRAM_GATEWAY_FRAME_SIZE = int(os.getenv('TELEGRAM_GATEWAY_FRAME_SIZE', str(256 * 1024)))
+
+        # Verified auth token cache (entries / seconds)
+        self.TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', '10000'))
+        self.TOKEN_CACHE_TTL = int(os.getenv('TOKEN_CACHE_TTL', '300'))
+
         # Validate required configurations
         self.validate()
 
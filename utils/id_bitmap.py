@@ -0,0 +1,32 @@
+# Set of non-negative integer ids stored as a bitmap: one bit per id up to the largest added.
+# Telegram message ids are dense within a chat, so a million-message cluster costs ~125 KB
+# instead of the tens of MB of a set of ints or the messages themselves.
+class IdBitmap:
+    def __init__(self, capacity=0):
+        self.bits = bytearray((capacity >> 3) + 1)
+        self.count = 0
+
+    def add(self, value):
+        index = value >> 3
+        if index >= len(self.bits):
+            # Grow geometrically when ids exceed the expected capacity
+            self.bits.extend(bytes(max(index + 1, len(self.bits) * 2) - len(self.bits)))
+        mask = 1 << (value & 7)
+        if not self.bits[index] & mask:
+            self.bits[index] |= mask
+            self.count += 1
+
+    def __contains__(self, value):
+        index = value >> 3
+        return 0 <= index < len(self.bits) and bool(self.bits[index] & (1 << (value & 7)))
+
+    def __len__(self):
+        return self.count
+
+    # Ids in ascending order
+    def __iter__(self):
+        for index, byte in enumerate(self.bits):
+            if byte:
+                for bit in range(8):
+                    if byte & (1 << bit):
+                        yield (index << 3) | bit
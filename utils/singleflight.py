@@ -0,0 +1,111 @@
+import asyncio
+
+
+# Concurrent calls with the same key share one execution of func() and get the same result
+# (or exception). Returned values are shared between callers: do not mutate them. A caller
+# that is cancelled does not cancel the call for the others.
+class SingleFlight:
+    def __init__(self):
+        self.calls = {}
+        self.executed = 0
+        self.shared = 0
+
+    async def do(self, key, func):
+        future = self.calls.get(key)
+        if future is None:
+            future = self.calls[key] = asyncio.ensure_future(func())
+            future.add_done_callback(lambda f: self.__done(key, f))
+            self.executed += 1
+        else:
+            self.shared += 1
+        return await asyncio.shield(future)
+
+    def __done(self, key, future):
+        if self.calls.get(key) is future:
+            del self.calls[key]
+
+    def stats(self):
+        return {"in_flight": len(self.calls), "executed": self.executed, "shared": self.shared}
+
+
+class _Failure:
+    def __init__(self, error):
+        self.error = error
+
+
+_END = object()
+
+
+# Concurrent streams with the same key share one upstream async iterator. Each subscriber gets
+# the chunks through its own bounded queue, so a consumer only holds `buffer` chunks and the
+# upstream advances at the pace of the slowest one. Subscribers join a stream until it has
+# produced its first chunk; later ones start a new upstream. The upstream is cancelled when
+# its last subscriber leaves, and the stream is closed to new subscribers at once.
+class SharedStreams:
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.flights = {}
+        self.executed = 0
+        self.shared = 0
+
+    async def stream(self, key, factory):
+        flight = self.flights.get(key)
+        if flight is None or flight["started"]:
+            flight = self.flights[key] = {"started": False, "queues": []}
+            flight["task"] = asyncio.create_task(self.__produce(key, flight, factory))
+            self.executed += 1
+        else:
+            self.shared += 1
+        queue = asyncio.Queue(self.buffer)
+        flight["queues"].append(queue)
+        try:
+            while True:
+                item = await queue.get()
+                if item is _END:
+                    return
+                if isinstance(item, _Failure):
+                    raise item.error
+                yield item
+        finally:
+            flight["queues"].remove(queue)
+            # Unblock a put the producer may have started on this queue
+            while not queue.empty():
+                queue.get_nowait()
+            if not flight["queues"]:
+                self.__close(key, flight)
+                flight["task"].cancel()
+
+    def __close(self, key, flight):
+        if self.flights.get(key) is flight:
+            del self.flights[key]
+
+    async def __produce(self, key, flight, factory):
+        final = _END
+        upstream = factory()
+        try:
+            try:
+                async for chunk in upstream:
+                    flight["started"] = True
+                    for queue in list(flight["queues"]):
+                        await queue.put(chunk)
+            finally:
+                # Release the upstream's resources now, not when it is garbage collected
+                await upstream.aclose()
+        except asyncio.CancelledError:
+            # Fail whoever is still subscribed instead of leaving them waiting: their pending
+            # chunks are dropped, the failure is delivered at once
+            self.__close(key, flight)
+            failure = _Failure(ConnectionError("Shared stream cancelled"))
+            for queue in list(flight["queues"]):
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(failure)
+            raise
+        except Exception as e:
+            final = _Failure(e)
+        self.__close(key, flight)
+        for queue in list(flight["queues"]):
+            await queue.put(final)
+
+    def stats(self):
+        return {"in_flight": len(self.flights), "executed": self.executed, "shared": self.shared}
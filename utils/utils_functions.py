@@ -30,3 +30,38 @@ def get_value_from_string(data_dict, key_to_find):
 
     # If the key is not found, return None
     return None
+
+
+# Parse a single-range 'bytes=' Range header against the resource size.
+# Returns (start, end) inclusive, None when the header should be ignored (absent, malformed or
+# multi-range -- serve the full body) and False when the range can't be satisfied (416).
+def parse_range_header(header, size):
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[len("bytes="):].strip().partition("-")
+    try:
+        if first == "":
+            # Suffix range: last N bytes
+            length = int(last)
+            if length <= 0:
+                return False
+            return max(size - length, 0), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        return False
+    if start > end:
+        return None
+    return start, min(end, size - 1)
+
+
+# If-Range check: the Range header is honoured only if the validator still matches
+def if_range_matches(if_range, etag, last_modified):
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith("W/"):
+        return if_range == etag
+    return if_range == last_modified